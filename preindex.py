@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*- 
+
+# Background pre-indexer, started by XBMC as the addon service: while XBMC
+# runs, the subtitle of each file played is indexed in a worker thread so the
+# SubSeek dialog opens on an already built archive.
+
+import sys
+import os
+import xbmc
+import xbmcaddon
+
+__settings__   = xbmcaddon.Addon(id='script.subseek')
+__cwd__        = __settings__.getAddonInfo('path')
+__scriptname__ = "SubSeek"
+
+BASE_RESOURCE_PATH = xbmc.translatePath( os.path.join( __cwd__, 'resources', 'lib' ) )
+sys.path.append (BASE_RESOURCE_PATH)
+
+if ( __name__ == "__main__" ):
+	import subindex
+	subindex.service()
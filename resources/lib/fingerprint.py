@@ -0,0 +1,90 @@
+
+"""
+Subtitle file fingerprints.
+
+A fingerprint is a pair (signature, digest).  The signature is cheap to
+compute from the file size, modification time and the first and last
+few KB of the file; the digest is an md5 of the whole file read in fixed
+size chunks.  When the signature matches a stored one the stored digest
+is reused without reading the whole file.
+"""
+
+import os
+
+try:
+    import hashlib
+    newHash = hashlib.md5
+except ImportError:
+    try:
+        import md5
+        newHash = md5.new
+    except ImportError:
+        # no C implementation available: fall back to pure python
+        import md5py
+        newHash = md5py.md5
+
+BUFFERSIZE = 65536
+EDGESIZE = 4096
+
+def fileDigest(filename, bufferSize=BUFFERSIZE):
+    "md5 hex digest of the whole file, read in fixed size chunks"
+    m = newHash()
+    f = open(filename, "rb")
+    try:
+        while 1:
+            data = f.read(bufferSize)
+            if not data:
+                break
+            m.update(data)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+def statSignature(filename, edgeSize=EDGESIZE):
+    "cheap signature from (size, mtime, first/last edgeSize bytes)"
+    st = os.stat(filename)
+    size = st.st_size
+    m = newHash()
+    f = open(filename, "rb")
+    try:
+        m.update(f.read(edgeSize))
+        if size>edgeSize:
+            f.seek(max(edgeSize, size-edgeSize))
+            m.update(f.read(edgeSize))
+    finally:
+        f.close()
+    return "%s:%s:%s" % (size, int(st.st_mtime), m.hexdigest())
+
+def fingerprint(filename, stored=None):
+    """return (signature, digest) for filename, reusing the digest from
+       stored (signature, digest) if the signature has not changed"""
+    signature = statSignature(filename)
+    if stored is not None:
+        (storedSignature, storedDigest) = stored
+        if storedSignature==signature and storedDigest:
+            return (signature, storedDigest)
+    return (signature, fileDigest(filename))
+
+def test(filename=None):
+    import time
+    if filename is None:
+        filename = __file__
+    now = time.time()
+    (signature, digest) = fingerprint(filename)
+    print "fingerprint", signature, digest, time.time()-now
+    now = time.time()
+    again = fingerprint(filename, (signature, "cached"))
+    print "precheck", again, time.time()-now
+    assert again==(signature, "cached")
+    assert fingerprint(filename, ("other", "cached"))==(signature, digest)
+    import md5py
+    m = md5py.md5()
+    m.update(open(filename, "rb").read())
+    assert m.hexdigest()==digest
+
+if __name__=="__main__":
+    import sys
+    if len(sys.argv)>1:
+        test(sys.argv[1])
+    else:
+        test()
@@ -11,10 +11,9 @@ import xbmcgui
 import xbmcplugin
 import unicodedata
 
-import md5py
+import subindex
 import datetime
 import shutil
-import uuid
 
 import math
 
@@ -232,12 +231,9 @@ class GUI( xbmcgui.WindowXMLDialog ):
 #### ---------------------------- On Init ----------------------------###
 
   def onInit( self ):
-    filename = os.path.join(os.path.split(xbmc.Player().getPlayingFile())[0], xbmc.Player().getSubtitles())
-		
-    if not os.path.exists(filename):
-      filename = os.path.join("special://temp", xbmc.Player().getSubtitles())
+    filename = subindex.subtitleFile()
 
-    if not os.path.exists(filename):
+    if filename is None or not os.path.exists(filename):
       xbmc.log(__scriptname__ + ": cannot find subtitle file!", xbmc.LOGERROR)
       dialog = xbmcgui.Dialog()
       dialog.ok('SubSeek', 'Sorry, the subtitle file could not be found...')
@@ -253,64 +249,41 @@ class GUI( xbmcgui.WindowXMLDialog ):
 
     xbmc.log(__scriptname__ + ": Subtitle file: " + filename, xbmc.LOGDEBUG)
 
-    hashmatch = False
     pDialog = xbmcgui.DialogProgress()
     pDialog.create('SubSeek', 'Hashing subtitle file...')
     pDialog.update(0)
-    f = open(filename, 'r')
-    m = md5py.md5()
-    for line in f:
-    	m.update(line)
-    hash = m.hexdigest()
-    f.close()
+    cache = subindex.openCache()
+    (signature, hash) = cache.fingerprint(filename)
     xbmc.log(__scriptname__ + ": Subtitle hash is "+hash, xbmc.LOGDEBUG)
 
-    if os.path.exists(os.path.join("special://temp","subseek-indexdir","hash.txt")):
-      f = open(os.path.join('special://temp', 'subseek-indexdir',"hash.txt"), 'r')
-      if f.readline() == hash:
-        hashmatch = True
-        xbmc.log(__scriptname__ + ": Subtitle hash matches stored database, reusing archive", xbmc.LOGDEBUG)
-      else:
-        xbmc.log(__scriptname__ + ": Subtitle hash does not match stored database, building new database", xbmc.LOGDEBUG)
-      f.close()
-      
-    if not hashmatch:
-      shutil.rmtree(os.path.join("special://temp","subseek-indexdir"))
-      os.mkdir(os.path.join("special://temp","subseek-indexdir"))
-
-      self.archive = Nucular.Nucular(os.path.join("special://temp","subseek-indexdir"))
-    
-      (self.archive).create()
-
-      pDialog = xbmcgui.DialogProgress()
-
-      pDialog.create('SubSeek', 'Opening Subtitle File...')
-      pDialog.update(0)
-
-      subs = SubRipFile.open(filename, encoding='iso-8859-1')
-
-      pDialog.create('SubSeek', 'Populating Database...')
-      pDialog.update(0)
-	
-      for i in range(len(subs)):
-        sub = subs[i]
-        D = {   "content": sub.text.replace("\n", " ").replace("<i>", "[I]").replace("</i>", "[/I]"),
-                "start": str(datetime.datetime(1,1,1,
-                        sub.start.hours,
-                        sub.start.minutes,
-                        sub.start.seconds,
-                        sub.start.milliseconds*1000)).split()[1]}
-        (self.archive).indexDictionary(str(uuid.uuid4()), D)
-        pDialog.update(int(math.floor(100*i/len(subs))))
-
-      pDialog.update(100, 'Storing Database...')      
-      (self.archive).store(lazy=False)
-      
-      f = open(os.path.join('special://temp', 'subseek-indexdir',"hash.txt"), "w")
-      f.write(hash)
-      f.close()
+    status = subindex.buildingStatus(hash)
+    if status is not None:
+      xbmc.log(__scriptname__ + ": Subtitle is being pre-indexed, waiting", xbmc.LOGDEBUG)
+      pDialog.create('SubSeek', status.get("message", ""))
+      while status is not None:
+        pDialog.update(status.get("progress") or 0, status.get("message", ""))
+        xbmc.sleep(250)
+        status = subindex.buildingStatus(hash)
+      cache.reload()
+
+    if cache.has(hash):
+      xbmc.log(__scriptname__ + ": Subtitle hash matches cached database, reusing archive", xbmc.LOGDEBUG)
     else:
-      (self.archive) = Nucular.Nucular(os.path.join("special://temp","subseek-indexdir"), readOnly=True)
+      xbmc.log(__scriptname__ + ": Subtitle hash not in cache, building new database", xbmc.LOGDEBUG)
+
+    def progress(percent, message):
+      if message is None:
+        pDialog.update(percent)
+      else:
+        pDialog.update(percent, message)
+
+    (self.archive) = subindex.build(cache, filename, progress, (signature, hash))
+    # searches reuse the postings and cues read by earlier searches
+    self.session = self.archive.incrementalSession()
+    if __settings__.getSetting("traceQueries") == "true":
+      # profile every search to find the slow ones
+      self.session.traceQueries(os.path.join(subindex.CACHEROOT, subindex.TRACEFILE))
+    self.searchText = ""
     
     pDialog.close()
     pass
@@ -518,31 +491,57 @@ class GUI( xbmcgui.WindowXMLDialog ):
 
 ###-------------------------- Click  -------------################
 
+  def numberSetting( self, id, default ):
+    # settings are stored as text; fall back to the default on bad input
+    value = __settings__.getSetting(id)
+    if not value:
+      return default
+    try:
+      return float(value)
+    except ValueError:
+      xbmc.log(__scriptname__ + ": ignoring non-numeric setting " + id, xbmc.LOGWARNING)
+      return default
+
   def onClick( self, controlId ):
     if controlId == 100:
-      kb = xbmc.Keyboard("", "Search", False)
+      kb = xbmc.Keyboard(self.searchText, "Search", False)
       kb.doModal()
       if(kb.isConfirmed()):
         text = kb.getText()
+        self.searchText = text
         xbmc.log(__scriptname__ + ": searching for '" + text +"'", xbmc.LOGDEBUG)
         self.getControl(controlId).setLabel(text)
         pDialog = xbmcgui.DialogProgress()
         pDialog.create('SubSeek', 'Searching Database...')
         pDialog.update(0)
-        query = (self.archive).Query()
-        query.attributeWord("content", text)
-        hits = query.resultDictionaries()
-        listItems = []
-        for hit in hits:
-          listItems.append(xbmcgui.ListItem(hit['content'], hit['start'].split(".")[0]))
-        self.getControl(120).addItems(listItems)
-        pDialog.close()
+        try:
+          window = None
+          near = None
+          minutes = self.numberSetting("searchWindow", 0)
+          if xbmc.Player().isPlaying():
+            # rank cues close to the playback position higher
+            near = int(xbmc.Player().getTime()*1000)
+            window = subindex.searchWindow(xbmc.Player().getTime(), minutes)
+          hits = subindex.search(self.session, text, window, near, fields=subindex.HITFIELDS)
+          listItems = []
+          for hit in hits:
+            label2 = subindex.formatTime(hit['start'])
+            if hit.get('approximate'):
+              # no exact match: the cue has the words with typos
+              label2 = "~" + label2
+            listItem = xbmcgui.ListItem(hit['content'], label2)
+            listItem.setProperty("start", str(hit['start']))
+            listItems.append(listItem)
+          # replace the hits of the previous search
+          self.getControl(120).reset()
+          self.getControl(120).addItems(listItems)
+        finally:
+          pDialog.close()
 
     elif controlId == 120:
-      time = self.getControl(controlId).getSelectedItem().getLabel2()
-      xbmc.log(__scriptname__ + ": seeking to " + time, xbmc.LOGDEBUG)
-      time = time.split(":")
-      time = int(time[0])*60*60+int(time[1])*60+int(time[2])+float(__settings__.getSetting("seekOffset"))
+      start = int(self.getControl(controlId).getSelectedItem().getProperty("start"))
+      xbmc.log(__scriptname__ + ": seeking to " + subindex.formatTime(start), xbmc.LOGDEBUG)
+      time = start/1000.0+self.numberSetting("seekOffset", -1)
       xbmc.Player().seekTime(time)
       if __settings__.getSetting("disableSubDisplay"):
         xbmc.Player().disableSubtitles()
@@ -0,0 +1,263 @@
+
+"""
+Cache of Nucular subtitle archives keyed by subtitle fingerprint.
+
+Each archive lives in its own directory (or, for in memory archives,
+snapshot file) under the cache root, named by the digest of the subtitle
+file it indexes.  A manifest in the root
+records for each digest the stat signature, the source file, the last
+use time and the size on disk; the least recently used archives are
+evicted when the cache holds too many bytes or entries.
+"""
+
+import os
+import time
+import shutil
+import marshal
+
+import fingerprint
+from nucular import Nucular
+
+MANIFEST = "manifest.dat"
+BUILDSUFFIX = ".building"
+SNAPSHOTSUFFIX = ".snapshot"
+MAXBYTES = 50*1024*1024
+MAXENTRIES = 20
+BUILDSTALE = 600 # seconds without a write before a build (of another process) is presumed dead
+
+def directorySize(directory):
+    "total bytes of files under directory"
+    result = 0
+    for (root, dirs, files) in os.walk(directory):
+        for name in files:
+            try:
+                result += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return result
+
+def lastModified(path):
+    "newest modification time of path or the files under it"
+    result = os.path.getmtime(path)
+    for (root, dirs, files) in os.walk(path):
+        for name in files:
+            try:
+                result = max(result, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return result
+
+def removePath(path):
+    "remove an archive directory or snapshot file if present"
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class IndexCache:
+    """one read-only Nucular archive per subtitle fingerprint, LRU evicted.
+       Archives built with a different version are rebuilt."""
+
+    def __init__(self, root, maxBytes=MAXBYTES, maxEntries=MAXENTRIES, version=None):
+        self.root = root
+        self.version = version
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.manifestPath = os.path.join(root, MANIFEST)
+        self.entries = self.readManifest()
+
+    def reload(self):
+        "pick up archives built by another process since the manifest was read"
+        self.entries = self.readManifest()
+
+    def readManifest(self):
+        "digest --> {signature, source, used, bytes, version} from the manifest file"
+        if not os.path.exists(self.manifestPath):
+            return {}
+        f = open(self.manifestPath, "rb")
+        try:
+            try:
+                result = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                # damaged manifest: start over, orphans are removed by evict
+                result = {}
+        finally:
+            f.close()
+        if type(result) is not type({}):
+            result = {}
+        return result
+
+    def writeManifest(self):
+        "write the manifest atomically"
+        tempPath = self.manifestPath+".tmp"
+        f = open(tempPath, "wb")
+        try:
+            marshal.dump(self.entries, f)
+        finally:
+            f.close()
+        try:
+            os.rename(tempPath, self.manifestPath)
+        except OSError:
+            # windows won't rename over an existing file
+            os.remove(self.manifestPath)
+            os.rename(tempPath, self.manifestPath)
+
+    def directory(self, digest):
+        "path of the archive directory or snapshot file for digest"
+        info = self.entries.get(digest, {})
+        return os.path.join(self.root, info.get("name", digest))
+
+    def fingerprint(self, filename):
+        "(signature, digest) for filename, reusing a stored digest if unchanged"
+        stored = None
+        for (digest, info) in self.entries.items():
+            if info.get("source")==filename:
+                stored = (info.get("signature"), digest)
+                break
+        return fingerprint.fingerprint(filename, stored)
+
+    def has(self, digest):
+        "test whether a completed archive in the current format exists for digest"
+        info = self.entries.get(digest)
+        if info is None or info.get("version")!=self.version:
+            return False
+        return os.path.exists(self.directory(digest))
+
+    def touch(self, digest):
+        info = self.entries[digest]
+        info["used"] = time.time()
+        self.writeManifest()
+
+    def open(self, digest):
+        "open the cached archive for digest read only"
+        if not self.has(digest):
+            raise KeyError, "no cached archive for "+repr(digest)
+        self.touch(digest)
+        return Nucular.Nucular(self.directory(digest), readOnly=True)
+
+    def build(self, digest, signature, source, populate, memory=False):
+        """build a new archive for digest: populate(archive) should index
+           the entries, the archive is stored and added to the cache.
+           If memory is set the archive is a single snapshot file."""
+        name = digest
+        if memory:
+            name = digest+SNAPSHOTSUFFIX
+        final = os.path.join(self.root, name)
+        building = final+BUILDSUFFIX
+        removePath(building)
+        archive = Nucular.Nucular(building, memory=memory)
+        archive.create()
+        populate(archive)
+        archive.store(lazy=False)
+        archive.cleanUp(complete=True)
+        removePath(final)
+        os.rename(building, final)
+        self.entries[digest] = {
+            "name": name,
+            "signature": signature,
+            "source": source,
+            "used": time.time(),
+            "bytes": directorySize(final),
+            "version": self.version,
+            }
+        self.evict(keep=digest)
+        return Nucular.Nucular(final, readOnly=True)
+
+    def totalBytes(self):
+        result = 0
+        for info in self.entries.values():
+            result += info.get("bytes", 0)
+        return result
+
+    def evict(self, keep=None):
+        "remove least recently used archives beyond the byte and entry limits"
+        # forget entries whose directory has gone away
+        for digest in self.entries.keys():
+            if not os.path.exists(self.directory(digest)):
+                del self.entries[digest]
+        byAge = [ (info.get("used", 0), digest) for (digest, info) in self.entries.items() ]
+        byAge.sort()
+        total = self.totalBytes()
+        count = len(byAge)
+        for (used, digest) in byAge:
+            if total<=self.maxBytes and count<=self.maxEntries:
+                break
+            if digest==keep:
+                continue
+            total -= self.entries[digest].get("bytes", 0)
+            count -= 1
+            removePath(self.directory(digest))
+            del self.entries[digest]
+        # remove archives not in the manifest (eg, interrupted builds)
+        names = {}
+        for digest in self.entries:
+            names[os.path.basename(self.directory(digest))] = digest
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if names.has_key(name):
+                continue
+            if name.endswith(BUILDSUFFIX) and now-lastModified(path)<=BUILDSTALE:
+                continue # a build in progress, maybe in another process
+            if os.path.isdir(path) or name.endswith(SNAPSHOTSUFFIX) or name.endswith(SNAPSHOTSUFFIX+BUILDSUFFIX):
+                removePath(path)
+        self.writeManifest()
+
+def test(root="/tmp/indexcachetest"):
+    import tempfile
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    cache = IndexCache(root, maxEntries=2)
+    sources = []
+    for i in range(3):
+        (fd, path) = tempfile.mkstemp(".srt")
+        os.write(fd, "subtitle file number %s\n" % i)
+        os.close(fd)
+        sources.append(path)
+    def populator(i):
+        def populate(archive):
+            archive.indexDictionary("cue%s" % i, {"content": "hello number %s" % i})
+        return populate
+    digests = []
+    for i in range(3):
+        (signature, digest) = cache.fingerprint(sources[i])
+        assert not cache.has(digest)
+        archive = cache.build(digest, signature, sources[i], populator(i), memory=(i==2))
+        query = archive.Query()
+        query.attributeWord("content", "hello")
+        assert len(query.resultDictionaries())==1
+        digests.append(digest)
+    # the oldest archive was evicted
+    assert not cache.has(digests[0])
+    # builds in progress are left alone until they go stale
+    building = os.path.join(root, "other"+BUILDSUFFIX)
+    os.makedirs(os.path.join(building, "Description"))
+    cache.evict()
+    assert os.path.isdir(building)
+    old = time.time()-BUILDSTALE-10
+    os.utime(os.path.join(building, "Description"), (old, old))
+    os.utime(building, (old, old))
+    cache.evict()
+    assert not os.path.exists(building)
+    # a second cache sees the archives built through the first after reloading
+    other = IndexCache(root, maxEntries=2)
+    (signature, rebuilt) = cache.fingerprint(sources[0])
+    cache.build(rebuilt, signature, sources[0], populator(0))
+    assert not other.has(rebuilt)
+    other.reload()
+    assert other.has(rebuilt) and not other.has(digests[1])
+    cache = IndexCache(root, maxEntries=2)
+    for digest in [rebuilt, digests[2]]:
+        assert cache.has(digest)
+        cache.open(digest)
+    assert cache.fingerprint(sources[2])[1]==digests[2]
+    assert cache.open(digests[2]).memory and os.path.isfile(cache.directory(digests[2]))
+    for path in sources:
+        os.remove(path)
+    shutil.rmtree(root)
+    print "indexcache test ok"
+
+if __name__=="__main__":
+    test()
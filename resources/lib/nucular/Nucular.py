@@ -12,7 +12,12 @@ import entry
 import os
 import parameters
 import specialValues
-from frames import fltree
+import ranking
+import termDictionary
+import queryProfile
+import heapq
+from idSet import IdSet, asIdSet
+from frames import fltree, fmemory, frameGenerators
 
 OVERFLOWSTATUS = "overflow"
 COMPLETESTATUS = "complete"
@@ -28,6 +33,12 @@ ATTTRANSLATE = "A"
 FREETEXTONLY = "F"
 COUNTERVALUE = "C"
 AUTOCLEAN = "CL"
+POSITIONAL = "P"
+TRIGRAMS = "T"
+TOKENIZER = "K"
+RESULTCACHESIZE = 32 # evaluated queries remembered per session
+MINSWEEP = 4 # fewer ids than this are described one at a time
+DESCRIBEBATCH = 100 # ids described together while testing remaining filters
 
 class Nucular:
     """session interface for interacting with an archive"""
@@ -45,10 +56,20 @@ class Nucular:
 
     # set this to supress indexing by attribute/word and attribute/value
     _freeTextOnly = False
+    _positional = False # set to record word positions in attribute word postings
+    _trigrams = False # set to keep a trigram index of the words for fuzzy search
+    traceFile = None # set to a file name to append the profile of every query evaluation to it
+    describeCount = 0 # entries described by this session
     
-    def __init__(self, directory, sessionId=None, threaded=False, splitter=entry.parseWords, readOnly=False):
+    def __init__(self, directory, sessionId=None, threaded=False, splitter=entry.parseWords, readOnly=False, memory=None):
+        """open the archive in directory.  If memory is set (or directory is a
+           memory snapshot file) the indices are held in memory and store()
+           saves them to the snapshot file directory (if not None)."""
         #pr "using ltree implementation", fltree
         self.readOnly = readOnly
+        if memory is None:
+            memory = directory is not None and fmemory.isSnapshot(directory)
+        self.memory = memory
         if sessionId is None:
             sessionId = fltree.newSessionName()
         self.sessionId = sessionId
@@ -61,6 +82,7 @@ class Nucular:
         self.URLTranslations = {}
         self.AttributeTranslations = {"i": "i"}
         self.AttributeUntranslations = {}
+        self.resultCache = ResultCache()
         self.initializeFromSystemIndex()
 
     def nextAbbreviation(self):
@@ -108,6 +130,12 @@ class Nucular:
                 self.abbreviationCounter = value
             elif opcode==AUTOCLEAN:
                 self._autoClean = value
+            elif opcode==POSITIONAL:
+                self._positional = value
+            elif opcode==TRIGRAMS:
+                self._trigrams = value
+            elif opcode==TOKENIZER:
+                self.splitter = entry.TokenizerFromConfig(value)
             else:
                 raise ValueError, "encountered unknown opcode in system index"
             kv = index.nextKeyValueAfter(key)
@@ -123,6 +151,23 @@ class Nucular:
         self._freeTextOnly = value
         self.System.put( (FREETEXTONLY, None), value )
 
+    def positionalIndexing(self, value=True):
+        "set to record word positions for phrase search, archive should be empty!"
+        self._positional = value
+        self.System.put( (POSITIONAL, None), value )
+
+    def trigramIndexing(self, value=True):
+        "set to keep a trigram index of the words for fuzzy search, archive should be empty!"
+        self._trigrams = value
+        self.System.put( (TRIGRAMS, None), value )
+        if value and not self.Trigram.exists():
+            self.Trigram.createBaseIndex()
+
+    def useTokenizer(self, tokenizer):
+        "split words for indexing and queries with an entry.Tokenizer (recorded in the archive), archive should be empty!"
+        self.splitter = tokenizer
+        self.System.put( (TOKENIZER, None), tokenizer.config() )
+
     def addURLTranslation(self, fromPrefix, toPrefix):
         "for example 'http://my.domain.edu/~me' translates to 'file://usr/home/me/htdocs', archive should be empty!"
         self.URLTranslations[fromPrefix] = toPrefix
@@ -253,6 +298,8 @@ class Nucular:
     
     def initializeIndices(self):
         "set up index structures"
+        if self.memory:
+            return self.initializeMemoryIndices()
         directory = self.directory
         sid = self.sessionId
         ro = self.readOnly
@@ -262,11 +309,46 @@ class Nucular:
         self.Log = NucularIndex("Log", "ti", "", directory, sid, ro)
         self.AttrIndex = NucularIndex("AttrIndex", "avi", "t", directory, sid, ro)
         #self.ValueLog = NucularIndex("ValueLog", "tiav", "", directory, sid, ro)
-        self.AttrWord = NucularIndex("AttrWord", "awi", "t", directory, sid, ro)
-        self.WordIndex = NucularIndex("WordIndex", "wi", "t", directory, sid, ro)
+        self.AttrWord = NucularIndex("AttrWord", "awi", "t", directory, sid, ro, terms=True)
+        self.WordIndex = NucularIndex("WordIndex", "wi", "t", directory, sid, ro, terms=True)
+        self.Trigram = NucularIndex("Trigram", "gw", "t", directory, sid, ro)
         # WordLog? tiaw->""
         # AttrGroup? aiv->t
         
+    def initializeMemoryIndices(self):
+        "set up in memory index structures, loading the snapshot if present"
+        directory = self.directory
+        archives = {}
+        if directory is not None and os.path.isfile(directory):
+            archives = fmemory.loadSnapshot(directory)
+        sid = self.sessionId
+        ro = self.readOnly
+        for (name, argumentsOrder, valuesOrder) in [
+            ("System", "od", "v"),
+            ("Description", "iav", "t"),
+            ("Log", "ti", ""),
+            ("AttrIndex", "avi", "t"),
+            ("AttrWord", "awi", "t"),
+            ("WordIndex", "wi", "t"),
+            ("Trigram", "gw", "t"),
+            ]:
+            archive = archives.get(name)
+            if archive is None:
+                archive = fmemory.MemoryArchive()
+            ind = MemoryNucularIndex(name, argumentsOrder, valuesOrder, archive, sid, ro)
+            setattr(self, name, ind)
+
+    def saveSnapshot(self, filename=None):
+        "save an in memory archive to a single snapshot file"
+        if not self.memory:
+            raise ValueError, "only in memory archives have snapshots"
+        if filename is None:
+            filename = self.directory
+        archives = {}
+        for ind in self.indexList():
+            archives[ind.name] = ind.getArchive()
+        fmemory.saveSnapshot(filename, archives)
+
     def loadReport(self):
         "for debug: show how many entries have been loaded into each index"
         print "VERBOSE: load report", self.directory
@@ -301,6 +383,17 @@ class Nucular:
         test = pfilter.AttributeRangeTest(attr, low, high)
         return pfilter.Filter(query, test)
     
+    def TimeWindowFilter(self, attr, low, high):
+        "select entries where numeric attribute lies in low..high inclusive"
+        attr1 = self.AttributeTranslations.get(attr, attr)
+        index = self.AttrIndex.getExistingBaseIndex()
+        # numbers sort before strings and ordered by value in the attribute index
+        tupleLow = (attr1, low)
+        tupleHigh = (attr1, high+1)
+        query = pquery.Range(index, tupleLow, tupleHigh)
+        test = pfilter.TimeWindowTest(attr, low, high)
+        return pfilter.Filter(query, test)
+
     def AttributeWordFilter(self, attr, word, splitter=None):
         "select entries where attribute contains word"
         attr1 = self.AttributeTranslations.get(attr, attr)
@@ -311,10 +404,51 @@ class Nucular:
         word = word.lower()
         index = self.AttrWord.getExistingBaseIndex()
         tup = (attr1, word)
-        query = pquery.PrefixTuple(index, tup)
+        query = pquery.PrefixTuple(index, tup, self.AttrWord.termDictionary())
         test = pfilter.AttributeWordPrefixTest(attr, word, splitter)
         return pfilter.Filter(query, test)
     
+    def PhraseFilter(self, attr, words, splitter=None):
+        "select entries where attribute contains the words consecutively (needs positional indexing)"
+        attr1 = self.AttributeTranslations.get(attr, attr)
+        if self._freeTextOnly:
+            raise ValueError, "attribute indexing is disabled"
+        if not self._positional:
+            raise ValueError, "phrase search requires positional indexing"
+        if splitter is None:
+            splitter = self.splitter
+        words = tuple([ w.lower() for w in words ])
+        index = self.AttrWord.getExistingBaseIndex()
+        terms = self.AttrWord.termDictionary()
+        minlength = entry.Entry.MINWORDLENGTH
+        queries = []
+        for offset in xrange(len(words)):
+            w = words[offset]
+            # short words are not indexed: they match any word at their position
+            if len(w)>minlength:
+                queries.append( (offset, pquery.PrefixTuple(index, (attr1, w), terms)) )
+        test = pfilter.PhraseTest(attr, words, splitter)
+        return pfilter.PhraseFilter(queries, test)
+
+    def FuzzyWordFilter(self, word, maxEdits=1, attr=None, splitter=None):
+        "select entries containing a word within maxEdits edits of word (in attr if given; needs trigram indexing)"
+        if not self._trigrams:
+            raise ValueError, "fuzzy search requires trigram indexing"
+        if splitter is None:
+            splitter = self.splitter
+        word = word.lower()
+        gramIndex = self.Trigram.getExistingBaseIndex()
+        if attr is None:
+            index = self.WordIndex.getExistingBaseIndex()
+            prefix = ()
+        else:
+            if self._freeTextOnly:
+                raise ValueError, "attribute indexing is disabled"
+            index = self.AttrWord.getExistingBaseIndex()
+            prefix = (self.AttributeTranslations.get(attr, attr),)
+        test = pfilter.FuzzyWordTest(attr, word, maxEdits, splitter)
+        return pfilter.FuzzyFilter(gramIndex, index, prefix, word, maxEdits, test)
+
     def WordFilter(self, word, splitter=None):
         "select entries containing word"
         if splitter is None:
@@ -322,7 +456,7 @@ class Nucular:
         word = word.lower()
         index = self.WordIndex.getExistingBaseIndex()
         tup = (word,)
-        query = pquery.PrefixTuple(index, tup)
+        query = pquery.PrefixTuple(index, tup, self.WordIndex.termDictionary())
         test = pfilter.WordPrefixTest(word, splitter)
         return pfilter.Filter(query, test)
 
@@ -330,21 +464,56 @@ class Nucular:
         "select entries containing proximate words"
         if splitter is None:
             splitter = self.splitter
-        # no index used, no "query", just a test
+        index = self.WordIndex.getExistingBaseIndex()
+        terms = self.WordIndex.termDictionary()
+        # candidates have all the words: just those are described and tested
+        queries = [ pquery.PrefixTuple(index, (w.lower(),), terms) for w in words ]
         test = pfilter.ProximateTest(words, nearLimit, splitter)
-        return pfilter.Filter(None, test)
+        return pfilter.ProximateFilter(queries, test, self.describeMany)
     
+    def entryCount(self):
+        "number of entries with words if the word index keeps statistics, else an estimate"
+        terms = self.WordIndex.termDictionary()
+        if terms is not None:
+            return terms.documents
+        # one log key per entry
+        return self.Log.getExistingBaseIndex().estimateCount(None, None)
+
+    def archiveVersion(self):
+        "changes whenever the contents seen by this session may have changed"
+        return tuple([ ind.generation for ind in self.indexList() ])
+
+    def cacheHits(self):
+        "number of cache hits so far (for query profiles)"
+        return self.resultCache.hits
+
+    def traceQueries(self, filename):
+        "append the profile of every query evaluation to the file filename (None to stop)"
+        self.traceFile = filename
+
     def indexList(self):
         "for use with common operations: provide subindices in a sequence."
-        return [self.Description, self.AttrIndex, self.Log, self.AttrWord, self.WordIndex, self.System]
+        result = [self.Description, self.AttrIndex, self.Log, self.AttrWord, self.WordIndex, self.System]
+        # archives created before trigram indexing was added have no trigram index
+        if self.Trigram.exists():
+            result.append(self.Trigram)
+        return result
         
     def create(self):
         "create a new archive, die if exists"
+        if self.memory:
+            if self.directory is not None and os.path.exists(self.directory):
+                raise ValueError, "cannot create in memory archive over existing file "+repr(self.directory)
+            for ind in self.indexList():
+                ind.createBaseIndex()
+            return
         if not os.path.exists(self.directory):
             os.mkdir(self.directory)
         if os.listdir(self.directory):
             raise ValueError, "cannot create archive in non-empty directory -- please delete all files and try again "+repr(self.directory)
         iList = self.indexList()
+        if self._trigrams and self.Trigram not in iList:
+            iList.append(self.Trigram)
         for ind in iList:
             ind.createBaseIndex()
             
@@ -365,28 +534,114 @@ class Nucular:
         E = entry.Entry(identity, D)
         self.index(E)
         
+    def indexBatch(self, pairs, fresh=None):
+        """
+        index a sequence of (identity, dictionary) pairs (no duplicates) in one pass.
+        Each sub-index is written once.  If the archive is freshly created
+        (fresh=None detects this) the sub-indices are written directly as sorted
+        base trees, skipping the undecided/recent/transient layers.
+        Returns the number of entries indexed.
+        """
+        if self.readOnly:
+            raise ValueError, "cannot modify archive via read only session"
+        timestamp = time.time()
+        logDict = {}
+        descrIndexDict = {}
+        attrIndexDict = {}
+        AttrWordDict = {}
+        freeWordsDict = {}
+        dicts = (descrIndexDict, attrIndexDict, AttrWordDict, freeWordsDict)
+        count = 0
+        for (identity, dictionary) in pairs:
+            D = {}
+            for k in dictionary:
+                D[k] = [ dictionary[k] ]
+            E = entry.Entry(identity, D)
+            logDict[ (timestamp, identity) ] = ()
+            self.indexDictionaries(E, dicts)
+            count += 1
+        loads = [ (self.Log, logDict), (self.Description, descrIndexDict),
+                  (self.AttrIndex, attrIndexDict), (self.AttrWord, AttrWordDict),
+                  (self.WordIndex, freeWordsDict) ]
+        if self._trigrams:
+            loads.append( (self.Trigram, self.trigramDictionary(freeWordsDict)) )
+        if fresh is None:
+            fresh = True
+            for (ind, D) in loads:
+                if not ind.isEmpty():
+                    fresh = False
+                    break
+        for (ind, D) in loads:
+            if not D:
+                continue
+            if fresh:
+                ind.loadBase(D)
+            else:
+                ind.putDictionary(D)
+        return count
+
     def index(self, entry, delete=False, test=False):
         "index the entry"
-        stypes = types.StringTypes
         #pr ; pr "INDEXING", (entry,delete,test)
-        SV = specialValues.SpecialValue
-        _freeTextOnly = self._freeTextOnly
         if self.readOnly:
             raise ValueError, "cannot modify archive via read only session"
         # XXXX should check whether identity is present already?
         # "indexing", entry
-        truncation = self.valueTruncation
         identity = entry.identity()
         timestamp = time.time()
+        #self.Identities.put( (identity,), (attrDict, timestamp), delete ) # tupling key for consistency ????
+        self.Log.put( (timestamp, identity), (), delete )
+        dicts = ({}, {}, {}, {})
+        self.indexDictionaries(entry, dicts)
+        (descrIndexDict, attrIndexDict, AttrWordDict, freeWordsDict) = dicts
+        if self._trigrams and not delete and not test:
+            # the trigram index covers the vocabulary: words are never removed from it
+            self.Trigram.putDictionary(self.trigramDictionary(freeWordsDict))
+        if not test:
+            #pr "BEFORE loading"
+            #pr "  ",self.Description
+            #pr "  ",self.AttrIndex
+            #pr "  ",self.AttrWord
+            #pr "  ",self.WordIndex
+            self.Description.putDictionary(descrIndexDict, delete)
+            self.AttrIndex.putDictionary(attrIndexDict, delete)
+            self.AttrWord.putDictionary(AttrWordDict, delete)
+            self.WordIndex.putDictionary(freeWordsDict, delete)
+            if delete:
+                self.Description.removeKeysWithPrefix( (identity,) ) # should be redundant modulo floating point
+            #pr "AFTER loading"
+            #pr "  ",self.Description
+            #pr "  ",self.AttrIndex
+            #pr "  ",self.AttrWord
+            #pr "  ",self.WordIndex
+            return None
+        else:
+            return dicts
+
+    def trigramDictionary(self, freeWordsDict):
+        "(trigram, word) --> t index entries for the words of free word postings (word, id) --> t"
+        result = {}
+        words = {}
+        for (w, identity) in freeWordsDict:
+            words[w] = 1
+        for w in words:
+            for g in entry.trigrams(w):
+                result[ (g, w) ] = True
+        return result
+
+    def indexDictionaries(self, entry, dicts):
+        "add the index keys for entry to dicts=(descrIndexDict, attrIndexDict, AttrWordDict, freeWordsDict)"
+        stypes = types.StringTypes
+        SV = specialValues.SpecialValue
+        _freeTextOnly = self._freeTextOnly
+        truncation = self.valueTruncation
+        identity = entry.identity()
         timestamp1 = True # for now...
         attrDict = entry.attrDict(indexable=True)
         attrDict = self.translateDict(attrDict)
         vDict = entry.attrDict(indexable=False)
         vDict = self.translateDict(vDict)
-        #self.Identities.put( (identity,), (attrDict, timestamp), delete ) # tupling key for consistency ????
-        self.Log.put( (timestamp, identity), (), delete )
-        attrIndexDict = {}
-        descrIndexDict = {}
+        (descrIndexDict, attrIndexDict, AttrWordDict, freeWordsDict) = dicts
         for att in attrDict: #attrDict.keys():
             if not _freeTextOnly:
                 # attribute prefix indexing
@@ -423,36 +678,22 @@ class Nucular:
             if not _freeTextOnly:
                 attrIndexDict[ (att, val, identity) ] = timestamp1
             descrIndexDict[ (identity, att, val) ] = timestamp1
-        (freeWords, attributeWords) = entry.wordStats(self.AttributeTranslations)
-        freeWordsDict = {}
+        (freeWords, attributeWords) = entry.wordStats(self.AttributeTranslations, self.splitter)
         for w in freeWords: #freeWords.keys():
             freeWordsDict[ (w,identity) ] = timestamp1
-        AttrWordDict = {}
-        if not _freeTextOnly:
+        if not _freeTextOnly and self._positional:
+            # positional postings: (attribute, word, id) --> positions
+            attributePositions = entry.wordPositions(self.AttributeTranslations, self.splitter)
+            for a in attributePositions:
+                aDict = attributePositions[a]
+                for w in aDict:
+                    AttrWordDict[ (a, w, identity) ] = tuple(aDict[w])
+        elif not _freeTextOnly:
             for a in attributeWords: #attributeWords.keys():
                 aDict = attributeWords[a]
                 for w in aDict: #aDict.keys():
                     AttrWordDict[ (a, w, identity) ] = timestamp1
-        if not test:
-            #pr "BEFORE loading"
-            #pr "  ",self.Description
-            #pr "  ",self.AttrIndex
-            #pr "  ",self.AttrWord
-            #pr "  ",self.WordIndex
-            self.Description.putDictionary(descrIndexDict, delete)
-            self.AttrIndex.putDictionary(attrIndexDict, delete)
-            self.AttrWord.putDictionary(AttrWordDict, delete)
-            self.WordIndex.putDictionary(freeWordsDict, delete)
-            if delete:
-                self.Description.removeKeysWithPrefix( (identity,) ) # should be redundant modulo floating point
-            #pr "AFTER loading"
-            #pr "  ",self.Description
-            #pr "  ",self.AttrIndex
-            #pr "  ",self.AttrWord
-            #pr "  ",self.WordIndex
-            return None
-        else:
-            return (descrIndexDict, attrIndexDict, AttrWordDict, freeWordsDict)
+        return dicts
         
     def remove(self, identity):
         "delete an identity from index"
@@ -509,35 +750,79 @@ class Nucular:
                 return True
         return False
         
-    def describe(self, identity):
-        "extract entry description for id (return None if missing)"
-        from types import TupleType
-        descr = {}
+    def describe(self, identity, fields=None):
+        """extract entry description for id (return None if missing).
+           If fields is given only those attributes (and the id) are decoded."""
         index = self.Description.getExistingBaseIndex()
         fromKey = (identity,)
         toKey = (identity, pquery.MAXIMUMOBJECT)
         #D = index.rangeDict(fromKey, toKey)
         (keys, values) = index.rangeLists(fromKey, toKey)
         # "for", identity, "got", D
+        self.describeCount += 1
+        wanted = self.translatedFields(fields)
+        descr = {}
         for k in keys:
-            (idt, att, mval) = k
-            attL = descr.get(att)
-            if attL is None:
-                attL = descr[att] = []
-            if type(mval) is TupleType:
-                # special
-                #pr "*** describing special", val
-                (flagname, text) = mval
-                specialval = self.specialValue(flagname, text)
-                val = specialval
-            else:
-                val = marshal.loads(mval)
-            if val not in attL:
-                attL.append(val)
+            if wanted is None or wanted.has_key(k[1]):
+                self.describeKey(k, descr)
         descr = self.untranslateDict(descr)
         result = entry.Entry(identity, descr)
         return result
 
+    def translatedFields(self, fields):
+        "dictionary of the stored attribute names for the attribute names fields, or None for all"
+        if fields is None:
+            return None
+        translations = self.AttributeTranslations
+        result = {}
+        for f in fields:
+            result[translations.get(f, f)] = 1
+        return result
+
+    def describeKey(self, key, descr):
+        "add the attribute value of a description index key to descr"
+        (idt, att, mval) = key
+        attL = descr.get(att)
+        if attL is None:
+            attL = descr[att] = []
+        if type(mval) is types.TupleType:
+            # special
+            #pr "*** describing special", val
+            (flagname, text) = mval
+            specialval = self.specialValue(flagname, text)
+            val = specialval
+        else:
+            val = marshal.loads(mval)
+        if val not in attL:
+            attL.append(val)
+
+    def describeMany(self, identities, fields=None):
+        """
+        entry descriptions for the sorted list identities, in the same order.
+        Ids close together in the description index are read in one range scan
+        (skipping the entries between them) instead of one descent each.
+        If fields is given only those attributes (and the id) are decoded.
+        """
+        index = self.Description.getExistingBaseIndex()
+        self.describeCount += len(identities)
+        wanted = self.translatedFields(fields)
+        descrs = {}
+        for identity in identities:
+            descrs[identity] = {}
+        for (start, end) in sweepRuns(index, identities, 0, len(identities)):
+            first = identities[start]
+            last = identities[end-1]
+            (keys, values) = index.rangeLists( (first,), (last, pquery.MAXIMUMOBJECT) )
+            for k in keys:
+                descr = descrs.get(k[0])
+                if descr is None:
+                    continue # an entry between the wanted ones
+                if wanted is not None and not wanted.has_key(k[1]):
+                    continue
+                self.describeKey(k, descr)
+        untranslate = self.untranslateDict
+        return [ entry.Entry(identity, untranslate(descrs[identity])) for identity in identities ]
+
     def result(self, queryString):
         import booleanQuery
         result = booleanQuery.booleanResult(queryString, self)
@@ -554,6 +839,12 @@ class Nucular:
     def Query(self):
         "create a query object associated with this archive"
         return NucularQuery(self, threaded=self.threaded)
+
+    def incrementalSession(self, maxRanges=8):
+        """copy of this (read only) session for search as you type: word postings
+           and descriptions are remembered between queries so a growing prefix
+           is narrowed in memory instead of rescanning the index."""
+        return IncrementalNucular(self, maxRanges)
     
     def QueryFromXMLText(self, text):
         "create a query object from xml text"
@@ -594,6 +885,16 @@ class Nucular:
                 if not high:
                     raise ValueError, 'prefix requires high="high value"'
                 Q.attributeRange(n, low, high)
+            elif fldtag=="window":
+                n = fld.attrib.get("n")
+                if not n:
+                    raise ValueError, 'window requires n="attributeName"'
+                try:
+                    low = int(fld.attrib.get("low"))
+                    high = int(fld.attrib.get("high"))
+                except (TypeError, ValueError):
+                    raise ValueError, 'window requires low="INTEGER" high="INTEGER"'
+                Q.timeWindow(n, low, high)
             elif fldtag=="contains":
                 n = fld.attrib.get("n")
                 #if not n:
@@ -605,6 +906,24 @@ class Nucular:
                     Q.attributeWord(n,p)
                 else:
                     Q.anyWord(p)
+            elif fldtag=="phrase":
+                n = fld.attrib.get("n")
+                if not n:
+                    raise ValueError, 'phrase requires n="attributeName"'
+                words = fld.attrib.get("words")
+                if not words:
+                    raise ValueError, 'phrase requires words="WORDS IN ORDER"'
+                Q.attributePhrase(n, words)
+            elif fldtag=="fuzzy":
+                n = fld.attrib.get("n")
+                word = fld.attrib.get("word")
+                if not word:
+                    raise ValueError, 'fuzzy requires word="WORD"'
+                try:
+                    edits = int(fld.attrib.get("edits", 1))
+                except ValueError:
+                    raise ValueError, 'fuzzy requires edits="INTEGER"'
+                Q.fuzzyWord(word, edits, n or None)
             elif fldtag=="match":
                 n = fld.attrib.get("n")
                 if not n:
@@ -639,13 +958,19 @@ class Nucular:
         iList = self.indexList()
         for ind in iList:
             if ind is not System:
+                if ind.changed and ind.hasTerms:
+                    ind.storeTerms()
                 ind.store(lazy)
+        if self.memory and self.directory is not None and not self.readOnly:
+            self.saveSnapshot()
+        self.resultCache.clear()
             
     def discard(self):
         "discard changes"
         iList = self.indexList()
         for ind in iList:
             ind.discard()
+        self.resultCache.clear()
             
     def aggregateRecent(self, dieOnFailure=True, verbose=False, fast=False, target=None):
         "collect recent changes"
@@ -676,12 +1001,15 @@ class Nucular:
             if not test:
                 success = False
                 break
+            if ind.hasTerms:
+                ind.refreshTerms()
         if not work:
             raise ValueError, "no such target found "+repr(target)
         if verbose:
             elapsed = time.time()-now
             print "verbose: nucular.aggregateRecent complete", total, "elapsed", elapsed, "rate", total/elapsed
         policy = None
+        self.resultCache.clear()
         return (success, total)
     
     def moveTransientToBase(self, dieOnFailure=True, verbose=False, target=None):
@@ -704,12 +1032,15 @@ class Nucular:
             if not test:
                 success = False
                 break
+            if ind.hasTerms:
+                ind.refreshTerms()
         if not work:
             raise ValueError, "no such target found "+repr(target)
         if verbose:
             elapsed = time.time()-now
             print "verbose: exiting nucular.moveTransientToBase", total, "elapsed", elapsed, "rate", total/elapsed
         policy = None
+        self.resultCache.clear()
         return (success, total)
     
     def cleanUp(self, complete=False, target=None):
@@ -723,6 +1054,23 @@ class Nucular:
             archive = ind.getArchive()
             archive.cleanUp(complete=complete)
 
+def sweepRuns(index, ids, start, end):
+    """
+    [(start, end)...] runs of the sorted ids[start:end] each worth reading
+    with one range scan of the description index (keyed id+...): a run is
+    swept if it spans fewer keys than the seeks for its ids would cost.
+    """
+    n = end-start
+    if n<=0:
+        return []
+    if n<MINSWEEP:
+        return [ (i, i+1) for i in xrange(start, end) ]
+    span = index.estimateCount( (ids[start],), (ids[end-1], pquery.MAXIMUMOBJECT) )
+    if span<=n*pquery.SEEKCOST:
+        return [ (start, end) ]
+    middle = start+n/2
+    return sweepRuns(index, ids, start, middle)+sweepRuns(index, ids, middle, end)
+
 def flattenMultiDict(md):
     "from key-->{x:y} dict return [ (key,x)... ] list"
     count = 0
@@ -754,6 +1102,9 @@ class NucularQuery:
         # use a dictionary to automatically eliminate dups
         self.filters = {}
         self.log = []
+        self.plan = [] # steps of the last evaluation, see explain
+        self.profile = None # queryProfile.QueryProfile of the last evaluation
+        self.terminatedEarly = False # set if the last evaluation stopped at the time limit
         
     def toXML(self):
         "display query in xml representation"
@@ -771,6 +1122,13 @@ class NucularQuery:
         logdata = "\n".join(self.log)
         return "Query log:\n"+logdata
     
+    def indexed(self):
+        "true iff some filter can be resolved from the indices (else evaluation overflows)"
+        for f in self.filters.values():
+            if f.estimate() is not None:
+                return True
+        return False
+
     def addMiscellaneousFilter(self, filterIdentifier, filter):
         "add an externally defined filter"
         filters = self.filters
@@ -793,6 +1151,11 @@ class NucularQuery:
         f = self.collection.AttributeRangeFilter(attr, low, high)
         self.filters[ ("r",attr,low,high) ] = f
 
+    def timeWindow(self, attr, low, high):
+        "select entries where numeric attr (eg, milliseconds) lies in low..high inclusive"
+        f = self.collection.TimeWindowFilter(attr, low, high)
+        self.filters[ ("w",attr,low,high) ] = f
+
     def proximateWords(self, wordSequence, nearLimit=2):
         "select entries where wordSequence appears in order near eachother in one attribute"
         # normalize the words, just in case
@@ -809,10 +1172,27 @@ class NucularQuery:
             # word sequence of length 1 is an "anyword"
             f = self.collection.ProximateFilter(wordSequence, nearLimit=nearLimit)
             self.filters[ ("x", wordSequence) ] = f
-        # also add attributeWords to make use of indices
+        # also add the words (they narrow the candidates and rank the matches)
         for w in wordSequence:
             self.anyWord(w)
         
+    def attributePhrase(self, attr, phrase):
+        "select entries where the words of phrase appear consecutively in a value for attr"
+        collection = self.collection
+        words = tuple(collection.splitter(phrase))
+        if len(words)<2:
+            return self.attributeWord(attr, phrase)
+        if collection._positional:
+            f = collection.PhraseFilter(attr, words)
+            self.filters[ ("ph",attr,words) ] = f
+        else:
+            # no positions in the index: narrow by indexed words then test the descriptions
+            for w in words:
+                if len(w)>entry.Entry.MINWORDLENGTH:
+                    self.attributeWord(attr, w)
+            f = pfilter.Filter(None, pfilter.PhraseTest(attr, words, collection.splitter))
+            self.filters[ ("ph",attr,words) ] = f
+
     def attributeWord(self, attr, word):
         "select entries which match word as a word prefix in a value for attr"
         words = self.collection.splitter(word)
@@ -820,6 +1200,25 @@ class NucularQuery:
             f = self.collection.AttributeWordFilter(attr, w)
             self.filters[ ("a",attr,w) ] = f
             
+    def fuzzyWord(self, word, maxEdits=1, attr=None):
+        "select entries with words within maxEdits edits of the (indexed, long enough) words of word (in attr if given)"
+        words = self.collection.splitter(word)
+        for w in words:
+            if len(w)<=entry.Entry.MINWORDLENGTH:
+                continue
+            f = self.collection.FuzzyWordFilter(w, maxEdits, attr)
+            self.filters[ ("f",attr,w,maxEdits) ] = f
+
+    def fuzzyPhrase(self, attr, phrase, maxEdits=1):
+        "select entries where the words of phrase, each within maxEdits edits, appear consecutively in attr"
+        splitter = self.collection.splitter
+        words = tuple(splitter(phrase))
+        self.fuzzyWord(phrase, maxEdits, attr)
+        if len(words)>1:
+            # the word filters find the candidates, the test keeps the word order
+            test = pfilter.FuzzyPhraseTest(attr, words, maxEdits, splitter)
+            self.filters[ ("fph",attr,words,maxEdits) ] = pfilter.Filter(None, test)
+
     def anyWord(self, word):
         "select entries which match word as a word-prefix in any attribute"
         words = self.collection.splitter(word)
@@ -827,12 +1226,36 @@ class NucularQuery:
             f = self.collection.WordFilter(w)
             self.filters[ ("w",w) ] = f
             
-    def resultDictionaries(self):
-        "return evaluated result as sequence of dictionaries"
+    def resultDictionaries(self, fields=None):
+        "return evaluated result as sequence of dictionaries (of just the attributes fields if given)"
         (result, status) = self.evaluate()
         if not result:
             raise ValueError, "no result returned in evaluation status="+repr(status)
-        return result.dictionaries()
+        return result.dictionaries(fields)
+
+    def topK(self, k, scorer=None, near=None, fields=None):
+        """
+        return the dictionaries of the k best scoring entries, best first.
+        scorer(features) gives the score of a ranking.MatchFeatures (default ranking.defaultScorer).
+        near=(attr, value) also scores by distance of numeric attr from value.
+        fields if given lists the attributes wanted in the dictionaries.
+        Scoring uses the word postings only: just the k winners are described.
+        """
+        if scorer is None:
+            scorer = ranking.defaultScorer
+        (result, status) = self.evaluate()
+        if not result:
+            raise ValueError, "no result returned in evaluation status="+repr(status)
+        features = ranking.matchFeatures(self, result.identities(), near)
+        decorated = [ (scorer(f), identity) for (identity, f) in features.items() ]
+        # ties go to the smaller identity
+        winners = heapq.nsmallest(k, [ (-score, identity) for (score, identity) in decorated ])
+        identities = [ identity for (score, identity) in winners ]
+        identities.sort()
+        D = {}
+        for descr in result.describeMany(identities, fields):
+            D[descr.identity()] = descr
+        return [ D[identity].asDictionary() for (score, identity) in winners ]
 
     def annotateDictionary(self, entry, delimitPairs=None):
         "mark up entry dictionary with html showing match locations"
@@ -938,7 +1361,46 @@ class NucularQuery:
                  switchFactor=SWITCHFACTORDEFAULT, truncateSize=None, materializeSize=None,
                  minResultLength=None, timeLimit=QUERYTIMELIMIT):
         """
+        return (result, status) as for evaluateUncached, reusing the result of an
+        equivalent query (same toXML) evaluated since the archive last changed.
+        The profile of the evaluation is kept in self.profile and result.profile
+        (and appended to the collection traceFile, if set).
+        """
+        collection = self.collection
+        self.profile = profile = queryProfile.QueryProfile(self)
+        cache = collection.resultCache
+        key = (collection.archiveVersion(), self.toXML(), maxBufferLimit,
+               truncateSize, materializeSize, minResultLength)
+        cached = cache.get(key)
+        if cached is not None:
+            (result, status, plan) = cached
+            self.log = ["result cache hit"]
+            self.plan = plan
+            profile.cacheHit = True
+            if result is not None:
+                result = result.copy(self)
+        else:
+            (result, status) = self.evaluateUncached(maxBufferLimit, switchFactor, truncateSize,
+                                                     materializeSize, minResultLength, timeLimit)
+            if not self.terminatedEarly:
+                cache.put(key, (result, status, self.plan))
+                if result is not None:
+                    result = result.copy(self)
+        profile.finish(result, status, self.plan)
+        if result is not None:
+            result.profile = profile
+        if collection.traceFile is not None:
+            profile.write(collection.traceFile)
+        return (result, status)
+
+    def evaluateUncached(self, maxBufferLimit=MAXBUFFERDEFAULT,
+                 switchFactor=SWITCHFACTORDEFAULT, truncateSize=None, materializeSize=None,
+                 minResultLength=None, timeLimit=QUERYTIMELIMIT):
+        """
         return (result, status)
+        Filters are applied in order of increasing estimate: each is resolved from the
+        index or, once testing the candidate descriptions is cheaper, by testing them
+        (see chooseMethod; switchFactor is no longer used).  The plan is kept in self.plan.
         If the estimates for all filters exceed maxBufferLimit return (None, OVERFLOWSTATUS).
         If the truncateSize is set truncate the intermediate results to that size.
         If materializeSize is set, do materialization whenever intermediate size falls below that limit.
@@ -953,51 +1415,63 @@ class NucularQuery:
             raise ValueError, "minResultLength support not yet implemented"
         self.log = []
         log = self.log.append
+        self.terminatedEarly = False
         collection = self.collection
         # sort filters by increasing estimate
         allFilters = self.filters.copy()
         estimatesDict = {}
+        estimates = {}
         for (k,f) in allFilters.items():
-            est = f.estimate()
+            est = estimates[k] = f.estimate()
             # if the estimate is None then the filter can only be directly tested, not indexed.
             if est is not None:
                 estimatesDict[ (est,k) ] = f
         estimateList = estimatesDict.items()
         estimateList.sort()
-        # evaluate filters that are cheap enough
         if self.threaded:
             log("threaded evaluation "+repr(now))
             result = ThreadedNucularResult(collection, self)
         else:
             log("unthreaded evaluation "+repr(now))
             result = NucularResult(collection, self)
-        sizeLimit = maxBufferLimit
         status = COMPLETESTATUS # unless decided otherwise later
+        self.plan = plan = []
+        total = max(collection.entryCount(), 1)
+        # if some filter can only be tested the survivors get described anyway
+        testing = len(estimateList)<len(allFilters)
         newsize = None
+        testSteps = {}
+        # resolve each filter from the indices unless testing descriptions is cheaper
         for ( (est, k), f ) in estimateList:
-            # "estimate", (est,k,sizeLimit)
-            log("estimate %s=%s sizelimit=%s [%s]" %(k, est, sizeLimit, time.time()-now))
-            evaluateF = False
-            if est<sizeLimit:
-                # estimate is okay: use the index
-                evaluateF = True
-            if truncateSize is not None:
-                # ignore the estimate anyway: just use the index and truncate as needed. (heuristic)
-                evaluateF = True
-            if newsize is not None and materializeSize is not None and newsize<materializeSize:
-                # We are below the materialization limit: switch from using indices to using materialized entries.
-                evaluateF = False
-            if evaluateF:
-                idDict = f.evaluateD(truncateSize=truncateSize)
-                # "idDict", idDict
-                result.intersectDict(idDict)
-                del allFilters[k] # done with this filter
-                newsize = result.size()
-                log("evaluated %s result %s give size=%s [%s]" % (k, len(idDict), newsize, time.time()-now))
-                sizeLimit = min(maxBufferLimit, switchFactor*newsize+100)
+            if newsize is None:
+                if est>=maxBufferLimit and truncateSize is None:
+                    break # too big to start from
+                (method, cost) = ("scan", est)
+                expected = est
+            else:
+                (method, cost) = self.chooseMethod(f, est, newsize, total, testing, truncateSize, materializeSize)
+                # assuming independent filters
+                expected = int(newsize*f.selectivity(total))
+            step = {"filter": f.toXML(), "method": method, "estimate": est, "cost": int(cost), "expectedSize": expected}
+            plan.append(step)
+            stepStart = time.time()
+            nodesBefore = frameGenerators.nodesRead
+            if method=="test":
+                log("testing %s on descriptions: cost %s [%s]" % (k, int(cost), time.time()-now))
+                testSteps[k] = step
+                # later filters are cheap to test too
+                testing = True
+                continue
+            if method=="scan":
+                ids = f.evaluateD(truncateSize=truncateSize)
             else:
-                log("estimate %s for %s switches to materialization %s" % (est, newsize, (sizeLimit,truncateSize,materializeSize)))
-                break # done looking for cheap filters
+                ids = f.restrictD(result.idSet)
+            result.intersectDict(ids)
+            del allFilters[k] # done with this filter
+            newsize = step["size"] = result.size()
+            step["elapsed"] = time.time()-stepStart
+            step["nodesRead"] = frameGenerators.nodesRead-nodesBefore
+            log("%s %s estimate %s cost %s gives size=%s [%s]" % (method, k, est, int(cost), newsize, time.time()-now))
         if not result.populated():
             log("aborting evaluation with overflow")
             return (None, OVERFLOWSTATUS) # no small enough filter found
@@ -1008,12 +1482,24 @@ class NucularQuery:
         remainingFilters = allFilters.items()
         if not remainingFilters:
             return (result, status)
+        for (k, f) in remainingFilters:
+            if not testSteps.has_key(k):
+                # filters without an index are tested with the others
+                step = testSteps[k] = {"filter": f.toXML(), "method": "test", "estimate": estimates[k],
+                                       "cost": 0, "expectedSize": None}
+                plan.append(step)
         # XXXX should sort the filters by increasing difficulty
         tests = [ f.test for (k,f) in remainingFilters ]
+        testStart = time.time()
+        nodesBefore = frameGenerators.nodesRead
         ids = result.identities()
-        ids.sort()
         keepids = {}
-        for identity in ids:
+        kept = []
+        for i in xrange(len(ids)):
+            identity = ids[i]
+            if i % DESCRIBEBATCH == 0:
+                # describe the next batch in one sweep
+                result.describeMany(ids[i:i+DESCRIBEBATCH])
             description = result.describe(identity)
             keep = True
             for test in tests:
@@ -1022,11 +1508,21 @@ class NucularQuery:
                     break
             if keep:
                 keepids[identity] = description
+                kept.append(identity)
             elapsed = time.time()-now
             if timeLimit is not None and elapsed>timeLimit:
                 log("terminating final evaluation early at %s with %s elements" % (elapsed, len(keepids)))
+                self.terminatedEarly = True
                 break # terminate early on too slow evaluation
-        result.resetDict(keepids, keepids.copy())
+        # ids are in order: kept is sorted
+        result.resetDict(IdSet(kept, True), keepids)
+        # the tests are applied together: each test step gets the totals
+        testElapsed = time.time()-testStart
+        testNodes = frameGenerators.nodesRead-nodesBefore
+        for step in testSteps.values():
+            step["size"] = len(kept)
+            step["elapsed"] = testElapsed
+            step["nodesRead"] = testNodes
         policy = None
         #pr "LOG"
         #pr "\n".join(self.log)
@@ -1034,14 +1530,55 @@ class NucularQuery:
         log("evaluation complete at %s" % elapsed)
         return (result, status)
     
+    def chooseMethod(self, f, est, size, total, testing, truncateSize=None, materializeSize=None):
+        """
+        (method, cost) for resolving index backed filter f (estimate est) against size
+        candidate ids from total entries: "scan" its postings, "seek" the candidates
+        in them, or "test" the candidate descriptions.  Costs are in key reads
+        (filters which describe their candidates also pay for that).
+        """
+        if truncateSize is not None:
+            # just use the index and truncate as needed (heuristic)
+            return ("scan", est)
+        testCost = size*parameters.QueryTestCost
+        if materializeSize is not None and size<materializeSize:
+            return ("test", testCost)
+        (method, cost) = ("scan", est)
+        seekCost = size*pquery.SEEKCOST
+        if f.describesCandidates():
+            cost += est*parameters.QueryTestCost
+            seekCost += testCost
+        # threaded results keep children of matching parents: those need the tests
+        if not self.threaded and f.restrictable() and seekCost<cost:
+            (method, cost) = ("seek", seekCost)
+        if testing:
+            # the filter only saves describing the candidates it rejects
+            testCost = testCost*(1.0-f.selectivity(total))
+        if testCost<=cost:
+            return ("test", testCost)
+        return (method, cost)
+
+    def explain(self, *args, **kw):
+        """
+        evaluate (with the arguments of evaluate) and return the plan used:
+        a list of dictionaries for the filters in the order applied with the
+        filter xml, the method ("scan" the postings, "seek" the candidate ids
+        in them or "test" descriptions), the filter estimate, the estimated
+        cost (in index key reads), the expectedSize of the result after the
+        step, its actual size and the elapsed time and tree nodes read for it
+        (description tests are applied together: their steps share the totals).
+        """
+        self.evaluate(*args, **kw)
+        return self.plan
+
     def test(self):
         "self test to make sure that filters are working"
         # XXX this will blow out memory for large data sets
-        idDicts = {}
+        idSets = {}
         tests = {}
         allFilters = self.filters.copy()
         for (k,f) in allFilters.items():
-            idDicts[k] = f.evaluateD()
+            idSets[k] = f.evaluateD()
             tests[k] = f.test
         # iterate over all ids
         collection = self.collection
@@ -1051,11 +1588,11 @@ class NucularQuery:
             descr = collection.describe(identity)
             #pr "description = ", repr(descr)
             for (k,f) in allFilters.items():
-                idDict = idDicts[k]
+                ids = idSets[k]
                 test = tests[k]
                 #pr "test is", test
                 testMatch = test(descr)
-                inDict = idDict.has_key(identity)
+                inDict = ids.has_key(identity)
                 if inDict:
                     if not testMatch:
                         raise ValueError, "for %s descr %s in dict but fails test" % (k,descr)
@@ -1063,15 +1600,62 @@ class NucularQuery:
                     if not inDict:
                         raise ValueError, "for %s descr %s matches test but not in dict" % (k,descr)
 
+class ResultCache:
+    "least recently used query results (keyed by archive version and query), counting hits and misses"
+    def __init__(self, maxEntries=RESULTCACHESIZE):
+        self.maxEntries = maxEntries
+        self.D = {}
+        self.order = [] # keys, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        "the remembered value for key, or None"
+        result = self.D.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        order = self.order
+        order.remove(key)
+        order.append(key)
+        return result
+
+    def put(self, key, value):
+        D = self.D
+        order = self.order
+        if D.has_key(key):
+            order.remove(key)
+        D[key] = value
+        order.append(key)
+        while len(order)>self.maxEntries:
+            del D[order[0]]
+            del order[0]
+
+    def clear(self):
+        self.D = {}
+        self.order = []
+
 class NucularResult:
-    "container for the result of a query"
+    "container for the result of a query: the selected ids are an idSet.IdSet"
     def __init__(self, collection, query=None):
         self.collection = collection
-        self.idDict = None
+        self.idSet = None
         self.idToDescription = {}
         self.idToAncestors = {} # used for threading
         self.query = query
+        self.profile = None # queryProfile.QueryProfile of the evaluation giving the result
         
+    def copy(self, query=None):
+        "a result for query (default the same) sharing the (immutable) ids and the descriptions of self"
+        if query is None:
+            query = self.query
+        result = self.__class__(self.collection, query)
+        result.idSet = self.idSet
+        result.idToDescription = self.idToDescription
+        result.idToAncestors = self.idToAncestors
+        return result
+
     def annotateDictionary(self, entry, delimitPairs=None):
         "mark up entry dictionary with html showing match locations"
         query = self.query
@@ -1079,75 +1663,65 @@ class NucularResult:
             raise ValueError, "cannot annotate: query not recorded"
         return query.annotateDictionary(entry, delimitPairs)
 
-    def resetDict(self, idDict, idToDescriptions=None):
-        if idToDescriptions is None:
-            idToDescriptions = {}
-        self.idDict = idDict
-        self.idToDescriptions = idToDescriptions
+    def resetDict(self, ids, idToDescription=None):
+        "replace the selected ids (and the descriptions known for them)"
+        if idToDescription is None:
+            idToDescription = {}
+        self.idSet = asIdSet(ids)
+        self.idToDescription = idToDescription
         
-    def intersectDict(self, idDict):
-        "combine intermediate results with new results in idDict"
-        if self.idDict is None:
-            self.idDict = idDict
-        elif self.idDict:
-            newDict = dictIntersect(self.idDict, idDict)
-            self.idDict = newDict
-
-    def unionDict(self, idDict):
-        if self.idDict is None:
-            self.idDict = idDict
+    def intersectDict(self, ids):
+        "combine intermediate results with new results in ids (an IdSet or dictionary)"
+        ids = asIdSet(ids)
+        if self.idSet is None:
+            self.idSet = ids
+        elif self.idSet:
+            self.idSet = self.idSet.intersect(ids)
+
+    def unionDict(self, ids):
+        ids = asIdSet(ids)
+        if self.idSet is None:
+            self.idSet = ids
         else:
-            all = self.idDict.copy()
-            #all.update(idDict)
-            for k in idDict.keys():
-                if all.get(k) is None:
-                    all[k] = idDict[k]
             # xxxx should do something about cleaning up child matches for matching ancestors...
-            self.idDict = all
+            self.idSet = self.idSet.union(ids)
 
-    def differenceDict(self, idDict):
+    def differenceDict(self, ids):
         # XXXX this is probably incorrect for the case of document inheritance (need to check)
-        assert self.idDict is not None, "unrestricted negation is not permitted"
-        all = self.idDict.copy()
-        for k in idDict.keys():
-            if all.has_key(k):
-                del all[k]
-        self.idDict = all
+        assert self.idSet is not None, "unrestricted negation is not permitted"
+        self.idSet = self.idSet.difference(asIdSet(ids))
         
     def populated(self):
         "true iff the result has recorded an entry set"
-        return self.idDict!=None
+        return self.idSet is not None
     
     def size(self):
-        return len(self.idDict)
+        return len(self.idSet)
 
     def entries(self):
         policy = parameters.gcPolicy()
         identities = self.identities()
-        descriptions = [self.describe(i) for i in identities]
+        descriptions = self.describeMany(identities)
         policy = None
-        return entries
+        return descriptions
     
-    def dictionaries(self):
-        "return selected entries as dictionaries"
+    def dictionaries(self, fields=None):
+        "return selected entries as dictionaries (of just the attributes fields if given)"
         policy = parameters.gcPolicy()
         identities = self.identities()
-        descriptions = [self.describe(i) for i in identities]
+        descriptions = self.describeMany(identities, fields)
         dictionaries = [descr.asDictionary() for descr in descriptions]
         policy = None
         return dictionaries
     
     def identities(self):
-        "return all selected identities as a sequence"
-        result = self.idDict.keys()
-        result.sort()
-        return result
+        "return all selected identities as a sorted list"
+        return self.idSet.keys()
     
     def toXML(self):
         L = ["<entries>"]
         ap = L.append
-        for identity in self.identities():
-            descr = self.describe(identity)
+        for descr in self.describeMany(self.identities()):
             ap(descr.toXML("   "))
         ap("</entries>")
         return "\n".join(L)
@@ -1158,26 +1732,48 @@ class NucularResult:
     
     def remove(self, identity):
         "take an identity out of this result set"
-        idDict = self.idDict
         i2d = self.idToDescription
-        if idDict.has_key(identity):
-            del idDict[identity]
+        if self.idSet.has_key(identity):
+            self.idSet = self.idSet.difference(IdSet([identity], True))
         if i2d.has_key(identity):
             del i2d[identity]
             
-    def describe(self, identity):
-        "get description for identity (and cache it)"
-        idDict = self.idDict
-        if idDict is None:
+    def describe(self, identity, fields=None):
+        """get description for identity (and cache it).
+           Descriptions of just the attributes fields are not cached."""
+        ids = self.idSet
+        if ids is None:
             raise ValueError, "result not yet populated"
-        if not idDict.has_key(identity):
+        if not ids.has_key(identity):
             raise KeyError, "id not in result set"
+        if fields is not None:
+            return self.collection.describe(identity, fields)
         i2d = self.idToDescription
         result = i2d.get(identity)
         if result is None:
             result = self.collection.describe(identity)
             i2d[identity] = result
         return result
+
+    def describeMany(self, identities, fields=None):
+        """descriptions for the sorted list identities, describing the uncached ones together
+           (descriptions of just the attributes fields, if given, are not cached)"""
+        ids = self.idSet
+        if ids is None:
+            raise ValueError, "result not yet populated"
+        i2d = self.idToDescription
+        missing = []
+        for identity in identities:
+            if not ids.has_key(identity):
+                raise KeyError, "id not in result set"
+            if not i2d.has_key(identity):
+                missing.append(identity)
+        if fields is not None:
+            return self.collection.describeMany(identities, fields)
+        if missing:
+            for descr in self.collection.describeMany(missing):
+                i2d[descr.identity()] = descr
+        return [ i2d[identity] for identity in identities ]
     
     def describeThread(self, identity):
         "return list of descriptions [followUp, parent, grandparent,...]"
@@ -1193,11 +1789,11 @@ class ThreadedNucularResult(NucularResult):
     """
     def identities(self):
         "return identities that don't have ancestors in the same result set"
-        idDict = self.idDict
+        ids = self.idSet
         idToAncestors = self.idToAncestors
         collection = self.collection
-        allDict = idDict.copy()
-        for identity in idDict:
+        result = []
+        for identity in ids:
             ancestors = idToAncestors.get(identity)
             if ancestors is None:
                 ancestors = collection.ancestorChain(identity)
@@ -1205,25 +1801,25 @@ class ThreadedNucularResult(NucularResult):
             keep = True
             # remove any entry with ancestor in same set
             for ancestor in ancestors:
-                if identity!=ancestor and idDict.has_key(ancestor):
+                if identity!=ancestor and ids.has_key(ancestor):
                     #pr "removing", identity, "because of", ancestor
                     keep = False
                     break
-            if not keep:
-                del allDict[identity]
-        return allDict.keys()
+            if keep:
+                result.append(identity)
+        return result
     
-    def intersectDict(self, idDict):
+    def intersectDict(self, ids):
         "check in current results whether id or ancestors match new result, remove non-matches"
-        if self.idDict is None:
-            self.idDict = idDict
+        ids = asIdSet(ids)
+        if self.idSet is None:
+            self.idSet = ids
         else:
-            myDict = self.idDict
             idToAncestors = self.idToAncestors
             collection = self.collection
-            currentIds = myDict.keys()
+            kept = []
             # see if each identity or any of its ancestors are in the result
-            for identity in currentIds: # myDict modified
+            for identity in self.idSet:
                 discard = True
                 ancestors = idToAncestors.get(identity)
                 if ancestors is None:
@@ -1231,33 +1827,29 @@ class ThreadedNucularResult(NucularResult):
                 #id1 = identity
                 for ancestor in ancestors:
                     #pr id1
-                    if idDict.has_key(ancestor):
+                    if ids.has_key(ancestor):
                         discard = False
                         break
                         #if id1!=identity:
                             #pr "keeping", identity, "based on ancestor match", ancestor
-                if discard:
-                    del myDict[identity]
-            self.idDict = myDict
-
-def dictIntersect(d1, d2):
-    "return pairs common to both dictionaries (should be a builtin)"
-    if len(d1)>len(d2):
-        (d1,d2) = (d2,d1)
-    result = {}
-    for k in d1: #d1.keys():
-        if d2.has_key(k):
-            result[k] = d1[k]
-    return result
+                if not discard:
+                    kept.append(identity)
+            self.idSet = IdSet(kept, True)
 
 class NucularIndex:
     "Sub-index interface for Nucular indices."
     
     lazyIndexing = True
     
-    def __init__(self, name, argumentsOrder, valuesOrder, directory, sessionId, readOnly=False):
-        "connect to an index in the directory with the name"
+    def __init__(self, name, argumentsOrder, valuesOrder, directory, sessionId, readOnly=False, terms=False):
+        """connect to an index in the directory with the name.
+           If terms is set keep a term dictionary for the (word postings) index."""
         self.readOnly = readOnly
+        self.hasTerms = terms
+        self.terms = None # term dictionary when loaded, False if unavailable
+        self.changed = False
+        self.baseTerms = None # term dictionary before the changes of this session
+        self.termChanges = None # {key: (deletedFirst, putLast)} to merge, None to rebuild
         self.sessionId = sessionId
         self.name = name
         self.argumentsOrder = argumentsOrder
@@ -1267,6 +1859,7 @@ class NucularIndex:
         self.session = None
         self.timestamp = None
         self.loadCount = 0
+        self.generation = 0 # incremented on every update, store and discard
 
     def __repr__(self):
         return "nucularIndex: "+repr((self.name, self.sessionId))
@@ -1279,6 +1872,9 @@ class NucularIndex:
     def put(self, key, value, delete=False):
         "set at key/value pair in the base index"
         index = self.getExistingBaseIndex()
+        self.noteTermChanges( (key,), delete )
+        self.changed = True
+        self.generation += 1
         if delete:
             del index[key]
         else:
@@ -1293,12 +1889,18 @@ class NucularIndex:
         #pr "removing keys", keys
         for k in keys:
             D[k] = None
+        self.noteTermChanges(keys, True)
+        self.changed = True
+        self.generation += 1
         index.delDictionary(D)
             
     def putDictionary(self, dictionary, delete=False):
         "set entries from dictionary in the base index"
         #pr self.name, "putDictionary", delete
         self.loadCount += len(dictionary)
+        self.noteTermChanges(dictionary, delete)
+        self.changed = True
+        self.generation += 1
         #pr dictionary
         index = self.getExistingBaseIndex()
         if delete:
@@ -1306,6 +1908,82 @@ class NucularIndex:
         else:
             index.putDictionary(dictionary)
 
+    def loadBase(self, dictionary):
+        "bulk load dictionary directly into a sorted base tree (index must be empty)"
+        if self.readOnly:
+            raise ValueError, "cannot modify archive via read only session"
+        self.loadCount += len(dictionary)
+        archive = self.getArchive()
+        # drop the (empty) undecided layer so the next session sees the new base
+        self.discard()
+        archive.loadBase(dictionary)
+        self.changed = True
+        self.generation += 1
+
+    def isEmpty(self):
+        "true iff no entries (or delete marks) are visible in any layer"
+        index = self.getExistingBaseIndex()
+        return index.lastIndex()<1
+
+    def noteTermChanges(self, keys, delete):
+        "record changed keys to merge into the term dictionary when stored"
+        if not self.hasTerms:
+            return
+        if not self.changed:
+            # the first change: merge into the dictionary if it is up to date
+            self.baseTerms = self.termDictionary()
+            if self.baseTerms is not None:
+                self.termChanges = {}
+        changes = self.termChanges
+        if changes is None:
+            return
+        for key in keys:
+            if changes.has_key(key):
+                changes[key] = (changes[key][0], not delete)
+            else:
+                changes[key] = (delete, not delete)
+
+    def termsFileName(self):
+        "path of the file holding the term dictionary, next to the index subdirectory"
+        return os.path.join(self.directory, self.name+".terms")
+
+    def termDictionary(self):
+        "the term dictionary for the index or None if not kept or out of date"
+        if not self.hasTerms:
+            return None
+        terms = self.terms
+        if terms is None:
+            terms = termDictionary.load(self.termsFileName())
+            if terms is not None and terms.stamp!=self.getExistingBaseIndex().lastIndex():
+                terms = None # updated without a new dictionary or not yet aggregated
+            if terms is None:
+                terms = False
+            self.terms = terms
+        if terms is False:
+            return None
+        return terms
+
+    def storeTerms(self):
+        "save the term dictionary for the current session, merging the changes into the old one if possible"
+        index = self.getExistingBaseIndex()
+        stamp = index.lastIndex()
+        terms = None
+        if self.termChanges is not None:
+            terms = self.baseTerms.merge(self.termChanges, stamp)
+        if terms is None:
+            terms = termDictionary.fromIndex(index, stamp)
+        terms.save(self.termsFileName())
+        self.terms = None # check against the index seen by the next session
+        self.changed = False
+        self.baseTerms = self.termChanges = None
+
+    def refreshTerms(self):
+        "rebuild the term dictionary for the merged layers after aggregation (the stamp changes)"
+        (index, name) = self.getArchive().newSessionMapping(readonly=True)
+        terms = termDictionary.fromIndex(index, index.lastIndex())
+        terms.save(self.termsFileName())
+        self.terms = None
+
     def exists(self):
         directory = self.archiveDirectory()
         return os.path.exists(directory)
@@ -1340,15 +2018,97 @@ class NucularIndex:
         if self.session:
             self.session.store(waiting)
         self.session = None
+        self.terms = None
+        self.generation += 1
         
     def discard(self):
         "discard updates"
         if self.session:
             self.session.discard()
         self.session = None
+        self.terms = None
+        self.changed = False
+        self.baseTerms = self.termChanges = None
+        self.generation += 1
         
     def getArchive(self):
         "get the index implementation archive, open it if not already open."
         dummy = self.getExistingBaseIndex()
         return self.archive
 
+class MemoryNucularIndex(NucularIndex):
+    "Sub-index held in memory (see frames/fmemory.py)."
+
+    def __init__(self, name, argumentsOrder, valuesOrder, archive, sessionId, readOnly=False):
+        NucularIndex.__init__(self, name, argumentsOrder, valuesOrder, None, sessionId, readOnly)
+        self.archive = archive
+
+    def exists(self):
+        return True
+
+    def termDictionary(self):
+        return None # the sorted key list answers range estimates directly
+
+    def getExistingBaseIndex(self):
+        "open the in memory index"
+        if self.session is None:
+            self.session = self.archive.sessionMapping(self.sessionId, self.readOnly)
+        return self.session
+
+    def createBaseIndex(self):
+        return self.getExistingBaseIndex()
+
+class IncrementalNucular(Nucular):
+    "read only session sharing the state of another, caching word postings and descriptions"
+
+    def __init__(self, collection, maxRanges=8):
+        self.__dict__.update(collection.__dict__)
+        self.readOnly = True
+        self.AttrWord = CachedNucularIndex(collection.AttrWord, maxRanges)
+        self.WordIndex = CachedNucularIndex(collection.WordIndex, maxRanges)
+        self.descriptions = {}
+        self.resultCache = ResultCache()
+
+    def describe(self, identity, fields=None):
+        "extract entry description for id (cached)"
+        if fields is not None:
+            return Nucular.describe(self, identity, fields)
+        descriptions = self.descriptions
+        result = descriptions.get(identity)
+        if result is None:
+            result = descriptions[identity] = Nucular.describe(self, identity)
+        return result
+
+    def describeMany(self, identities, fields=None):
+        if fields is not None:
+            return Nucular.describeMany(self, identities, fields)
+        descriptions = self.descriptions
+        missing = [ identity for identity in identities if not descriptions.has_key(identity) ]
+        if missing:
+            for descr in Nucular.describeMany(self, missing):
+                descriptions[descr.identity()] = descr
+        return [ descriptions[identity] for identity in identities ]
+
+    def cacheHits(self):
+        "result cache hits and the posting ranges reused from earlier scans"
+        result = self.resultCache.hits
+        for index in (self.AttrWord, self.WordIndex):
+            if index.cache is not None:
+                result += index.cache.hits
+        return result
+
+class CachedNucularIndex:
+    "Sub-index wrapper whose base index remembers recent range scans (pquery.RangeCache)."
+
+    def __init__(self, subindex, maxRanges=8):
+        self.subindex = subindex
+        self.maxRanges = maxRanges
+        self.cache = None
+
+    def __getattr__(self, name):
+        return getattr(self.subindex, name)
+
+    def getExistingBaseIndex(self):
+        if self.cache is None:
+            self.cache = pquery.RangeCache(self.subindex.getExistingBaseIndex(), self.maxRanges)
+        return self.cache
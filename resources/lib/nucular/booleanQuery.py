@@ -32,7 +32,7 @@ def disjunction(sequence, session, qs):
     result = getResult(parse0, session, qs)
     for parse in sequence[1:]:
         presult = getResult(parse, session, qs)
-        result.unionDict(presult.idDict)
+        result.unionDict(presult.idSet)
     return result
 
 def conjunction(sequence, session, qs):
@@ -90,14 +90,13 @@ def conjunction(sequence, session, qs):
     assert result is not None, "failed to evaluate query with status="+repr(status)
     # restrict using additional positive conditions
     for pr in positiveResults:
-        if result.idDict:
-            result.intersectDict(pr.idDict)
+        if result.idSet:
+            result.intersectDict(pr.idSet)
     # restrict using negations
     for np in negativeParses:
-        if result.idDict:
+        if result.idSet:
             nresult = getResult(np, session, qs)
-            nDict = nresult.idDict
-            result.differenceDict(nDict)
+            result.differenceDict(nresult.idSet)
     return result
             
 
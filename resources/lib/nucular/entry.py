@@ -6,6 +6,7 @@ import re
 #import bisect
 import specialValues
 import types
+import unicodedata
 #import parameters
 
 # XXX the implementation assumes that no mods are done after indexing
@@ -34,6 +35,7 @@ class Entry:
         # "D after", repr(D)
         self.D = D
         self.myWordList = self.myWordCollection = None
+        self.tokenCache = None
 
     def __repr__(self):
         return "Entry(%s)" % self.D
@@ -188,8 +190,24 @@ class Entry:
         return []
     
     MINWORDLENGTH = 2
+
+    def attrTokens(self, splitter=None):
+        """attribute --> [words of each value] split by splitter (default parseWords), numbers omitted.
+           Cached: the tests of a query and indexing split each value once."""
+        if splitter is None:
+            splitter = parseWords
+        cache = self.tokenCache
+        if cache is not None and cache[0] is splitter:
+            return cache[1]
+        D = self.attrDict(indexable=True)
+        result = {}
+        for attribute in D:
+            # numbers are range indexed, not words
+            result[attribute] = [ splitter(v) for v in D[attribute] if type(v) not in NUMBERTYPES ]
+        self.tokenCache = (splitter, result)
+        return result
     
-    def words(self, attribute=None, collection=None, attributeWords=None, attributeTranslation=None):
+    def words(self, attribute=None, collection=None, attributeWords=None, attributeTranslation=None, splitter=None):
         "Find words in content and words associated with each attribute."
         # XXXX if attribute=None and attributeWords is set, collection
         # XXXX is unneeded (implicit from attributeWord)
@@ -197,18 +215,16 @@ class Entry:
             attributeTranslation = {}
         minlen = self.MINWORDLENGTH
         #D = self.D
-        D = self.attrDict(indexable=True)
+        D = self.attrTokens(splitter)
         if collection is None:
             collection = {}
         if attribute is None:
             for attr in D.keys():
-                collection = self.words(attr, collection, attributeWords, attributeTranslation)
+                collection = self.words(attr, collection, attributeWords, attributeTranslation, splitter)
         else:
             values = D.get(attribute, [])
             translation = attributeTranslation.get(attribute, attribute)
-            for v in values:
-                #v = str(v).lower()
-                words = parseWords(v)
+            for words in values:
                 ##pr "words = ", words
                 for w in words:
                     if len(w)>minlen:
@@ -221,20 +237,49 @@ class Entry:
                             attributeWords[translation] = attrDict
         return collection
     
-    def wordStats(self, attributeTranslation=None):
+    def wordPositions(self, attributeTranslation=None, splitter=None):
+        "attribute --> word --> list of positions of the word among the words of the attribute values."
+        if attributeTranslation is None:
+            attributeTranslation = {}
+        minlen = self.MINWORDLENGTH
+        D = self.attrTokens(splitter)
+        result = {}
+        offsets = {}
+        for attribute in D:
+            translation = attributeTranslation.get(attribute, attribute)
+            positions = result.get(translation)
+            if positions is None:
+                positions = result[translation] = {}
+            offset = offsets.get(translation, 0)
+            for words in D[attribute]:
+                for i in xrange(len(words)):
+                    w = words[i]
+                    if len(w)>minlen:
+                        L = positions.get(w)
+                        if L is None:
+                            L = positions[w] = []
+                        L.append(offset+i)
+                # leave a gap so phrases don't match across values
+                offset += len(words)+1
+            offsets[translation] = offset
+        return result
+
+    def wordStats(self, attributeTranslation=None, splitter=None):
         "Get collection of words and attribute/word associations."
         if attributeTranslation is None:
             attributeTranslation = {}
         freeCollection = {}
         attributeWords = {}
-        self.words(None, freeCollection, attributeWords, attributeTranslation)
+        self.words(None, freeCollection, attributeWords, attributeTranslation, splitter)
         return (freeCollection, attributeWords)
 
-# XXX in some future version the handling of word parsing might
-# XXX be encapsulated in an object...
+# Tokenizer below encapsulates word parsing for archives which need more
+# than parseWords.
 
 # need to make this a parameter of some kind
 RE = re.compile("\w+")
+UNICODERE = re.compile("\w+", re.UNICODE)
+NUMBERTYPES = (types.IntType, types.LongType, types.FloatType)
 WORDLENGTHLIMIT = 30
 
 def parseWords(v, RE=RE, limit=WORDLENGTHLIMIT):
@@ -245,6 +290,76 @@ def parseWords(v, RE=RE, limit=WORDLENGTHLIMIT):
     result = [ x[:WORDLENGTHLIMIT] for x in result ]
     return result
 
+def foldAccents(text):
+    "unicode text in compatibility decomposition (NFKD) without combining marks: u'Caf\xe9' --> u'Cafe'"
+    if type(text) is not types.UnicodeType:
+        return text # bytes in an unknown encoding: leave them be
+    decomposed = unicodedata.normalize("NFKD", text)
+    return u"".join([ c for c in decomposed if not unicodedata.combining(c) ])
+
+class Tokenizer:
+    """
+    Word splitter usable in place of parseWords: lower cases, optionally
+    folds accents (so "cafe" finds "Caf\xe9"), drops stop words and words
+    shorter than minLength and truncates words to limit characters.
+    Results are cached by value.  config() is a marshallable tuple from
+    which TokenizerFromConfig makes the same tokenizer.
+    """
+    def __init__(self, fold=True, stopWords=(), minLength=0, limit=WORDLENGTHLIMIT, cacheSize=10000):
+        self.fold = fold
+        stopWords = list(stopWords)
+        stopWords.sort()
+        self.stopWords = tuple(stopWords)
+        self.stopDict = dict([ (w, 1) for w in stopWords ])
+        self.minLength = minLength
+        self.limit = limit
+        self.cacheSize = cacheSize
+        self.cache = {}
+
+    def __repr__(self):
+        return "Tokenizer%s" % (self.config(),)
+
+    def config(self):
+        return (self.fold, self.stopWords, self.minLength, self.limit)
+
+    def __call__(self, v):
+        cache = self.cache
+        result = cache.get(v)
+        if result is not None:
+            return result
+        text = v
+        if type(text) not in types.StringTypes:
+            text = str(text)
+        text = text.lower()
+        if self.fold:
+            text = foldAccents(text)
+        limit = self.limit
+        minLength = self.minLength
+        stopDict = self.stopDict
+        result = []
+        for w in UNICODERE.findall(text):
+            w = w[:limit]
+            if len(w)>=minLength and not stopDict.has_key(w):
+                result.append(w)
+        if len(cache)>=self.cacheSize:
+            cache.clear()
+        cache[v] = result
+        return result
+
+def TokenizerFromConfig(config):
+    (fold, stopWords, minLength, limit) = config
+    return Tokenizer(fold, stopWords, minLength, limit)
+
+TRIGRAMPAD = "$" # not a word character: marks the start and end of words
+
+def trigrams(word):
+    "distinct three character substrings of word padded at both ends"
+    padded = TRIGRAMPAD+word+TRIGRAMPAD
+    D = {}
+    for i in xrange(len(padded)-2):
+        D[padded[i:i+3]] = 1
+    return D.keys()
+
 def findPrefixInText(prefix, text, RE=RE):
     "return [(start,end), ...] for occurrances of prefix in text"
     lprefix = len(prefix)
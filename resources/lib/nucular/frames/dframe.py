@@ -643,6 +643,17 @@ class DataFrame:
         "estimate largest index"
         return self.getSize()
 
+    def estimateCount(self, fromKey, toKey):
+        "number of keys from fromKey (inclusive, None for the start) to toKey (exclusive, None for the end)"
+        k = self.keys
+        if k is None:
+            (k, v) = self.sortedKeysAndValues()
+        if toKey is None:
+            end = len(k)
+        else:
+            end = bisect.bisect_left(k, toKey)
+        return max(0, end-bisect.bisect_left(k, fromKey))
+
 
 # testing stuff...
 
@@ -22,6 +22,7 @@ TESTDIR = "../../testdata"
 #TESTDIR = "/net/arw/"
 
 import os
+import marshal
 import frameGenerators
 import bisect
 from nucular import parameters
@@ -40,6 +41,20 @@ def TreeFromSortedFrames(sortedFrames, filename, adjustSizes=True, nodeSize=None
     result.create(sortedFrames, filename, adjustSizes=True, verbose=verbose)
     return result
 
+def TreeFromDictionary(dictionary, filename, nodeSize=None):
+    "sort dictionary in memory and write it directly as a tree"
+    if nodeSize is None:
+        nodeSize = fTree.nodeSize
+    keys = dictionary.keys()
+    keys.sort()
+    values = [ dictionary[k] for k in keys ]
+    # frames are already split to node size: don't adjust them again
+    frames = frameGenerators.splitFrameGenerator(keys, values, nodeSize)
+    sortedFrames = frameGenerators.SortedFrames(frames)
+    result = fTree(filename, nodeSize)
+    result.create(sortedFrames, filename, adjustSizes=False)
+    return result
+
 def FastTreeFromDframeFiles(filePaths, filename, adjustSizes=True, nodeSize=None):
     unsortedFrames = frameGenerators.FramesFromDFrameFilePaths(filePaths)
     result = FastTreeFromUnsortedFrames(unsortedFrames, filename,
@@ -332,16 +347,55 @@ class fTree:
 
     def lastIndex(self):
         "return estimated last seek position for last element of structure"
-        root = self.root
-        if root is None:
+        if self.root is None:
             return 0 # empty structure
-        currentNode = root
+        currentNode = self._lastLeaf()
+        # return last position in last leaf
+        return currentNode.getRecordSeek() + currentNode.getSize()
+
+    def _lastLeaf(self):
+        currentNode = self.root
         for level in xrange(self.leafLevel):
             (keys, values) = currentNode.sortedKeysAndValues()
             recordSeek = values[-1]
             currentNode = self._getNodeAtSeek(recordSeek)
-        # return last position in last leaf
-        return currentNode.getRecordSeek() + currentNode.getSize()
+        return currentNode
+
+    def _leafPosition(self, key):
+        "(leaf, index of key in leaf) for the leaf holding key (or the next), None past the end"
+        leaf = self.LeafGenerator(key).iter().next()
+        if leaf is None:
+            return None
+        (keys, values) = leaf.sortedKeysAndValues()
+        return (leaf, bisect.bisect_left(keys, key))
+
+    def estimateCount(self, fromKey, toKey):
+        """estimated number of keys from fromKey (inclusive, None for the start) to
+           toKey (exclusive, None for the end).  Unlike indexOf differences this
+           counts keys: the leaves between the end leaves (byte positions apart)
+           are taken to hold keys as densely as the parts of the end leaves in range."""
+        if self.root is None:
+            return 0
+        start = self._leafPosition(fromKey)
+        if start is None:
+            return 0
+        end = None
+        if toKey is not None:
+            end = self._leafPosition(toKey)
+        if end is None:
+            leaf = self._lastLeaf()
+            end = (leaf, len(leaf.sortedKeysAndValues()[0]))
+        (leaf, index) = start
+        (endLeaf, endIndex) = end
+        if endLeaf.getRecordSeek()<=leaf.getRecordSeek():
+            return max(0, endIndex-index)
+        (keys, values) = leaf.sortedKeysAndValues()
+        (endKeys, endValues) = endLeaf.sortedKeysAndValues()
+        # marshal the pairs in range as the leaves are stored
+        sample = (keys[index:]+endKeys[:endIndex], values[index:]+endValues[:endIndex])
+        byteSize = max(len(marshal.dumps(sample)), 1)
+        between = max(0, endLeaf.getRecordSeek()-leaf.getRecordSeek()-leaf.dataSize())
+        return (len(keys)-index) + int(between*len(sample[0])/byteSize) + endIndex
         
     def _getNodeAtSeek(self, recordSeek):
         # check cache
@@ -559,6 +613,8 @@ def test(filename1=os.path.join(TESTDIR, "fTree1.dat"),
     test = T.lastIndex()
     if test!=0:
         raise ValueError, "last index should be 0 in empty tree."
+    if T.estimateCount(None, None)!=0:
+        raise ValueError, "key count should be 0 in empty tree."
     kv = T.KeyValueGenerator("aaa", "zzz")
     test = kv.next()
     if test is not None:
@@ -605,6 +661,8 @@ def test(filename1=os.path.join(TESTDIR, "fTree1.dat"),
     test = T.lastIndex()
     if test<=index1:
         raise ValueError, "last index should be past hello index in 1-elt."
+    if T.estimateCount(None, None)!=1 or T.estimateCount("a", "hello")!=0 or T.estimateCount("a", "z")!=1:
+        raise ValueError, "bad key counts in 1-elt"
     kv = T.KeyValueGenerator("aaa", "zzz")
     test = kv.next()
     if test!=("hello", "goodbye"):
@@ -627,6 +685,19 @@ def test(filename1=os.path.join(TESTDIR, "fTree1.dat"),
         print "   constructed tree T1"
         compareDictAndTree(D1, T1)
         print "   compared D1/T1"
+        # key counts are estimated across leaves from the leaf byte sizes
+        keys = D1.keys()
+        keys.sort()
+        for (start, end) in [(0, size), (size/4, size/2), (size/2, min(size, size/2+3))]:
+            toKey = None
+            if end<size:
+                toKey = keys[end]
+            fromKey = None
+            if start<size:
+                fromKey = keys[start]
+            test = T1.estimateCount(fromKey, toKey)
+            if abs(test-(end-start))>(end-start)/10:
+                raise ValueError, "bad key count estimate %s for %s" % (test, (start, end))
         T2 = scatterSortTreeFromDictionary(D2, filename2, filename3)
         print "constructed T2"
         compareDictAndTree(D2, T2)
@@ -602,6 +602,42 @@ class LayeredArchive:
         self.moveFile(oldTransientFileName, transientRetiredDir)
         return (True, moveCount)
 
+    def loadBase(self, dictionary, dieOnFailure=True, verbose=False):
+        "Bulk load dictionary as a sorted base archive, bypassing the shadow layers (archive must be empty)."
+        fsSurrogate = self.fsSurrogate
+        if verbose:
+            print "loadBase", self.path, len(dictionary)
+        ts = self.newTimeStamp()
+        lockFileName = "%s.lock" % (ts,)
+        gotLocks = self.lockPrepareDirectories(lockFileName)
+        try:
+            if not gotLocks:
+                if dieOnFailure:
+                    raise ValueError, "failed to lock prepare directories on attempted base load"
+                # silently return otherwise
+                return (False, 0)
+            if self.transientMapping() is not None:
+                raise ValueError, "cannot bulk load base: transient archive is present"
+            baseActive = self.baseMapping()
+            if baseActive.lastIndex()>0:
+                raise ValueError, "cannot bulk load base: base archive is not empty"
+            oldBaseFileName = baseActive.filename
+            baseActive.close()
+            destinationFileName = "b%s.ktree" % ts
+            destinationName = fsSurrogate.join(self.path, BASE, PREPARED, destinationFileName)
+            fTree.TreeFromDictionary(dictionary, destinationName)
+            # move new base/prepare to base/active
+            baseActiveDir = fsSurrogate.join(self.path, BASE, ACTIVE)
+            finalPath = self.moveFile(destinationName, baseActiveDir)
+            if finalPath==oldBaseFileName:
+                raise ValueError, "new and old names should not match"
+        finally:
+            self.unlockPrepareDirectories(lockFileName)
+        # move old (empty) base/active to base/retired
+        baseRetiredDir = fsSurrogate.join(self.path, BASE, RETIRED)
+        self.moveFile(oldBaseFileName, baseRetiredDir)
+        return (True, len(dictionary))
+
     #def timeOutSessions(self, seconds):
     #    not implemented
     
@@ -751,6 +787,10 @@ class SessionMapping:
 
     def lastIndex(self):
         return self.tree.lastIndex()
+
+    def estimateCount(self, fromKey, toKey):
+        "estimated number of keys from fromKey to toKey (exclusive; None for the start or end)"
+        return self.tree.estimateCount(fromKey, toKey)
     
     def keysBetweenDict(self, startKey, pastEndKey, giveValues=False):
         tree = self.tree
@@ -0,0 +1,301 @@
+"""
+In memory stand in for the layered archive, for small archives.
+
+A MemoryArchive is a single key/value table kept as a dictionary plus
+sorted key and value lists (rebuilt lazily after updates).  There are
+no layers, files or locks: updates are visible at once, store keeps them
+and discard undoes those made by the session since it last stored.  MemoryMapping gives it the SessionMapping interface used by
+the Nucular indices.  Snapshots of several archives are saved to and
+loaded from a single marshal file.
+"""
+
+import os
+import marshal
+from bisect import bisect_left, bisect_right
+
+SNAPSHOTMARK = "nucular memory snapshot 1"
+
+class MemoryArchive:
+    "stand in for fltree.LayeredArchive holding everything in one in memory table"
+
+    def __init__(self, keys=None, values=None):
+        if keys is None:
+            keys = []
+            values = []
+        self.D = dict(zip(keys, values))
+        # keys from snapshots are sorted already
+        self.keys = keys
+        self.values = values
+
+    def sortedLists(self):
+        "(keys, values) sorted by key"
+        keys = self.keys
+        if keys is None:
+            D = self.D
+            keys = D.keys()
+            keys.sort()
+            self.keys = keys
+            self.values = [ D[k] for k in keys ]
+        return (keys, self.values)
+
+    def changed(self):
+        self.keys = self.values = None
+
+    def sessionMapping(self, sessionname, readonly=False):
+        return MemoryMapping(self, sessionname, readonly)
+
+    def loadBase(self, dictionary, dieOnFailure=True, verbose=False):
+        "bulk load dictionary (archive must be empty)"
+        if self.D:
+            raise ValueError, "cannot load base: archive is not empty"
+        self.D = dictionary.copy()
+        self.changed()
+        return (True, len(dictionary))
+
+    def aggregateRecent(self, dieOnFailure=True, verbose=False, fast=False):
+        return (True, 0) # no layers
+
+    def moveTransientToBase(self, dieOnFailure=True, verbose=False):
+        return (True, 0) # no layers
+
+    def cleanUp(self, complete=False):
+        pass # no files
+
+class MemoryMapping:
+    "SessionMapping interface for a MemoryArchive"
+
+    def __init__(self, archive, sessionname, readonly=False):
+        self.archive = archive
+        self.sessionname = sessionname
+        self.readonly = readonly
+        self.saved = {} # key --> (present, value) before the updates since the last store
+
+    def __repr__(self):
+        return "MemoryMapping(id=%s, name=%s, size=%s)" % (id(self), self.sessionname, len(self.archive.D))
+
+    def checkWrite(self):
+        if self.readonly:
+            raise ValueError, "cannot modify archive via read only session"
+
+    def save(self, keys):
+        "remember the current entries for keys so discard can restore them"
+        D = self.archive.D
+        saved = self.saved
+        for k in keys:
+            if not saved.has_key(k):
+                saved[k] = (D.has_key(k), D.get(k))
+
+    def __getitem__(self, key):
+        return self.archive.D[key]
+
+    def get(self, key, default=None):
+        return self.archive.D.get(key, default)
+
+    def has_key(self, key):
+        return self.archive.D.has_key(key)
+
+    def __setitem__(self, key, value):
+        self.checkWrite()
+        self.save( (key,) )
+        self.archive.D[key] = value
+        self.archive.changed()
+
+    def __delitem__(self, key):
+        self.checkWrite()
+        self.save( (key,) )
+        del self.archive.D[key]
+        self.archive.changed()
+
+    def putDictionary(self, dictionary):
+        self.checkWrite()
+        self.save(dictionary)
+        self.archive.D.update(dictionary)
+        self.archive.changed()
+
+    def delDictionary(self, dictionary):
+        self.checkWrite()
+        self.save(dictionary)
+        D = self.archive.D
+        for k in dictionary:
+            if D.has_key(k):
+                del D[k]
+        self.archive.changed()
+
+    def rangeLists(self, fromKey, toKey, truncateSize=None):
+        "keys and values from fromKey to toKey inclusive (only the first truncateSize if given)"
+        (keys, values) = self.archive.sortedLists()
+        start = bisect_left(keys, fromKey)
+        end = bisect_right(keys, toKey)
+        if truncateSize is not None:
+            end = min(end, start+truncateSize)
+        return (keys[start:end], values[start:end])
+
+    def rangeDict(self, fromKey, toKey, truncateSize=None):
+        (keys, values) = self.rangeLists(fromKey, toKey, truncateSize)
+        return dict(zip(keys, values))
+
+    def KeyValueGenerator(self):
+        (keys, values) = self.archive.sortedLists()
+        for i in xrange(len(keys)):
+            yield (keys[i], values[i])
+        yield None # sentinel
+
+    def firstKeyValue(self):
+        (keys, values) = self.archive.sortedLists()
+        if keys:
+            return (keys[0], values[0])
+        return None
+
+    def findAtOrNextKeyValue(self, key, forceNext=False):
+        (keys, values) = self.archive.sortedLists()
+        index = bisect_left(keys, key)
+        if forceNext and index<len(keys) and keys[index]==key:
+            index += 1
+        if index<len(keys):
+            return (keys[index], values[index])
+        return None
+
+    def nextKeyValueAfter(self, key):
+        return self.findAtOrNextKeyValue(key, forceNext=True)
+
+    def indexOf(self, key):
+        (keys, values) = self.archive.sortedLists()
+        return bisect_left(keys, key)
+
+    def lastIndex(self):
+        return len(self.archive.D)
+
+    def estimateCount(self, fromKey, toKey):
+        (keys, values) = self.archive.sortedLists()
+        if toKey is None:
+            end = len(keys)
+        else:
+            end = bisect_left(keys, toKey)
+        return max(0, end-bisect_left(keys, fromKey))
+
+    def store(self, waiting=False):
+        self.saved = {} # updates are visible already: just forget the old entries
+
+    def sync(self):
+        pass
+
+    def discard(self):
+        "restore the entries changed since the last store"
+        saved = self.saved
+        if not saved:
+            return
+        D = self.archive.D
+        for k in saved:
+            (present, value) = saved[k]
+            if present:
+                D[k] = value
+            elif D.has_key(k):
+                del D[k]
+        self.saved = {}
+        self.archive.changed()
+
+def isSnapshot(filename):
+    "test whether filename holds a memory snapshot"
+    if not os.path.isfile(filename):
+        return False
+    f = open(filename, "rb")
+    try:
+        try:
+            mark = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return False
+    finally:
+        f.close()
+    return mark==SNAPSHOTMARK
+
+def saveSnapshot(filename, archives):
+    "save name --> MemoryArchive dictionary to filename (atomically)"
+    tempname = filename+".tmp"
+    f = open(tempname, "wb")
+    try:
+        marshal.dump(SNAPSHOTMARK, f)
+        names = archives.keys()
+        names.sort()
+        marshal.dump(len(names), f)
+        for name in names:
+            (keys, values) = archives[name].sortedLists()
+            marshal.dump( (name, keys, values), f )
+    finally:
+        f.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tempname, filename)
+
+def loadSnapshot(filename):
+    "load name --> MemoryArchive dictionary from filename"
+    f = open(filename, "rb")
+    try:
+        mark = marshal.load(f)
+        if mark!=SNAPSHOTMARK:
+            raise ValueError, "not a memory snapshot "+repr(filename)
+        result = {}
+        count = marshal.load(f)
+        for i in xrange(count):
+            (name, keys, values) = marshal.load(f)
+            result[name] = MemoryArchive(keys, values)
+    finally:
+        f.close()
+    return result
+
+def test(filename="/tmp/fmemoryTest.dat"):
+    A = MemoryArchive()
+    M = A.sessionMapping("test")
+    D = {}
+    for x in xrange(1, 1000, 13):
+        D[ (str(x), x) ] = x
+    M.putDictionary(D)
+    M[ ("z", 0) ] = "last"
+    del M[ ("1", 1) ]
+    (keys, values) = M.rangeLists( ("2",), ("3",) )
+    expected = [ k for k in D if ("2",)<=k<=("3",) ]
+    expected.sort()
+    if keys!=expected or values!=[ D[k] for k in keys ]:
+        raise ValueError, "bad range "+repr((keys, expected))
+    if M.firstKeyValue()!=( ("105", 105), 105 ):
+        raise ValueError, "bad first "+repr(M.firstKeyValue())
+    if M.nextKeyValueAfter( ("105", 105) )!=( ("118", 118), 118 ):
+        raise ValueError, "bad next"
+    if M.findAtOrNextKeyValue( ("z", 0) )!=( ("z", 0), "last" ) or M.nextKeyValueAfter( ("z", 0) ) is not None:
+        raise ValueError, "bad end"
+    if M.lastIndex()!=len(D) or M.indexOf( ("z",) )!=len(D)-1:
+        raise ValueError, "bad index "+repr((M.lastIndex(), M.indexOf( ("z",) )))
+    if M.estimateCount(None, None)!=len(D) or M.estimateCount( ("2",), ("3",) )!=len(keys):
+        raise ValueError, "bad key count "+repr(M.estimateCount(None, None))
+    (few, values) = M.rangeLists( ("2",), ("3",), truncateSize=3 )
+    if few!=keys[:3] or values!=[ D[k] for k in few ]:
+        raise ValueError, "bad truncated range "+repr(few)
+    # discard undoes the updates since the last store
+    M.store()
+    before = A.sortedLists()
+    before = (before[0][:], before[1][:])
+    M[ ("z", 0) ] = "changed"
+    M[ ("new", 0) ] = "new"
+    del M[ ("105", 105) ]
+    M.delDictionary( {("118", 118): None, ("missing",): None} )
+    M.putDictionary( {("new", 0): "newer", ("2", 2): 2} )
+    M.discard()
+    if A.sortedLists()!=before:
+        raise ValueError, "discard did not restore the archive"
+    saveSnapshot(filename, {"test": A})
+    if not isSnapshot(filename):
+        raise ValueError, "snapshot not recognized"
+    B = loadSnapshot(filename)["test"]
+    if B.sortedLists()!=A.sortedLists():
+        raise ValueError, "snapshot does not match"
+    R = B.sessionMapping("reader", readonly=True)
+    try:
+        R[ ("a", 1) ] = 1
+    except ValueError:
+        pass
+    else:
+        raise ValueError, "read only mapping accepted an update"
+    os.remove(filename)
+    print "fmemory test ok"
+
+if __name__=="__main__":
+    test()
@@ -26,6 +26,9 @@ except:
 PREFIXFORMAT = "%08d&%08d"
 PREFIXLENGTH = len(PREFIXFORMAT % (123456,1222) )
 
+# number of frames read from files so far (for query profiles)
+nodesRead = 0
+
 class GeneratorWrapper:
     "superclass for wrapping generator objects to associate methods"
     # this is intended to make code a bit more readable and less type-error prone
@@ -936,8 +939,9 @@ def SortedFrameRange(SortedFrames, smallestKey=None, largestKey=None, excludeSma
                     # generate subframe
                     (keys, values) = frame.rangeLists(smallestKey, largestKey, excludeSmallest, excludeLargest)
                     if keys:
+                        # (an empty subframe is skipped, not the last one repeated)
                         newFrame = dframe.DataFrameFromLists(keys, values)
-                    yield newFrame
+                        yield newFrame
             if not done:
                 # advance to next frame
                 frame = SortedFrames.next()
@@ -1224,7 +1228,12 @@ def larger(thing):
     if tt is TupleType:
         if len(thing)==0:
             return (0,)
-        return (larger(thing[0]),)
+        first = thing[0]
+        large = larger(first)
+        if large>first:
+            return (large,)
+        # can't truncate (eg, numeric first component): keep the whole thing
+        return thing
     elif tt in StringTypes: # elif tt is UnicodeType:
         # cmax should be beyond any reasonable string
         cmax = MAXUNICHR #unichr(0x10fffd)
@@ -1402,6 +1411,7 @@ def storeFramesToFileWithStats(frameGenerator, toFile, atEnd=True):
 def restoreFramesFromFileWithStats(fromFile, startSeek=None, cache=None, noData=False):
     "restore sequence from file as generated by storeToFile, include stats (generator)"
     # cache if present is a dictionary of seek to cached frames
+    global nodesRead
     if startSeek is None:
         startSeek = fromFile.tell()
     done = False
@@ -1433,6 +1443,7 @@ def restoreFramesFromFileWithStats(fromFile, startSeek=None, cache=None, noData=
                 # load the uninterpretted frame data from file, setting reported stats, and seek
                 frame = dframe.DataFrame()
                 frame.loadString(fromFile, dataSize, minkey, maxkey, size, recordSeek, noData)
+                nodesRead += 1
                 recordSeek = fromFile.tell()
                 if size>0:
                     yield frame
@@ -120,6 +120,9 @@ class ShadowTree:
     def lastIndex(self):
         "approximate last structure position"
         return self.white.lastIndex() + self.grey.lastIndex()
+    def estimateCount(self, fromKey, toKey):
+        "approximate key count: counts delete marks and shadowed keys too"
+        return self.white.estimateCount(fromKey, toKey)+self.grey.estimateCount(fromKey, toKey)
     def finalize(self):
         self.white.finalize()
         if self.grey is not None:
@@ -130,7 +133,9 @@ class ShadowTree:
         yield leaf
         (mn, mx) = leaf.getMinMax(check=True) # get true maximum value
         # this should not cause an infinite recursion because atEnd=False
-        for frame in self.LeafGenerator(mx, atEnd=False, clean=True):
+        # (white frames start before mx: keep only the keys after the leaf)
+        following = self.LeafGenerator(mx, atEnd=False, clean=True)
+        for frame in following.Range(mx, excludeSmallest=True):
             if frame is None:
                 break
             #pr "yielding frame after leaf", frame.getMinMax(check=True)
@@ -319,6 +324,10 @@ def test(size=1000, file1=os.path.join(TESTDIR, "shBase.dat"), detail=False):
             shadowTree.putDictionary(adds)
             shadowTree.delDictionary(dels)
         print size, version, "testing tree with caching", caching
+        # the key count includes delete marks and shadowed keys
+        count = shadowTree.estimateCount(None, None)
+        if abs(count-len(initial)-len(whiteTree.sortedKeysAndValues()[0]))>size/10:
+            raise ValueError, "bad key count estimate "+repr(count)
         fTree.compareDictAndTree(final, shadowTree, detail=detail)
         print
     print "tests complete"
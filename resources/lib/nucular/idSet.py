@@ -0,0 +1,195 @@
+
+"""
+Sets of entry identities held as sorted lists.
+
+Query evaluation combines the ids selected by filters with
+intersections, unions and differences.  Holding each set as one sorted
+list (rather than a dictionary) makes those merges of sorted sequences,
+gives the identities in order without sorting and lets the ids be
+passed straight to seeks that expect them sorted.
+IdSets are not modified once made: the operations return new sets.
+"""
+
+from bisect import bisect_left
+
+# an intersection probes the larger set by bisection when it is this many times bigger
+GALLOPFACTOR = 8
+
+class IdSet:
+    "immutable set of ids as a sorted list without duplicates"
+
+    def __init__(self, ids=(), isSorted=False):
+        """ids is any sequence of ids; if isSorted is set it must be
+           a sorted list without duplicates and is used as is"""
+        if not isSorted:
+            ids = list(ids)
+            ids.sort()
+            ids = unique(ids)
+        self.ids = ids
+
+    def __repr__(self):
+        return "IdSet(%s)" % repr(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __eq__(self, other):
+        return isinstance(other, IdSet) and self.ids==other.ids
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def has_key(self, identity):
+        ids = self.ids
+        i = bisect_left(ids, identity)
+        return i<len(ids) and ids[i]==identity
+
+    __contains__ = has_key
+
+    def keys(self):
+        "the ids as a new sorted list"
+        return list(self.ids)
+
+    def intersect(self, other):
+        "ids in both self and other"
+        small = self.ids
+        big = other.ids
+        if len(small)>len(big):
+            (small, big) = (big, small)
+        nsmall = len(small)
+        nbig = len(big)
+        result = []
+        ap = result.append
+        if nsmall*GALLOPFACTOR<nbig:
+            # seek each id of the small set in the rest of the big one
+            j = 0
+            for identity in small:
+                j = bisect_left(big, identity, j)
+                if j>=nbig:
+                    break
+                if big[j]==identity:
+                    ap(identity)
+        else:
+            i = j = 0
+            while i<nsmall and j<nbig:
+                a = small[i]
+                b = big[j]
+                if a<b:
+                    i += 1
+                elif b<a:
+                    j += 1
+                else:
+                    ap(a)
+                    i += 1
+                    j += 1
+        return IdSet(result, True)
+
+    def union(self, other):
+        "ids in either self or other"
+        L1 = self.ids
+        L2 = other.ids
+        if not L1:
+            return other
+        if not L2:
+            return self
+        n1 = len(L1)
+        n2 = len(L2)
+        result = []
+        ap = result.append
+        i = j = 0
+        while i<n1 and j<n2:
+            a = L1[i]
+            b = L2[j]
+            if a<b:
+                ap(a)
+                i += 1
+            elif b<a:
+                ap(b)
+                j += 1
+            else:
+                ap(a)
+                i += 1
+                j += 1
+        result.extend(L1[i:])
+        result.extend(L2[j:])
+        return IdSet(result, True)
+
+    def difference(self, other):
+        "ids in self but not in other"
+        L1 = self.ids
+        L2 = other.ids
+        if not L1 or not L2:
+            return self
+        n2 = len(L2)
+        result = []
+        ap = result.append
+        j = 0
+        for a in L1:
+            while j<n2 and L2[j]<a:
+                j += 1
+            if j>=n2:
+                ap(a)
+            elif L2[j]!=a:
+                ap(a)
+        return IdSet(result, True)
+
+def unique(sortedList):
+    "sortedList without repeated elements"
+    result = []
+    ap = result.append
+    last = None
+    first = True
+    for x in sortedList:
+        if first or x!=last:
+            ap(x)
+            last = x
+            first = False
+    return result
+
+def fromKeys(keys, idIndex):
+    "IdSet of the ids at position idIndex of the index keys"
+    return IdSet([ k[idIndex] for k in keys ])
+
+def asIdSet(ids):
+    "an IdSet for ids (an IdSet, or a dictionary or sequence of ids)"
+    if isinstance(ids, IdSet):
+        return ids
+    if type(ids) is type({}):
+        ids = ids.keys()
+    return IdSet(ids)
+
+def test():
+    import random
+    random.seed(1)
+    for trial in xrange(200):
+        n1 = random.randint(0, 40)
+        n2 = random.choice([0, 5, 40, 400])
+        L1 = [ "id%03d" % random.randint(0, 500) for i in xrange(n1) ]
+        L2 = [ "id%03d" % random.randint(0, 500) for i in xrange(n2) ]
+        (s1, s2) = (IdSet(L1), IdSet(L2))
+        (d1, d2) = (dict.fromkeys(L1), dict.fromkeys(L2))
+        both = [ x for x in d1 if d2.has_key(x) ]
+        either = d1.keys()+[ x for x in d2 if not d1.has_key(x) ]
+        only = [ x for x in d1 if not d2.has_key(x) ]
+        for (a, b) in [(s1, s2), (s2, s1)]:
+            if a.intersect(b)!=IdSet(both):
+                raise ValueError, "bad intersection "+repr((a, b))
+            if a.union(b)!=IdSet(either):
+                raise ValueError, "bad union "+repr((a, b))
+        if s1.difference(s2)!=IdSet(only):
+            raise ValueError, "bad difference "+repr((s1, s2))
+        for x in L1+L2+["id999", ""]:
+            if s1.has_key(x)!=d1.has_key(x):
+                raise ValueError, "bad membership "+repr(x)
+    s = IdSet(["b", "a", "c", "a"])
+    if s.keys()!=["a", "b", "c"] or len(s)!=3 or "d" in s:
+        raise ValueError, "bad set "+repr(s)
+    if asIdSet({"a": 1})!=IdSet(["a"]) or fromKeys([("w", "b"), ("v", "b")], -1)!=IdSet(["b"]):
+        raise ValueError, "bad conversion"
+    print "idSet test ok"
+
+if __name__=="__main__":
+    test()
@@ -16,11 +16,18 @@ DefaultQueryTimeLimit = 20
 # QueryEvalMax or smaller.
 QueryEvalMax = 10000000
 
+# (no longer used: queries compare the costs below instead)
 # Queries will switch from intersecting Id lists to
 # examining values when
 #   #currentIds * switchfactor < #subqueryEstimate
 QuerySwitchFactor = 5000
 
+# Queries switch from intersecting Id lists to examining values when
+# describing and testing the current Ids costs less than using the index.
+# This is the cost of describing and testing one entry, in index key reads
+# (seeking a key costs pquery.SEEKCOST key reads).
+QueryTestCost = 40
+
 # This is the estimated desired size for buckets of
 # information to pass around when building the ltree indices
 # (if memory is thrashing lower this number.)
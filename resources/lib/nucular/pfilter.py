@@ -7,6 +7,9 @@ select entry identities based on a selection criterion
 """
 
 import entry
+import pquery
+from idSet import IdSet, fromKeys
+from types import TupleType
 from stringAnnotator import delimitMatches
 #from types import UnicodeType, StringType
 
@@ -16,6 +19,9 @@ from stringAnnotator import delimitMatches
 # HACKY! the subscript for IDs in all indexes of interest is -1
 IDINDEX = -1
 
+# candidates described together by a ProximateFilter
+DESCRIBEBATCH = 100
+
 class Filter:
     "container for a related query and match test, assumed to correspond"
     def __init__(self, query, test, idIndex=IDINDEX):
@@ -32,20 +38,35 @@ class Filter:
             return None
         return query.estimate()
     
+    def selectivity(self, total):
+        "estimated fraction of total entries selected (1.0 if not indexed)"
+        query = self.query
+        if query is None:
+            return 1.0
+        return query.selectivity(total)
+
     def evaluateD(self, truncateSize=None):
+        "the IdSet of ids selected by the filter"
         query = self.query
         if query is None:
             raise ValueError, "cannot evaluate: no query for "+repr(self.test)
-        D = self.query.evaluateD(selectIndex=self.idIndex, truncateSize=truncateSize)
-        result = {}
-        for ident in D.values():
-            result[ident] = ident
-        return result
+        return query.evaluateIds(self.idIndex, truncateSize)
     
     def evaluate(self):
-        result = self.evaluateD().values()
-        #result.sort()
-        return result
+        return self.evaluateD().keys()
+
+    def restrictable(self):
+        "true iff restrictD can select from the index"
+        return self.query is not None
+
+    def describesCandidates(self):
+        "true iff evaluateD and restrictD describe the candidate ids they test"
+        return False
+
+    def restrictD(self, ids):
+        "the IdSet of ids (an IdSet) selected by the filter, seeking them in the index"
+        (keys, values) = self.query.restrictLists(ids.ids)
+        return fromKeys(keys, self.idIndex)
 
     def annotate(self, dictionary, startmark, endmark):
         "annotate matching part of dictionary contents, delimiting with start and end mark"
@@ -244,6 +265,15 @@ class AttributeRangeTest:
                 return True
         return False
 
+class TimeWindowTest(AttributeRangeTest):
+    "test whether a numeric (eg, millisecond time) attribute lies in low..high inclusive."
+    def annotate(self, dictionary, startmark, endmark):
+        # numbers are not annotated
+        return dictionary.copy()
+
+    def toXML(self):
+        return '<window n="%s" low="%s" high="%s"/>' % (self.attr, self.low, self.high)
+
 class AttributeWordPrefixTest:
     "test if an entry contains a word as a word prefix in specified attribute."
     def __init__(self, attr, word, splitter):
@@ -284,16 +314,15 @@ class AttributeWordPrefixTest:
     
     def __call__(self, entry):
         #description = entry.D
-        description = entry.attrDict(indexable=True)
+        # split values once per entry for all the tests of a query
+        description = entry.attrTokens(self.splitter)
         #pr "testing", description, "looking in", self.attr, "for", self.word
         L = description.get(self.attr)
         if L is None:
             return False
         word = self.word
-        splitter = self.splitter
         minlength = entry.MINWORDLENGTH
-        for v in L:
-            splitv = splitter(v)
+        for splitv in L:
             for vword in splitv:
                 if len(vword)>minlength and vword.startswith(word):
                     return True
@@ -339,21 +368,330 @@ class WordPrefixTest:
     
     def __call__(self, entry):
         #description = entry.D
-        description = entry.attrDict(indexable=True)
-        splitter = self.splitter
+        description = entry.attrTokens(self.splitter)
         word = self.word
         #attrs = description.keys()
         # "description = ", description
         minlength = entry.MINWORDLENGTH
         for attr in description.keys(): #attrs:
             L = description[attr]
-            for v in L:
-                splitv = splitter(v)
+            for splitv in L:
                 for vword in splitv:
                     if len(vword)>minlength and vword.startswith(word):
                         return True
         return False
 
+class PhraseFilter(Filter):
+    """
+    select entries where words appear consecutively in an attribute
+    using positional postings (attr, word, id) --> positions only.
+    queries is a list of (offset, PrefixTuple) for the indexed words of the phrase.
+    """
+    def __init__(self, queries, test, idIndex=IDINDEX):
+        self.queries = queries
+        self.test = test
+        self.idIndex = idIndex
+        self.query = None
+        if queries:
+            # the most selective word drives the evaluation
+            L = [ (q.estimate(), offset, q) for (offset, q) in queries ]
+            L.sort()
+            self.query = L[0][2]
+            self.ordered = [ (offset, q) for (est, offset, q) in L ]
+
+    def evaluateD(self, truncateSize=None):
+        return self.phraseStarts(None, truncateSize)
+
+    def restrictD(self, ids):
+        return self.phraseStarts(ids)
+
+    def phraseStarts(self, ids=None, truncateSize=None):
+        "IdSet of ids (of the IdSet ids if given) with the phrase"
+        if self.query is None:
+            raise ValueError, "cannot evaluate: no indexed words for "+repr(self.test)
+        idIndex = self.idIndex
+        starts = None
+        for (offset, q) in self.ordered:
+            if starts is not None:
+                # only look for the ids still in the running
+                ids = starts.keys()
+                ids.sort()
+                (keys, values) = q.restrictLists(ids)
+            elif ids is not None:
+                (keys, values) = q.restrictLists(ids.ids)
+            else:
+                (keys, values) = q.index.rangeLists(q.firstKey(), q.beyondEndKey(), truncateSize)
+            found = {}
+            for i in xrange(len(keys)):
+                ident = keys[i][idIndex]
+                if starts is not None and not starts.has_key(ident):
+                    continue
+                positions = values[i]
+                if type(positions) is not TupleType:
+                    raise ValueError, "archive has no positional postings for phrase search"
+                D = found.get(ident)
+                if D is None:
+                    D = found[ident] = {}
+                for p in positions:
+                    D[p-offset] = 1
+            if starts is not None:
+                # keep phrase start positions consistent with all words so far
+                for ident in found.keys():
+                    D = found[ident]
+                    previous = starts[ident]
+                    for p in D.keys():
+                        if not previous.has_key(p):
+                            del D[p]
+                    if not D:
+                        del found[ident]
+            starts = found
+            if not starts:
+                break
+        return IdSet(starts.keys())
+
+class PhraseTest:
+    "test for words appearing consecutively in an attribute (short words match any word)"
+    def __init__(self, attr, words, splitter):
+        if not words:
+            raise ValueError, "some words are required! "+repr(words)
+        self.attr = attr
+        self.words = words
+        self.splitter = splitter
+
+    def suggestion(self, d, a, b):
+        raise ValueError, "phrase test cannot make suggestions"
+
+    def SuggestionTest(self):
+        return AttributeWordPrefixTest(self.attr, self.words[-1], self.splitter)
+
+    def annotate(self, dictionary, startmark, endmark):
+        # don't make any annotations for now
+        return dictionary
+
+    def toXML(self):
+        return '<phrase n="%s" words="%s"/>' % (self.attr, " ".join(self.words))
+
+    def __call__(self, entry):
+        description = entry.attrTokens(self.splitter)
+        L = description.get(self.attr)
+        if L is None:
+            return False
+        words = self.words
+        nwords = len(words)
+        minlength = entry.MINWORDLENGTH
+        for splitv in L:
+            for start in xrange(len(splitv)-nwords+1):
+                for i in xrange(nwords):
+                    word = words[i]
+                    if len(word)>minlength and not self.wordMatches(word, splitv[start+i]):
+                        break
+                else:
+                    return True
+        return False
+
+    def wordMatches(self, word, vword):
+        return vword.startswith(word)
+
+class FuzzyPhraseTest(PhraseTest):
+    "test for words appearing consecutively in an attribute, each as a prefix or within maxEdits edits"
+    def __init__(self, attr, words, maxEdits, splitter):
+        PhraseTest.__init__(self, attr, words, splitter)
+        self.maxEdits = maxEdits
+
+    def toXML(self):
+        return '<phrase n="%s" words="%s" edits="%s"/>' % (self.attr, " ".join(self.words), self.maxEdits)
+
+    def wordMatches(self, word, vword):
+        maxEdits = self.maxEdits
+        return vword.startswith(word) or editDistance(word, vword, maxEdits)<=maxEdits
+
+class FuzzyFilter(Filter):
+    """
+    select entries containing a word within maxEdits edits of word.
+    Candidate words come from the trigram index (trigram, word) --> t:
+    a word within k edits shares all but at most 3k trigrams with word.
+    The candidates within the edit distance are then looked up in the
+    word postings index as keys prefix+(candidate, id).
+    """
+    def __init__(self, gramIndex, index, prefix, word, maxEdits, test, idIndex=IDINDEX):
+        self.gramIndex = gramIndex
+        self.index = index
+        self.prefix = prefix
+        self.word = word
+        self.maxEdits = maxEdits
+        self.test = test
+        self.idIndex = idIndex
+        self.query = None
+        self.words = None
+
+    def candidates(self):
+        "indexed words within the edit distance (computed once)"
+        if self.words is None:
+            word = self.word
+            maxEdits = self.maxEdits
+            grams = entry.trigrams(word)
+            counts = {}
+            gramIndex = self.gramIndex
+            for g in grams:
+                (keys, values) = gramIndex.rangeLists( (g,), (g, pquery.MAXIMUMOBJECT) )
+                for k in keys:
+                    w = k[1]
+                    counts[w] = counts.get(w, 0)+1
+            # short words may share no trigram within the edit distance: those are missed
+            need = max(1, len(grams)-3*maxEdits)
+            words = []
+            for w in counts:
+                if counts[w]>=need and editDistance(word, w, maxEdits)<=maxEdits:
+                    words.append(w)
+            words.sort()
+            self.words = words
+        return self.words
+
+    def queries(self):
+        index = self.index
+        prefix = self.prefix
+        return [ pquery.MatchTuple(index, prefix+(w,)) for w in self.candidates() ]
+
+    def estimate(self):
+        result = 0
+        for q in self.queries():
+            result += q.estimate()
+        return result
+
+    def selectivity(self, total):
+        return min(1.0, float(self.estimate())/max(total, 1))
+
+    def evaluateD(self, truncateSize=None):
+        ids = []
+        for q in self.queries():
+            ids.extend(q.evaluateIds(self.idIndex, truncateSize).ids)
+        return IdSet(ids)
+
+    def restrictable(self):
+        return True
+
+    def restrictD(self, ids):
+        keys = []
+        for q in self.queries():
+            keys.extend(q.restrictLists(ids.ids)[0])
+        return fromKeys(keys, self.idIndex)
+
+class FuzzyWordTest:
+    "test for a word within maxEdits edits of word in attr (or any attribute if attr is None)"
+    def __init__(self, attr, word, maxEdits, splitter):
+        self.attr = attr
+        self.word = word
+        self.maxEdits = maxEdits
+        self.splitter = splitter
+
+    def suggestion(self, d, a, b):
+        raise ValueError, "fuzzy test cannot make suggestions"
+
+    def SuggestionTest(self):
+        if self.attr is None:
+            return WordPrefixTest(self.word, self.splitter)
+        return AttributeWordPrefixTest(self.attr, self.word, self.splitter)
+
+    def annotate(self, dictionary, startmark, endmark):
+        # don't make any annotations for now
+        return dictionary
+
+    def toXML(self):
+        if self.attr is None:
+            return '<fuzzy word="%s" edits="%s"/>' % (self.word, self.maxEdits)
+        return '<fuzzy n="%s" word="%s" edits="%s"/>' % (self.attr, self.word, self.maxEdits)
+
+    def __call__(self, entry):
+        description = entry.attrTokens(self.splitter)
+        if self.attr is None:
+            Ls = description.values()
+        else:
+            Ls = [ description.get(self.attr, []) ]
+        word = self.word
+        maxEdits = self.maxEdits
+        minlength = entry.MINWORDLENGTH
+        for L in Ls:
+            for splitv in L:
+                for vword in splitv:
+                    if len(vword)>minlength and editDistance(word, vword, maxEdits)<=maxEdits:
+                        return True
+        return False
+
+def editDistance(a, b, limit=None):
+    "Levenshtein distance from a to b; distances over limit (if given) may be reported as limit+1"
+    if limit is not None and abs(len(a)-len(b))>limit:
+        return limit+1
+    previous = range(len(b)+1)
+    for i in xrange(1, len(a)+1):
+        ca = a[i-1]
+        current = [i]
+        for j in xrange(1, len(b)+1):
+            cost = 1
+            if ca==b[j-1]:
+                cost = 0
+            current.append( min(previous[j]+1, current[j-1]+1, previous[j-1]+cost) )
+        if limit is not None and min(current)>limit:
+            return limit+1
+        previous = current
+    return previous[-1]
+
+class ProximateFilter(Filter):
+    """
+    select entries where words appear in order near eachother in an attribute.
+    queries is a list of PrefixTuples into the word postings, one per word:
+    only the entries in the postings of every word are candidates, and just
+    those are described (with describeMany) and tested.
+    """
+    def __init__(self, queries, test, describeMany, idIndex=IDINDEX):
+        self.queries = queries
+        self.test = test
+        self.describeMany = describeMany
+        self.idIndex = idIndex
+        # the most selective word drives the evaluation
+        L = [ (queries[i].estimate(), i, queries[i]) for i in xrange(len(queries)) ]
+        L.sort()
+        self.ordered = [ q for (est, i, q) in L ]
+        self.query = self.ordered[0]
+
+    def evaluateD(self, truncateSize=None):
+        return self.proximate(None, truncateSize)
+
+    def restrictD(self, ids):
+        return self.proximate(ids)
+
+    def describesCandidates(self):
+        return True
+
+    def candidates(self, ids=None, truncateSize=None):
+        "IdSet of ids (of the IdSet ids if given) in the postings of all the words"
+        idIndex = self.idIndex
+        result = ids
+        for q in self.ordered:
+            if result is None:
+                result = q.evaluateIds(idIndex, truncateSize)
+            else:
+                (keys, values) = q.restrictLists(result.ids)
+                result = fromKeys(keys, idIndex)
+            if not result:
+                break
+        return result
+
+    def proximate(self, ids=None, truncateSize=None):
+        "IdSet of ids (of the IdSet ids if given) with the words near eachother"
+        candidates = self.candidates(ids, truncateSize).ids
+        test = self.test
+        describeMany = self.describeMany
+        kept = []
+        for start in xrange(0, len(candidates), DESCRIBEBATCH):
+            for description in describeMany(candidates[start:start+DESCRIBEBATCH]):
+                if test(description):
+                    kept.append(description.identity())
+        return IdSet(kept, True)
+
+    def SuggestionFilter(self):
+        # the suggestion test completes the last word
+        return Filter(self.queries[-1], self.test.SuggestionTest(), self.idIndex)
+
 class ProximateTest:
     "test for proximate words in any attribute"
     def __init__(self, words, limit, splitter):
@@ -396,20 +734,16 @@ class ProximateTest:
 
     # faster:
     def __call__(self, entry):
-        description = entry.attrDict(indexable=True)
-        splitter = self.splitter
+        # the words are split once per entry: no need for quickProximateFilter
+        description = entry.attrTokens(self.splitter)
         words = self.words
         limit = self.limit
         minlength = entry.MINWORDLENGTH
         for attr in description.keys():
             L = description[attr]
-            for v in L:
-                if v:#
-                    v = v.lower()
-                    if quickProximateFilter(v, words):
-                        splitv = splitter(v)
-                        if proximateMatchAnywhere(splitv, words, minlength, limit):
-                            return True
+            for splitv in L:
+                if proximateMatchAnywhere(splitv, words, minlength, limit):
+                    return True
         return False
 
 def quickProximateFilter(text, queryWords, chunksize=100, deltasize=20):
@@ -455,7 +789,43 @@ def quickProximateFilter(text, queryWords, chunksize=100, deltasize=20):
     # all spans exceed chunksize
     return False
 
-def proximateMatchAnywhere(splitWords, queryWords, minLength, limit, fromSplitIndex=0, toSplitIndex=None, queryIndex=0):
+def proximateMatchAnywhere(splitWords, queryWords, minLength, limit):
+    """
+    true iff splitWords has words (longer than minLength) starting with each
+    of queryWords in order, each within limit words after the one before.
+    One pass over splitWords, no recursion, at most len(queryWords) prefix
+    tests per word: last[k] is the most recent position ending a match of
+    queryWords[:k+1], the best start for a match of the next query word.
+    """
+    lastQuery = len(queryWords)-1
+    reach = limit+1
+    last = [-reach-1] * (lastQuery+1)
+    first = queryWords[0]
+    top = 0 # query words after the first which can match at the next word
+    for i in xrange(len(splitWords)):
+        word = splitWords[i]
+        if len(word)<=minLength:
+            continue
+        # later query words first: word i extends the matches ending before it
+        k = top
+        while k>0:
+            if i-last[k-1]<=reach and word.startswith(queryWords[k]):
+                if k==lastQuery:
+                    return True
+                last[k] = i
+            k -= 1
+        if word.startswith(first):
+            if not lastQuery:
+                return True
+            last[0] = i
+        # usually no match is in reach and only the first query word is tested
+        top = lastQuery
+        while top>0 and i-last[top-1]>=reach:
+            top -= 1
+    return False
+
+def recursiveProximateMatchAnywhere(splitWords, queryWords, minLength, limit, fromSplitIndex=0, toSplitIndex=None, queryIndex=0):
+    "former (recursive) implementation of proximateMatchAnywhere, kept for proximateBenchmark"
     #pr "pma", splitWords[fromSplitIndex:toSplitIndex], queryWords[queryIndex:], "minlength=", minLength
     nsplit = len(splitWords)
     nquery = len(queryWords)
@@ -474,7 +844,7 @@ def proximateMatchAnywhere(splitWords, queryWords, minLength, limit, fromSplitIn
                 # match!
                 return True
             else:
-                test = proximateMatchAnywhere(splitWords, queryWords, minLength, limit, i+1, i+limit+2, nextQueryIndex)
+                test = recursiveProximateMatchAnywhere(splitWords, queryWords, minLength, limit, i+1, i+limit+2, nextQueryIndex)
                 if test:
                     return test
     return False
@@ -487,6 +857,85 @@ def pmaTest():
     words = "test this".split()
     if proximateMatchAnywhere(splitWords, words, 1, 30):
         raise ValueError, "match on second test"
+    # agrees with the recursive implementation
+    import random
+    random.seed(3)
+    for trial in xrange(2000):
+        splitWords = [ random.choice(["a", "ab", "abc", "b", "bc", "bcd", "c"]) for i in xrange(random.randint(0, 12)) ]
+        words = [ random.choice(["a", "ab", "b", "bc", "c"]) for i in xrange(random.randint(1, 3)) ]
+        minLength = random.randint(0, 2)
+        limit = random.randint(0, 3)
+        expected = recursiveProximateMatchAnywhere(splitWords, words, minLength, limit)
+        if proximateMatchAnywhere(splitWords, words, minLength, limit)!=expected:
+            raise ValueError, "on %s expected %s" % ((splitWords, words, minLength, limit), expected)
+    print "pmaTest complete with no errors"
+
+def proximateBenchmark(nlines=20000, limit=2):
+    """time proximateMatchAnywhere on split subtitle cues against the former test
+       (quickProximateFilter, then splitting and the recursive match), on all the
+       cues and on the candidates a ProximateFilter tests (cues with every word)
+       which the quick filter does not help with"""
+    import random
+    import time
+    random.seed(7)
+    vocabulary = ("i you what the to it is that and of a in me we this know do not have "
+                  "don't be was your no for he on just are with right here all they get "
+                  "can go yeah out there come now want like up so think okay gonna back "
+                  "time well tell about where who got one see look let's man sorry night "
+                  "never something mean hey father captain ship money kill movie number").split()
+    # subtitle cues: a few words, commoner words much more often (roughly zipfian)
+    cumulative = []
+    total = 0
+    for i in xrange(len(vocabulary)):
+        total += 1.0/(i+1)
+        cumulative.append(total)
+    lines = []
+    for i in xrange(nlines):
+        words = []
+        for j in xrange(random.randint(2, 12)):
+            x = random.random()*total
+            k = 0
+            while cumulative[k]<x:
+                k += 1
+            words.append(vocabulary[k])
+        lines.append(" ".join(words).capitalize()+random.choice([".", "?", "!", "..."]))
+        if random.random()<0.02:
+            # song lyrics
+            words = ["yeah,"]*random.randint(6, 14) + ["oh"]*random.randint(1, 4) + ["come", "on!"]
+            lines.append(" ".join(words).capitalize())
+    minLength = entry.Entry.MINWORDLENGTH
+    for text in ["know what", "come back", "you don't know", "tell the captain", "yeah yeah yeah come"]:
+        words = tuple(entry.parseWords(text))
+        allCues = [ (line, entry.parseWords(line)) for line in lines ]
+        candidates = []
+        for (line, splitv) in allCues:
+            for w in words:
+                for x in splitv:
+                    if len(x)>minLength and x.startswith(w):
+                        break
+                else:
+                    break
+            else:
+                candidates.append( (line, splitv) )
+        for (label, cues) in [ ("all", allCues), ("candidate", candidates) ]:
+            now = time.time()
+            old = 0
+            for (line, splitv) in cues:
+                text = line.lower()
+                if quickProximateFilter(text, words) and \
+                       recursiveProximateMatchAnywhere(entry.parseWords(text), words, minLength, limit):
+                    old += 1
+            oldTime = time.time()-now
+            now = time.time()
+            new = 0
+            for (line, splitv) in cues:
+                if proximateMatchAnywhere(splitv, words, minLength, limit):
+                    new += 1
+            newTime = time.time()-now
+            if old!=new:
+                raise ValueError, "%s: %s matches, expected %s" % (words, new, old)
+            print "%s: %s of %s %s cues match: former %.4fs, split cues %.4fs" % (
+                " ".join(words), new, len(cues), label, oldTime, newTime)
 
 def proximateMatch(splitWords, index, words, limit, minlength):
     "bad implementation!"
@@ -533,6 +982,65 @@ def proximateTest():
             raise ValueError, "on %s expected %s, got %s" % ((words, limit, expected), expected, test)
     print "proximateTest complete with no errors"
 
+def proximateFilterTest():
+    import Nucular
+    archive = Nucular.Nucular(None, memory=True)
+    archive.create()
+    texts = ["red apple", "red and green apple", "apple red", "red sky", "red on the far side of an apple"]
+    for i in xrange(len(texts)):
+        archive.indexDictionary("e%s" % i, {"content": texts[i]})
+    archive.store()
+    f = archive.ProximateFilter(("red", "apple"), 2)
+    if f.estimate() is None:
+        raise ValueError, "no estimate for proximate filter"
+    described = archive.describeCount
+    if f.evaluateD()!=IdSet(["e0", "e1"]):
+        raise ValueError, "bad proximate evaluation "+repr(f.evaluateD())
+    # only the 4 entries with both words are described
+    if archive.describeCount-described!=4:
+        raise ValueError, "described %s entries" % (archive.describeCount-described)
+    if f.restrictD(IdSet(["e1", "e2", "e3"]))!=IdSet(["e1"]):
+        raise ValueError, "bad proximate restriction"
+    # a near filter alone drives the evaluation
+    query = archive.Query()
+    query.addMiscellaneousFilter("near", f)
+    (result, status) = query.evaluate(maxBufferLimit=10)
+    if result is None or result.identities()!=["e0", "e1"]:
+        raise ValueError, "bad near query "+repr(status)
+    # a near filter matching many entries is not scanned into a small window:
+    # only the window's candidates are described
+    archive = Nucular.Nucular(None, memory=True)
+    archive.create()
+    for i in xrange(3000):
+        archive.indexDictionary("c%04d" % i, {"content": "red apple %s" % i, "start": i*1000})
+    archive.store()
+    query = archive.Query()
+    query.timeWindow("start", 0, 199000)
+    query.addMiscellaneousFilter("near", archive.ProximateFilter(("red", "apple"), 2))
+    described = archive.describeCount
+    plan = query.explain()
+    if [ step["method"] for step in plan ]!=["scan", "test"] or plan[-1]["size"]!=200:
+        raise ValueError, "bad near plan "+repr(plan)
+    if archive.describeCount-described!=200:
+        raise ValueError, "described %s entries" % (archive.describeCount-described)
+    print "proximateFilterTest complete with no errors"
+
+def editDistanceTest():
+    for (a, b, limit, expected) in [ ("number", "number", None, 0),
+                                     ("nmber", "number", None, 1),
+                                     ("moive", "movie", None, 2),
+                                     ("kitten", "sitting", None, 3),
+                                     ("kitten", "sitting", 1, 2),
+                                     ("", "abc", None, 3),
+                                     ]:
+        test = editDistance(a, b, limit)
+        if test!=expected:
+            raise ValueError, "on %s expected %s, got %s" % ((a, b, limit), expected, test)
+    print "editDistanceTest complete with no errors"
 
 if __name__=="__main__":
     proximateTest()
+    pmaTest()
+    proximateBenchmark()
+    proximateFilterTest()
+    editDistanceTest()
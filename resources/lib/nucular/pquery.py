@@ -10,6 +10,8 @@ Used to implement queries.
 """
 
 from types import StringType, UnicodeType
+from bisect import bisect_left, bisect_right
+from idSet import IdSet
 #import parameters
 
 class Extremum:
@@ -28,6 +30,9 @@ class Extremum:
 MINIMUMOBJECT = Extremum(-1)
 MAXIMUMOBJECT = Extremum(1)
 
+# a seek in a layered archive costs about as much as scanning this many keys
+SEEKCOST = 25
+
 # XXX can all three behaviours be safely emulated using perversions of "Range?"
 
 class MatchTuple:
@@ -45,20 +50,26 @@ class MatchTuple:
         
     def estimate(self):
         """
-        numeric estimate of result size
+        numeric estimate of result size (in keys, whatever the index)
         """
-        index = self.index
-        startkey = self.firstKey()
-        endkey = self.beyondEndKey()
-        startIndex = index.indexOf(startkey)
-        if endkey is None:
-            endIndex = index.lastIndex()
-        else:
-            endIndex = index.indexOf(endkey)
-        if startIndex>endIndex:
-            raise ValueError, "start should not be smaller than end in estimate"
-        return endIndex-startIndex
+        return self.index.estimateCount(self.firstKey(), self.beyondEndKey())
     
+    def selectivity(self, total):
+        """
+        estimated fraction of the total entries with a match.  Entries may have
+        several keys with an attribute (or other leading component), so the
+        estimate is compared with the estimate for all keys with that component.
+        """
+        est = self.estimate()
+        first = self.firstKey()
+        if len(first)>1:
+            whole = MatchTuple(self.index, first[:1]).estimate()
+        else:
+            whole = total
+        if whole<=0:
+            return 1.0
+        return min(1.0, float(est)/whole)
+
     def evaluateD(self, selectIndex=None, truncateSize=None):
         """
         generate the matching results as dictionary index->match.
@@ -116,6 +127,11 @@ class MatchTuple:
 #                 kv = None # beyond the last match
 #         return resultsD
     
+    def evaluateIds(self, selectIndex, truncateSize=None):
+        "IdSet of the key entries at selectIndex (the ids, usually) of the matches"
+        (keys, values) = self.index.rangeLists(self.firstKey(), self.beyondEndKey(), truncateSize)
+        return IdSet([ k[selectIndex] for k in keys ])
+
     def evaluate(self):
         "same as evaluateD, but return a list"
         D = self.evaluateD()
@@ -126,6 +142,29 @@ class MatchTuple:
             result[i] = D[i]
         return result
     
+    def matchedTerms(self):
+        "the key prefixes (whole keys but the id) matched, None if unknown (tuple must be a whole key but the id)"
+        return [self.tuple]
+
+    def restrictLists(self, ids):
+        """(keys, values) for matches whose id (last key component) is in
+           the sorted list ids, seeking each term's postings for the ids
+           instead of scanning them when the terms are known and that is cheaper."""
+        terms = self.matchedTerms()
+        index = self.index
+        if terms is None or len(terms)*len(ids)*SEEKCOST>self.estimate():
+            (keys, values) = index.rangeLists(self.firstKey(), self.beyondEndKey())
+            D = dict.fromkeys(ids)
+            L = [ i for i in xrange(len(keys)) if D.has_key(keys[i][-1]) ]
+            return ([ keys[i] for i in L ], [ values[i] for i in L ])
+        keys = []
+        values = []
+        for term in terms:
+            (tkeys, tvalues) = leapfrog(index, term, ids)
+            keys.extend(tkeys)
+            values.extend(tvalues)
+        return (keys, values)
+
     def matches(self, matchtuple):
         # aggregate this!
         # "Match.matches"
@@ -141,7 +180,46 @@ class MatchTuple:
         return tup+(MAXIMUMOBJECT,)
         
 class PrefixTuple(MatchTuple):
-    "first part of tuple must match and last entry must be a prefix"
+    """first part of tuple must match and last entry must be a prefix.
+       terms if given is the termDictionary.TermDictionary for the index."""
+    def __init__(self, index, tuple, terms=None):
+        MatchTuple.__init__(self, index, tuple)
+        self.terms = terms
+
+    def estimate(self):
+        terms = self.terms
+        if terms is None:
+            return MatchTuple.estimate(self)
+        return terms.count(self.firstKey(), self.beyondEndKey())
+
+    def evaluateD(self, selectIndex=None, truncateSize=None):
+        terms = self.terms
+        if terms is not None and not terms.count(self.firstKey(), self.beyondEndKey()):
+            return {} # no word has the prefix: don't touch the index
+        return MatchTuple.evaluateD(self, selectIndex, truncateSize)
+
+    def selectivity(self, total):
+        if self.terms is None:
+            return MatchTuple.selectivity(self, total)
+        # posting counts are document frequencies
+        return min(1.0, float(self.estimate())/max(total, 1))
+
+    def evaluateIds(self, selectIndex, truncateSize=None):
+        terms = self.terms
+        if terms is not None and not terms.count(self.firstKey(), self.beyondEndKey()):
+            return IdSet()
+        return MatchTuple.evaluateIds(self, selectIndex, truncateSize)
+
+    def expand(self):
+        "matching terms (word prefix expansion) if the term dictionary is known, else None"
+        terms = self.terms
+        if terms is None:
+            return None
+        return terms.expand(self.firstKey(), self.beyondEndKey())
+
+    def matchedTerms(self):
+        return self.expand()
+
     def matches(self, matchtuple):
         # could inline
         # "PrefixTuple.matches"
@@ -207,6 +285,95 @@ class Range(MatchTuple):
     def beyondEndKey(self):
         return self.endTuple
 
+    def matchedTerms(self):
+        return None
+
+def leapfrog(index, term, ids):
+    """
+    (keys, values) for the keys term+(id,) of index with id in the sorted
+    list ids.  Seeks alternate between the postings (the next key at or
+    after the current id) and ids (the first id at or after that key), so
+    runs of ids or postings missing from the other are skipped.
+    """
+    keys = []
+    values = []
+    i = 0
+    n = len(ids)
+    nterm = len(term)
+    while i<n:
+        kv = index.findAtOrNextKeyValue(term+(ids[i],))
+        if kv is None:
+            break
+        (key, value) = kv
+        if key[:nterm]!=term:
+            break # beyond the postings for term
+        found = key[-1]
+        if found==ids[i]:
+            keys.append(key)
+            values.append(value)
+            i += 1
+        else:
+            i = bisect_left(ids, found, i)
+    return (keys, values)
+
+class RangeCache:
+    """
+    Wrapper for an index (which must not change) remembering the keys and
+    values of recent range scans.  A range inside a remembered range (for
+    example prefix "abc" after prefix "ab") is sliced out of it without
+    touching the index.
+    """
+    def __init__(self, index, maxRanges=8):
+        self.index = index
+        self.maxRanges = maxRanges
+        self.ranges = [] # (fromKey, toKey, offset, keys, values), most recent first
+        self.scans = 0 # number of ranges read from the index
+        self.hits = 0 # number of ranges sliced from remembered ones
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def cached(self, fromKey, toKey):
+        "remembered range holding fromKey..toKey or None"
+        ranges = self.ranges
+        for i in xrange(len(ranges)):
+            r = ranges[i]
+            if r[0]<=fromKey and toKey<=r[1]:
+                if i:
+                    del ranges[i]
+                    ranges.insert(0, r)
+                return r
+        return None
+
+    def rangeLists(self, fromKey, toKey, truncateSize=None):
+        if truncateSize is not None:
+            # partial scans are not remembered
+            return self.index.rangeLists(fromKey, toKey, truncateSize)
+        r = self.cached(fromKey, toKey)
+        if r is None:
+            index = self.index
+            (keys, values) = index.rangeLists(fromKey, toKey)
+            self.scans += 1
+            ranges = self.ranges
+            ranges.insert(0, (fromKey, toKey, index.indexOf(fromKey), keys, values))
+            del ranges[self.maxRanges:]
+            return (keys, values)
+        self.hits += 1
+        (cachedFrom, cachedTo, offset, keys, values) = r
+        start = bisect_left(keys, fromKey)
+        end = bisect_right(keys, toKey)
+        return (keys[start:end], values[start:end])
+
+    def rangeDict(self, fromKey, toKey, truncateSize=None):
+        (keys, values) = self.rangeLists(fromKey, toKey, truncateSize)
+        return dict(zip(keys, values))
+
+    def indexOf(self, key):
+        for (cachedFrom, cachedTo, offset, keys, values) in self.ranges:
+            if cachedFrom<=key<=cachedTo:
+                return offset+bisect_left(keys, key)
+        return self.index.indexOf(key)
+
 def test():
     # in memory test: no disk storage required
     #import kisstree
@@ -280,6 +447,28 @@ def checkResult(result, est, D, lower, upper):
         if D.get(keypart)!=valuepart:
             raise ValueError, "can't find %s in dictionary: found %s" % (repr(t), repr(valuepart))
 
+def leapfrogTest():
+    from frames import fmemory
+    M = fmemory.MemoryArchive().sessionMapping("test")
+    D = {}
+    for x in xrange(0, 1000, 3):
+        D[ ("a", "%04d" % x) ] = x
+        if x%2:
+            D[ ("ab", "%04d" % x) ] = -x
+    M.putDictionary(D)
+    ids = [ "%04d" % x for x in xrange(0, 1200, 5) ]
+    (keys, values) = leapfrog(M, ("a",), ids)
+    expected = [ ("a", "%04d" % x) for x in xrange(0, 1000, 15) ]
+    if keys!=expected or values!=[ D[k] for k in keys ]:
+        raise ValueError, "bad leapfrog "+repr(keys)
+    P = PrefixTuple(M, ("a",))
+    (keys, values) = P.restrictLists(ids)
+    expected = [ k for k in D if k[1] in ids ]
+    expected.sort()
+    if keys!=expected:
+        raise ValueError, "bad restriction "+repr(keys)
+    print "leapfrogTest ok"
+
 if __name__=="__main__":
     test()
 
@@ -0,0 +1,152 @@
+
+"""
+Profiles of query evaluations.
+
+NucularQuery.evaluate records a QueryProfile for every evaluation: the
+plan steps (see NucularQuery.explain) with the estimate, actual size,
+elapsed time and tree nodes read of each filter, and for the whole
+evaluation the elapsed time, tree nodes read from file, cache hits and
+entries described.  Profiles can be appended to a trace file, one JSON
+object per line, to find slow queries without a debugger.
+"""
+
+import time
+from types import StringType, UnicodeType, IntType, LongType, FloatType, BooleanType, \
+     ListType, TupleType, DictType
+from frames import frameGenerators
+
+class QueryProfile:
+    "measurements of one query evaluation"
+
+    def __init__(self, query):
+        self.query = query.toXML()
+        self.steps = [] # the plan of the evaluation
+        self.status = None
+        self.size = None # ids in the result, if any
+        self.cacheHit = False # set if the result was reused from the result cache
+        self.cacheHits = 0 # result and range cache hits during the evaluation
+        self.nodesRead = 0 # tree nodes read from file
+        self.describes = 0 # entries described
+        self.elapsed = None
+        self.collection = query.collection
+        self.started = time.time()
+        self.counts = self.counters()
+
+    def __repr__(self):
+        return "QueryProfile(%s)" % repr(self.asDictionary())
+
+    def counters(self):
+        "current (cache hits, nodes read, describes) totals"
+        collection = self.collection
+        return (collection.cacheHits(), frameGenerators.nodesRead, collection.describeCount)
+
+    def finish(self, result, status, steps):
+        "record the outcome of the evaluation"
+        self.elapsed = time.time()-self.started
+        self.status = status
+        self.steps = steps
+        if result is not None:
+            self.size = result.size()
+        now = self.counters()
+        (self.cacheHits, self.nodesRead, self.describes) = [ now[i]-self.counts[i] for i in xrange(len(now)) ]
+
+    def asDictionary(self):
+        return {"query": self.query, "steps": self.steps, "status": self.status, "size": self.size,
+                "cacheHit": self.cacheHit, "cacheHits": self.cacheHits, "nodesRead": self.nodesRead,
+                "describes": self.describes, "elapsed": self.elapsed, "time": self.started}
+
+    def toJSON(self):
+        "the profile as a one line JSON object"
+        return jsonString(self.asDictionary())
+
+    def write(self, filename):
+        "append the profile to the trace file filename"
+        f = open(filename, "a")
+        try:
+            f.write(self.toJSON()+"\n")
+        finally:
+            f.close()
+
+JSONESCAPES = {'"': '\\"', "\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+def jsonString(x):
+    "JSON text for x made of dictionaries, sequences, strings, numbers, booleans and None"
+    tx = type(x)
+    if x is None:
+        return "null"
+    if tx is BooleanType:
+        if x:
+            return "true"
+        return "false"
+    if tx in (IntType, LongType):
+        return str(x)
+    if tx is FloatType:
+        return repr(x)
+    if tx in (StringType, UnicodeType):
+        if tx is StringType:
+            x = x.decode("utf-8", "replace")
+        L = ['"']
+        for c in x:
+            escape = JSONESCAPES.get(c)
+            if escape is None:
+                if c<" " or c>"~":
+                    escape = "\\u%04x" % ord(c)
+                else:
+                    escape = c
+            L.append(escape)
+        L.append('"')
+        return str("".join(L))
+    if tx in (ListType, TupleType):
+        return "[%s]" % ", ".join([ jsonString(y) for y in x ])
+    if tx is DictType:
+        items = x.items()
+        items.sort()
+        return "{%s}" % ", ".join([ "%s: %s" % (jsonString(str(k)), jsonString(v)) for (k, v) in items ])
+    raise TypeError, "no JSON form for "+repr(x)
+
+def test(directory="/tmp/queryProfileTest"):
+    import os
+    import shutil
+    import Nucular
+    text = jsonString({"a": [1, 2.5, None, True], "b": u'q"\n\xe9', "c": (False, "x")})
+    if text!='{"a": [1, 2.5, null, true], "b": "q\\"\\n\\u00e9", "c": [false, "x"]}':
+        raise ValueError, "bad json "+repr(text)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    archive = Nucular.Nucular(directory)
+    archive.create()
+    for i in xrange(1000):
+        archive.indexDictionary("e%03d" % i, {"content": "number %s of the movie" % i})
+    archive.store(lazy=False)
+    # move the postings into the base trees, read node by node
+    archive.aggregateRecent()
+    archive.moveTransientToBase()
+    archive = Nucular.Nucular(directory, readOnly=True)
+    trace = os.path.join(directory, "queries.trace")
+    archive.traceQueries(trace)
+    query = archive.Query()
+    query.proximateWords("movie number")
+    (result, status) = query.evaluate()
+    profile = result.profile
+    if profile is not query.profile or profile.size!=0 or profile.cacheHit:
+        raise ValueError, "bad profile "+repr(profile)
+    # the first word is scanned (whether the second is sought depends on the
+    # estimates); the near filter is cheaper to test than to scan, and all
+    # 1000 candidates with both words are described once
+    methods = [ step["method"] for step in profile.steps ]
+    if len(methods)!=3 or methods[0]!="scan" or methods[2]!="test" or profile.describes!=1000:
+        raise ValueError, "bad steps "+repr(profile)
+    if profile.nodesRead<1 or profile.elapsed is None or profile.steps[0].get("elapsed") is None:
+        raise ValueError, "bad measurements "+repr(profile)
+    query.evaluate()
+    profile = query.profile
+    if not profile.cacheHit or profile.cacheHits!=1 or profile.describes or profile.nodesRead:
+        raise ValueError, "bad cached profile "+repr(profile)
+    lines = open(trace).readlines()
+    if len(lines)!=2 or lines[1]!=profile.toJSON()+"\n":
+        raise ValueError, "bad trace "+repr(lines)
+    shutil.rmtree(directory)
+    print "queryProfile test ok"
+
+if __name__=="__main__":
+    test()
@@ -0,0 +1,265 @@
+
+"""
+Ranking of query results from the word postings.
+
+Match features for every id in a result are collected from the postings
+of the word filters of the query, restricted to the result ids (seeking
+them when there are few, see pquery.MatchTuple.restrictLists):
+how many query words match a whole word or only a word prefix, how often
+they occur, how close together they occur (when the archive has
+positional postings) and, optionally, how far an attribute value of the
+entry is from a reference value (eg, a start time from the playback time).
+"""
+
+import entry
+import pfilter
+import pquery
+from types import TupleType
+
+class MatchFeatures:
+    "features of one result entry used by a scorer"
+    def __init__(self, identity, nterms):
+        self.identity = identity
+        self.nterms = nterms # number of query words
+        self.exact = 0 # query words matching a whole word
+        self.prefix = 0 # query words matching only as a word prefix
+        self.frequency = 0 # occurrences of query words
+        self.span = None # smallest word span holding all query words, if positions known
+        self.distance = None # distance of the near attribute value, if requested
+        self.positions = {} # attribute --> term number --> positions
+
+    def __repr__(self):
+        return "MatchFeatures(%s, exact=%s, prefix=%s, frequency=%s, span=%s, distance=%s)" % (
+            repr(self.identity), self.exact, self.prefix, self.frequency, self.span, self.distance)
+
+def defaultScorer(features):
+    "whole word matches beat prefix matches, then frequency, proximity and closeness (per minute)"
+    score = 10.0*features.exact + 3.0*features.prefix + features.frequency
+    span = features.span
+    if span is not None:
+        # consecutive words (span nterms-1) get the full proximity bonus
+        score += 5.0/(1+max(0, span-features.nterms+1))
+    distance = features.distance
+    if distance is not None:
+        score -= abs(distance)/60000.0
+    return score
+
+def termQueries(query):
+    """[(word, queries)...] for the query words of the word filters of a NucularQuery:
+       postings matching any of queries match word (exactly if the posting word is word)"""
+    result = []
+    seen = {}
+    items = query.filters.items()
+    items.sort()
+    for (key, f) in items:
+        if isinstance(f, pfilter.PhraseFilter):
+            terms = [ (q.tuple, q.tuple[-1], [q]) for (offset, q) in f.queries ]
+        elif isinstance(f, pfilter.FuzzyFilter):
+            # near misses count as prefix matches
+            terms = [ (key, f.word, f.queries()) ]
+        elif f.query is not None and isinstance(f.test, (pfilter.AttributeWordPrefixTest, pfilter.WordPrefixTest)):
+            terms = [ (f.query.tuple, f.query.tuple[-1], [f.query]) ]
+        else:
+            terms = []
+        for (termKey, word, queries) in terms:
+            if not seen.has_key(termKey):
+                seen[termKey] = 1
+                result.append( (word, queries) )
+    return result
+
+def minimalSpan(positionLists):
+    "smallest last-first over choices of one position from each list"
+    merged = []
+    for i in xrange(len(positionLists)):
+        for p in positionLists[i]:
+            merged.append( (p, i) )
+    merged.sort()
+    nlists = len(positionLists)
+    counts = [0] * nlists
+    covered = 0
+    best = None
+    first = 0
+    for (p, i) in merged:
+        if counts[i]==0:
+            covered += 1
+        counts[i] += 1
+        while covered==nlists:
+            (firstp, firsti) = merged[first]
+            span = p-firstp
+            if best is None or span<best:
+                best = span
+            counts[firsti] -= 1
+            if counts[firsti]==0:
+                covered -= 1
+            first += 1
+    return best
+
+def matchFeatures(query, identities, near=None):
+    """identity --> MatchFeatures for identities in a result of query.
+       near=(attr, value) records the distance from value of the (numeric) attr value."""
+    collection = query.collection
+    terms = termQueries(query)
+    nterms = len(terms)
+    result = {}
+    for identity in identities:
+        result[identity] = MatchFeatures(identity, nterms)
+    ids = result.keys()
+    ids.sort()
+    for termNumber in xrange(nterms):
+        (word, queries) = terms[termNumber]
+        keys = []
+        values = []
+        for q in queries:
+            (qkeys, qvalues) = q.restrictLists(ids)
+            keys.extend(qkeys)
+            values.extend(qvalues)
+        exactIds = {}
+        prefixIds = {}
+        for i in xrange(len(keys)):
+            key = keys[i]
+            features = result.get(key[-1])
+            if features is None:
+                continue
+            if key[-2]==word:
+                exactIds[features] = 1
+            else:
+                prefixIds[features] = 1
+            positions = values[i]
+            if type(positions) is TupleType:
+                features.frequency += len(positions)
+                # attribute word postings are keyed (attr, word, id)
+                if len(key)==3:
+                    D = features.positions.get(key[0])
+                    if D is None:
+                        D = features.positions[key[0]] = {}
+                    D.setdefault(termNumber, []).extend(positions)
+            else:
+                features.frequency += 1
+        for features in exactIds:
+            features.exact += 1
+        for features in prefixIds:
+            if not exactIds.has_key(features):
+                features.prefix += 1
+    if nterms:
+        for features in result.values():
+            for D in features.positions.values():
+                if len(D)==nterms:
+                    span = minimalSpan(D.values())
+                    if features.span is None or span<features.span:
+                        features.span = span
+    if near is not None:
+        nearDistances(query, ids, near, result)
+    return result
+
+def nearQuery(query, attr):
+    "query for the attribute index keys of attr, narrowed to a time window on attr in query if any"
+    items = query.filters.items()
+    items.sort()
+    for (key, f) in items:
+        if isinstance(f.test, pfilter.TimeWindowTest) and f.test.attr==attr:
+            return f.query
+    collection = query.collection
+    attr1 = collection.AttributeTranslations.get(attr, attr)
+    return pquery.MatchTuple(collection.AttrIndex.getExistingBaseIndex(), (attr1,))
+
+def nearDistances(query, ids, near, result):
+    """record in the features of result the distance of the (numeric) attr value
+       from value for near=(attr, value) and the sorted list ids: the attribute
+       keys are scanned unless describing the ids is cheaper."""
+    (attr, value) = near
+    q = nearQuery(query, attr)
+    if len(ids)*pquery.SEEKCOST<q.estimate():
+        pairs = []
+        for descr in query.collection.describeMany(ids, [attr]):
+            for v in descr.getValues(attr):
+                pairs.append( (descr.identity(), v) )
+    else:
+        (keys, values) = q.index.rangeLists(q.firstKey(), q.beyondEndKey())
+        pairs = [ (key[-1], key[1]) for key in keys ]
+    for (identity, v) in pairs:
+        features = result.get(identity)
+        if features is None or type(v) not in entry.NUMBERTYPES:
+            continue
+        distance = v-value
+        if features.distance is None or abs(distance)<abs(features.distance):
+            features.distance = distance
+
+def rankedArchive():
+    import Nucular
+    archive = Nucular.Nucular(None, memory=True)
+    archive.create()
+    archive.positionalIndexing()
+    texts = ["the numbers game", "a number of things", "number one number two",
+             "game of numbers", "nothing to see"]
+    for i in xrange(len(texts)):
+        archive.indexDictionary("c%s" % i, {"content": texts[i], "start": i*1000})
+    archive.store()
+    return archive
+
+def checkContents(hits, expected):
+    contents = [ hit["content"] for hit in hits ]
+    if contents!=expected:
+        raise ValueError, "expected %s, got %s" % (expected, contents)
+
+def topKTest():
+    archive = rankedArchive()
+    query = archive.Query()
+    query.attributeWord("content", "number")
+    # whole word matches first, more occurrences first
+    checkContents(query.topK(2), ["number one number two", "a number of things"])
+    query = archive.Query()
+    query.attributeWord("content", "numbers game")
+    # adjacent words beat separated ones
+    checkContents(query.topK(5), ["the numbers game", "game of numbers"])
+    checkContents(query.topK(5, near=("start", 3000)), ["the numbers game", "game of numbers"])
+    checkContents(query.topK(1, scorer=lambda f: -abs(f.distance), near=("start", 3000)), ["game of numbers"])
+    if minimalSpan([[1, 9], [4, 12], [10]])!=3:
+        raise ValueError, "bad minimal span "+repr(minimalSpan([[1, 9], [4, 12], [10]]))
+    print "topKTest ok"
+
+def matchFeaturesTest():
+    import Nucular
+    archive = rankedArchive()
+    query = archive.Query()
+    query.attributeWord("content", "numbers game")
+    # features of some ids are those of the whole result, sought or scanned
+    ids = query.evaluate()[0].identities()
+    whole = matchFeatures(query, ids, ("start", 3000))
+    for some in [ids[:1], ids]:
+        features = matchFeatures(query, some, ("start", 3000))
+        if [ repr(features[i]) for i in some ]!=[ repr(whole[i]) for i in some ]:
+            raise ValueError, "features of %s differ from the whole result: %s" % (some, features)
+    many = archive.Query()
+    many.attributeWord("content", "numbers")
+    many.timeWindow("start", 0, 1000)
+    count = archive.describeCount
+    features = matchFeatures(many, many.evaluate()[0].identities(), ("start", 500))
+    if [ f.distance for f in features.values() ]!=[-500]:
+        raise ValueError, "bad window distances "+repr(features)
+    if archive.describeCount!=count:
+        raise ValueError, "window keys described instead of scanned"
+    # a few ids among many entries are described instead
+    archive = Nucular.Nucular(None, memory=True)
+    archive.create()
+    for i in xrange(200):
+        archive.indexDictionary("d%03d" % i, {"content": "cue w%s" % (i%50), "start": i*1000})
+    archive.store()
+    query = archive.Query()
+    query.attributeWord("content", "w17")
+    count = archive.describeCount
+    features = matchFeatures(query, query.evaluate()[0].identities(), ("start", 100000))
+    distances = [ (i, features[i].distance) for i in features ]
+    distances.sort()
+    if distances!=[("d017", -83000), ("d067", -33000), ("d117", 17000), ("d167", 67000)]:
+        raise ValueError, "bad distances "+repr(distances)
+    if archive.describeCount!=count+4:
+        raise ValueError, "described %s entries" % (archive.describeCount-count)
+    print "matchFeaturesTest ok"
+
+def test():
+    topKTest()
+    matchFeaturesTest()
+    print "ranking test ok"
+
+if __name__=="__main__":
+    test()
@@ -0,0 +1,240 @@
+
+"""
+Term dictionary for word postings indices.
+
+A word index maps keys term+(id,) to values, where the term is
+(word,) or (attribute, word).  The term dictionary holds the distinct
+terms in sorted order with the cumulative number of postings, so prefix
+expansion and posting count estimates are bisections of a list in
+memory instead of descents through the layered archive.  The number of
+distinct ids (documents) is kept too, for query planning.  It is saved
+next to the index with a stamp (the index size when it was built) and
+ignored when the stamp does not match the index.
+"""
+
+import os
+import marshal
+from array import array
+from bisect import bisect_left
+
+TERMSMARK = "nucular term dictionary 2"
+
+class TermDictionary:
+    "sorted terms with cumulative posting counts"
+
+    def __init__(self, terms, ends, stamp=None, documents=None):
+        self.terms = terms # sorted list of term tuples
+        self.ends = ends # ends[i] is the number of postings for terms[0..i]
+        self.stamp = stamp
+        self.documents = documents # number of distinct ids with postings
+
+    def span(self, fromKey, toKey):
+        "(start, end) term positions for terms from fromKey (inclusive) to toKey (exclusive)"
+        terms = self.terms
+        return (bisect_left(terms, fromKey), bisect_left(terms, toKey))
+
+    def postingsBefore(self, position):
+        if position<1:
+            return 0
+        return self.ends[position-1]
+
+    def count(self, fromKey, toKey):
+        "number of postings for terms from fromKey to toKey"
+        (start, end) = self.span(fromKey, toKey)
+        return self.postingsBefore(end)-self.postingsBefore(start)
+
+    def expand(self, fromKey, toKey):
+        "terms from fromKey to toKey (eg, the words with a prefix)"
+        (start, end) = self.span(fromKey, toKey)
+        return self.terms[start:end]
+
+    def merge(self, changes, stamp=None):
+        """dictionary with a batch of changes {key: (deletedFirst, putLast)} applied,
+           or None if the batch does not fit the dictionary.  A key existed
+           before the batch if its first change deleted it and exists after
+           if its last change put it (entries are deleted with the keys they
+           were indexed with)."""
+        deltas = {}
+        ids = {}
+        for key in changes:
+            (deletedFirst, putLast) = changes[key]
+            delta = int(putLast)-int(deletedFirst)
+            if delta:
+                term = key[:-1]
+                deltas[term] = deltas.get(term, 0)+delta
+            identity = key[-1]
+            (before, after) = ids.get(identity, (False, False))
+            ids[identity] = (before or deletedFirst, after or putLast)
+        documents = self.documents
+        for (before, after) in ids.values():
+            documents += int(after)-int(before)
+        if documents<0:
+            return None
+        oldTerms = self.terms
+        oldEnds = self.ends
+        nold = len(oldTerms)
+        added = []
+        for term in deltas:
+            position = bisect_left(oldTerms, term)
+            if position>=nold or oldTerms[position]!=term:
+                added.append(term)
+        added.sort()
+        nadded = len(added)
+        terms = []
+        ends = array('l')
+        total = 0
+        i = j = 0
+        while i<nold or j<nadded:
+            if j>=nadded or (i<nold and oldTerms[i]<added[j]):
+                term = oldTerms[i]
+                count = self.postingsBefore(i+1)-self.postingsBefore(i)
+                i += 1
+            else:
+                term = added[j]
+                count = 0
+                j += 1
+            count += deltas.get(term, 0)
+            if count<0:
+                return None
+            if count:
+                total += count
+                terms.append(term)
+                ends.append(total)
+        return TermDictionary(terms, ends, stamp, documents)
+
+    def save(self, filename):
+        "save to filename (atomically)"
+        tempname = filename+".tmp"
+        f = open(tempname, "wb")
+        try:
+            marshal.dump( (TERMSMARK, self.stamp, self.terms, self.ends.tostring(), self.documents), f )
+        finally:
+            f.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tempname, filename)
+
+def fromIndex(index, stamp=None):
+    "build the term dictionary for all keys of index (a SessionMapping)"
+    terms = []
+    ends = array('l')
+    count = 0
+    last = None
+    ids = {}
+    for kv in index.KeyValueGenerator():
+        if kv is None:
+            break # sentinel
+        ids[kv[0][-1]] = 1
+        term = kv[0][:-1]
+        if term!=last:
+            if last is not None:
+                terms.append(last)
+                ends.append(count)
+            last = term
+        count += 1
+    if last is not None:
+        terms.append(last)
+        ends.append(count)
+    return TermDictionary(terms, ends, stamp, len(ids))
+
+def load(filename):
+    "load a saved term dictionary, or None if missing or damaged"
+    if not os.path.exists(filename):
+        return None
+    f = open(filename, "rb")
+    try:
+        try:
+            (mark, stamp, terms, endString, documents) = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+    if mark!=TERMSMARK:
+        return None
+    ends = array('l')
+    ends.fromstring(endString)
+    return TermDictionary(terms, ends, stamp, documents)
+
+def test(directory="/tmp/termDictionaryTest"):
+    import shutil
+    import Nucular
+    import idSet
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    words = ["alpha", "alphabet", "beta", "betamax", "gamma"]
+    archive = Nucular.Nucular(directory)
+    archive.create()
+    for i in xrange(50):
+        text = " ".join([ words[(i+j) % len(words)] for j in xrange(i % 3 + 1) ])
+        archive.indexDictionary("e%03d" % i, {"content": text})
+    archive.store(lazy=False)
+    archive = Nucular.Nucular(directory, readOnly=True)
+    terms = archive.WordIndex.termDictionary()
+    if terms is None:
+        raise ValueError, "term dictionary not stored"
+    if terms.documents!=50 or archive.entryCount()!=50:
+        raise ValueError, "bad document count "+repr(terms.documents)
+    index = archive.WordIndex.getExistingBaseIndex()
+    for prefix in ["al", "alpha", "alphabet", "b", "betamax", "gam", "x", ""]:
+        f = archive.WordFilter(prefix)
+        (keys, values) = index.rangeLists( (prefix,), f.query.beyondEndKey() )
+        expected = idSet.fromKeys(keys, -1)
+        if f.estimate()!=len(keys):
+            raise ValueError, "bad estimate for "+repr(prefix)
+        if f.evaluateD()!=expected:
+            raise ValueError, "bad evaluation for "+repr(prefix)
+    if terms.expand( ("alpha",), ("alphb",) )!=[ ("alpha",), ("alphabet",) ]:
+        raise ValueError, "bad expansion "+repr(terms.expand( ("alpha",), ("alphb",) ))
+    if archive.AttrWord.termDictionary() is None:
+        raise ValueError, "no attribute word term dictionary"
+    # a lazy update is not visible until aggregation: the old dictionary is ignored meanwhile
+    writer = Nucular.Nucular(directory)
+    writer.indexDictionary("e999", {"content": "delta"})
+    for i in xrange(100):
+        writer.indexDictionary("u%03d" % i, {"content": "epsilon%s" % i})
+    writer.store()
+    archive = Nucular.Nucular(directory, readOnly=True)
+    # without a valid dictionary entries are counted from the log keys
+    if archive.entryCount()!=50:
+        raise ValueError, "bad entry count "+repr(archive.entryCount())
+    if archive.WordIndex.termDictionary() is not None and archive.WordIndex.termDictionary().count( ("delta",), ("deltb",) ):
+        raise ValueError, "dictionary ahead of the index"
+    writer.aggregateRecent()
+    archive = Nucular.Nucular(directory, readOnly=True)
+    if archive.WordIndex.termDictionary() is None:
+        raise ValueError, "term dictionary stale after aggregation"
+    writer.moveTransientToBase()
+    archive = Nucular.Nucular(directory, readOnly=True)
+    for ind in (archive.WordIndex, archive.AttrWord):
+        if ind.termDictionary() is None:
+            raise ValueError, "term dictionary stale after moving to base: "+repr(ind)
+    if archive.WordIndex.termDictionary().count( ("delta",), ("deltb",) )!=1:
+        raise ValueError, "update missing from the term dictionary"
+    query = archive.Query()
+    query.anyWord("delta")
+    if query.resultDictionaries()!=[ {"i": "e999", "content": "delta"} ]:
+        raise ValueError, "update not found"
+    # a stored batch is merged into the dictionary instead of rescanning the index
+    writer = Nucular.Nucular(directory)
+    writer.remove("e000")
+    writer.remove("e001")
+    writer.indexDictionary("e001", {"content": "alphabet zeta"})
+    writer.indexDictionary("e050", {"content": "zeta omega"})
+    rebuilt = {}
+    for ind in (writer.WordIndex, writer.AttrWord):
+        if ind.termChanges is None:
+            raise ValueError, "batch not recorded for merging: "+repr(ind)
+        rebuilt[ind.name] = fromIndex(ind.getExistingBaseIndex())
+    writer.store(lazy=False)
+    for ind in (writer.WordIndex, writer.AttrWord):
+        terms = load(ind.termsFileName())
+        expected = rebuilt[ind.name]
+        if (terms.terms, list(terms.ends), terms.documents)!=(expected.terms, list(expected.ends), expected.documents):
+            raise ValueError, "merged term dictionary differs from a rebuild: "+repr(ind)
+    if terms.documents!=151:
+        raise ValueError, "bad document count after merge "+repr(terms.documents)
+    shutil.rmtree(directory)
+    print "termDictionary test ok"
+
+if __name__=="__main__":
+    test()
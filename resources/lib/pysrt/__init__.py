@@ -1,4 +1,5 @@
 from pysrt.srttime import SubRipTime
 from pysrt.srtitem import SubRipItem
 from pysrt.srtfile import SubRipFile
+from pysrt.srttable import CueTable
 from pysrt.srtexc import InvalidItem, InvalidTimeString
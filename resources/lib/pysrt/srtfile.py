@@ -12,6 +12,7 @@ except ImportError:
 
 from pysrt.srtexc import InvalidItem
 from pysrt.srtitem import SubRipItem
+from pysrt.srttime import SubRipTime
 
 
 class SubRipFile(UserList, object):
@@ -123,6 +124,112 @@ class SubRipFile(UserList, object):
         source_file.close()
         return new_file
 
+    @classmethod
+    def stream(cls, path='', encoding=None, error_handling=ERROR_PASS,
+               file_descriptor=None):
+        """
+        stream([path, [encoding]]) -> iterator of SubRipItem
+
+        Same parsing rules as open but items are yielded as soon as they
+        are read, without building a SubRipFile. The file is read with
+        readline in a single pass, so file_descriptor.tell() follows the
+        parsing progress.
+        """
+        if file_descriptor is None:
+            source_file = open(path, 'rb')
+        else:
+            source_file = file_descriptor
+
+        encoding = encoding or cls.detect_encoding(source_file)
+        if u'\n'.encode(encoding) == '\n':
+            readline = source_file.readline
+            decode = True
+        else:
+            # wide encodings (utf-16/32) can't be split on byte newlines
+            readline = codecs.getreader(encoding)(source_file).readline
+            decode = False
+
+        state = cls._EXPECT_INDEX
+        block = []
+        text = []
+        index = start = end = None
+        line_number = 0
+        while True:
+            line = readline()
+            at_end = not line
+            if decode:
+                line = line.decode(encoding)
+            line = line.replace(u'\r', u'')
+            line_number += 1
+            if not line.strip():
+                if state == cls._EXPECT_TEXT:
+                    yield SubRipItem(index, SubRipTime.from_ordinal(start),
+                                     SubRipTime.from_ordinal(end),
+                                     u''.join(text))
+                elif state != cls._EXPECT_INDEX:
+                    cls._handle_error(InvalidItem(u''.join(block)),
+                                      error_handling, path, line_number)
+                if at_end:
+                    break
+                state = cls._EXPECT_INDEX
+                del block[:]
+                del text[:]
+                continue
+            block.append(line)
+            if state == cls._EXPECT_INDEX:
+                index = line.strip()
+                if index.isdigit():
+                    state = cls._EXPECT_TIMING
+                else:
+                    state = cls._INVALID
+            elif state == cls._EXPECT_TIMING:
+                timing = cls._parse_timing(line)
+                if timing is None:
+                    state = cls._INVALID
+                else:
+                    start, end = timing
+                    state = cls._EXPECT_TEXT
+            elif state == cls._EXPECT_TEXT:
+                text.append(line)
+
+        if file_descriptor is None:
+            source_file.close()
+
+    _EXPECT_INDEX, _EXPECT_TIMING, _EXPECT_TEXT, _INVALID = range(4)
+
+    @classmethod
+    def _parse_timing(cls, line):
+        """
+        u'HH:MM:SS,mmm --> HH:MM:SS,mmm' -> (start, end) ordinals or None
+        """
+        parts = line.split(u'-->', 1)
+        if len(parts) != 2:
+            return None
+        end = parts[1].split()
+        if not end:
+            return None
+        start = cls._parse_ordinal(parts[0].strip())
+        end = cls._parse_ordinal(end[0])
+        if start is None or end is None:
+            return None
+        return start, end
+
+    @staticmethod
+    def _parse_ordinal(source):
+        """
+        u'HH:MM:SS,mmm' -> milliseconds or None, without the time regex
+        """
+        if len(source) != 12 or source[2] != u':' or source[5] != u':' \
+                or source[8] not in u',.':
+            return None
+        try:
+            return int(source[0:2]) * SubRipTime.HOURS_RATIO \
+                 + int(source[3:5]) * SubRipTime.MINUTES_RATIO \
+                 + int(source[6:8]) * SubRipTime.SECONDS_RATIO \
+                 + int(source[9:12])
+        except ValueError:
+            return None
+
     @staticmethod
     def _extract_newline(file_descriptor):
         if hasattr(file_descriptor, 'newlines') and file_descriptor.newlines:
@@ -139,17 +246,23 @@ class SubRipFile(UserList, object):
     def slice(self, starts_before=None, starts_after=None, ends_before=None,
               ends_after=None):
         clone = copy(self)
+        data = self.data
 
+        # compare plain ordinals rather than SubRipTime objects
         if starts_before:
-            clone.data = (i for i in clone.data if i.start < starts_before)
+            ordinal = SubRipTime._coerce(starts_before).ordinal
+            data = [i for i in data if i.start.ordinal < ordinal]
         if starts_after:
-            clone.data = (i for i in clone.data if i.start > starts_after)
+            ordinal = SubRipTime._coerce(starts_after).ordinal
+            data = [i for i in data if i.start.ordinal > ordinal]
         if ends_before:
-            clone.data = (i for i in clone.data if i.end < ends_before)
+            ordinal = SubRipTime._coerce(ends_before).ordinal
+            data = [i for i in data if i.end.ordinal < ordinal]
         if ends_after:
-            clone.data = (i for i in clone.data if i.end > ends_after)
+            ordinal = SubRipTime._coerce(ends_after).ordinal
+            data = [i for i in data if i.end.ordinal > ordinal]
 
-        clone.data = list(clone.data)
+        clone.data = list(data)
         return clone
 
     def shift(self, *args, **kwargs):
@@ -166,8 +279,13 @@ class SubRipFile(UserList, object):
         Example to delay all subs from 2 seconds and half
         >>> subs.shift(seconds=2, milliseconds=500)
         """
+        ratio = kwargs.pop('ratio', None)
+        offset = SubRipTime(*args, **kwargs).ordinal
         for item in self:
-            item.shift(*args, **kwargs)
+            for time in (item.start, item.end):
+                if ratio is not None:
+                    time.ordinal = int(round(time.ordinal * ratio))
+                time.ordinal += offset
 
     def clean_indexes(self):
         self.sort()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Compact array-backed table of subtitle cues
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+from pysrt.srtitem import SubRipItem
+from pysrt.srttime import SubRipTime
+
+
+class CueTable(object):
+    """
+    CueTable(starts, ends, texts, indexes)
+
+    Cues of a subtitle file kept sorted by start time, with start and end
+    times as arrays of milliseconds and texts in a single list.
+
+    starts, ends -> iterables of int milliseconds.
+    texts -> list of unicode texts.
+    indexes -> iterable of int item indexes. Default to 1..n.
+    """
+    TYPECODE = 'l'
+
+    def __init__(self, starts=None, ends=None, texts=None, indexes=None):
+        starts = list(starts or [])
+        ends = list(ends or [])
+        texts = list(texts or [])
+        if indexes is None:
+            indexes = range(1, len(starts) + 1)
+        else:
+            indexes = list(indexes)
+        if not len(starts) == len(ends) == len(texts) == len(indexes):
+            raise ValueError('starts, ends, texts and indexes differ in length')
+        order = range(len(starts))
+        if not self._is_sorted(starts):
+            decorated = [(starts[i], ends[i], i) for i in order]
+            decorated.sort()
+            order = [i for (start, end, i) in decorated]
+        self.starts = array(self.TYPECODE, [starts[i] for i in order])
+        self.ends = array(self.TYPECODE, [ends[i] for i in order])
+        self.texts = [texts[i] for i in order]
+        self.indexes = array(self.TYPECODE, [indexes[i] for i in order])
+        self._ends_sorted = self._is_sorted(self.ends)
+
+    @staticmethod
+    def _is_sorted(values):
+        for i in xrange(1, len(values)):
+            if values[i - 1] > values[i]:
+                return False
+        return True
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        iterable of SubRipItem -> CueTable
+        """
+        starts = []
+        ends = []
+        texts = []
+        indexes = []
+        for item in items:
+            starts.append(item.start.ordinal)
+            ends.append(item.end.ordinal)
+            texts.append(item.text)
+            indexes.append(item.index)
+        return cls(starts, ends, texts, indexes)
+
+    @classmethod
+    def open(cls, path='', encoding=None, **kwargs):
+        """
+        open([path, [encoding]])
+
+        Build a table from SubRipFile.stream without a SubRipFile in between.
+        """
+        from pysrt.srtfile import SubRipFile
+        return cls.from_items(SubRipFile.stream(path, encoding, **kwargs))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, position):
+        return SubRipItem(self.indexes[position],
+                          SubRipTime.from_ordinal(self.starts[position]),
+                          SubRipTime.from_ordinal(self.ends[position]),
+                          self.texts[position])
+
+    def __iter__(self):
+        for position in xrange(len(self)):
+            yield self[position]
+
+    def to_file(self, **kwargs):
+        """
+        Build a SubRipFile holding SubRipItems for all cues
+        """
+        from pysrt.srtfile import SubRipFile
+        return SubRipFile(list(self), **kwargs)
+
+    def _take(self, positions):
+        clone = self.__class__()
+        typecode = self.TYPECODE
+        clone.starts = array(typecode, [self.starts[i] for i in positions])
+        clone.ends = array(typecode, [self.ends[i] for i in positions])
+        clone.texts = [self.texts[i] for i in positions]
+        clone.indexes = array(typecode, [self.indexes[i] for i in positions])
+        # positions are increasing so sorted ends stay sorted
+        clone._ends_sorted = self._ends_sorted
+        return clone
+
+    def _span(self, low, high):
+        # contiguous positions: slice the arrays directly
+        clone = self.__class__()
+        clone.starts = self.starts[low:high]
+        clone.ends = self.ends[low:high]
+        clone.texts = self.texts[low:high]
+        clone.indexes = self.indexes[low:high]
+        clone._ends_sorted = self._ends_sorted
+        return clone
+
+    def at(self, time):
+        """
+        Position of the cue displayed at `time` or None.
+        If cues overlap the one starting last wins.
+        """
+        ordinal = SubRipTime._coerce(time).ordinal
+        position = bisect_right(self.starts, ordinal) - 1
+        ends = self.ends
+        if self._ends_sorted:
+            # earlier cues end before the last one started
+            if position >= 0 and ends[position] > ordinal:
+                return position
+            return None
+        while position >= 0:
+            if ends[position] > ordinal:
+                return position
+            position -= 1
+        return None
+
+    def find(self, time):
+        """
+        Position of the first cue starting at or after `time`
+        (len(self) if none).
+        """
+        return bisect_left(self.starts, SubRipTime._coerce(time).ordinal)
+
+    def slice(self, starts_before=None, starts_after=None, ends_before=None,
+              ends_after=None):
+        """
+        Same filters as SubRipFile.slice, returns a new CueTable.
+        Start filters are bisections; end filters are too when end times
+        are in order, which is usually the case.
+        """
+        low, high = 0, len(self)
+        if starts_before:
+            high = bisect_left(self.starts, SubRipTime._coerce(starts_before).ordinal)
+        if starts_after:
+            low = bisect_right(self.starts, SubRipTime._coerce(starts_after).ordinal)
+        if not (ends_before or ends_after):
+            return self._span(low, max(low, high))
+        ends = self.ends
+        if self._ends_sorted:
+            if ends_before:
+                high = min(high, bisect_left(ends, SubRipTime._coerce(ends_before).ordinal))
+            if ends_after:
+                low = max(low, bisect_right(ends, SubRipTime._coerce(ends_after).ordinal))
+            return self._span(low, max(low, high))
+        positions = xrange(low, max(low, high))
+        if ends_before:
+            ordinal = SubRipTime._coerce(ends_before).ordinal
+            positions = [i for i in positions if ends[i] < ordinal]
+        if ends_after:
+            ordinal = SubRipTime._coerce(ends_after).ordinal
+            positions = [i for i in positions if ends[i] > ordinal]
+        return self._take(positions)
+
+    def shift(self, *args, **kwargs):
+        """shift(hours, minutes, seconds, milliseconds, ratio)
+
+        Same as SubRipFile.shift, applied to the whole start and end arrays.
+        """
+        typecode = self.TYPECODE
+        if 'ratio' in kwargs:
+            ratio = kwargs.pop('ratio')
+            self.starts = array(typecode, [int(round(t * ratio)) for t in self.starts])
+            self.ends = array(typecode, [int(round(t * ratio)) for t in self.ends])
+        offset = SubRipTime(*args, **kwargs).ordinal
+        if offset:
+            self.starts = array(typecode, [t + offset for t in self.starts])
+            self.ends = array(typecode, [t + offset for t in self.ends])
+
+
+def test(path='/tmp/srttabletest.srt'):
+    from pysrt.srtfile import SubRipFile
+    source = open(path, 'wb')
+    # cue 3 overlaps cue 4 and ends after it: end times are out of order
+    for (index, start, end, text) in [(1, 1000, 2000, 'one'),
+                                      (2, 2000, 3500, 'two\nlines'),
+                                      (3, 4000, 9000, 'long'),
+                                      (4, 5000, 6000, 'inside'),
+                                      (5, 9000, 10000, 'caf\xe9')]:
+        source.write('%s\r\n%s --> %s\r\n%s\r\n\r\n' % (index,
+            SubRipTime.from_ordinal(start), SubRipTime.from_ordinal(end),
+            text.replace('\n', '\r\n')))
+    source.close()
+    opened = SubRipFile.open(path, encoding='iso-8859-1')
+    streamed = list(SubRipFile.stream(path, encoding='iso-8859-1'))
+    def rows(items):
+        return [(item.index, item.start.ordinal, item.end.ordinal, item.text)
+                for item in items]
+    assert rows(streamed) == rows(opened), (rows(streamed), rows(opened))
+    assert rows(streamed)[4] == (5, 9000, 10000, u'caf\xe9\n')
+    table = CueTable.open(path, encoding='iso-8859-1')
+    assert rows(table) == rows(opened)
+    assert not table._ends_sorted
+    # cues start inclusive and end exclusive
+    for (time, expected) in [(999, None), (1000, 0), (1999, 0), (2000, 1),
+                             (3500, None), (4000, 2), (5000, 3), (6000, 2),
+                             (9000, 4), (10000, None)]:
+        assert table.at(time) == expected, (time, table.at(time))
+    for (time, expected) in [(0, 0), (1000, 0), (1001, 1), (9000, 4), (9001, 5)]:
+        assert table.find(time) == expected, (time, table.find(time))
+    # slices agree with SubRipFile.slice, with the ends in order or not
+    sorted_table = CueTable([1000, 2000, 4000], [2000, 3500, 9000], [u'a', u'b', u'c'])
+    assert sorted_table._ends_sorted
+    assert [sorted_table.at(t) for t in (999, 1999, 2000, 3500, 8999)] == [None, 0, 1, None, 2]
+    sorted_file = sorted_table.to_file()
+    for kwargs in [{}, {'starts_after': 1000}, {'starts_before': 5000},
+                   {'ends_before': 9000}, {'ends_after': 3500},
+                   {'starts_after': 1000, 'ends_before': 9500},
+                   {'starts_before': 9000, 'ends_after': 2000}]:
+        for (cues, items) in [(table, opened), (sorted_table, sorted_file)]:
+            sliced = cues.slice(**kwargs)
+            assert rows(sliced) == rows(items.slice(**kwargs)), (kwargs, rows(sliced))
+    # shifts agree with SubRipFile.shift
+    for (args, kwargs) in [((), {'seconds': 2, 'milliseconds': 500}),
+                           ((0, 0, -1), {}), ((), {'ratio': 25 / 23.9})]:
+        table.shift(*args, **kwargs)
+        opened.shift(*args, **kwargs)
+        assert rows(table) == rows(opened), (args, kwargs, rows(table))
+    import os
+    os.remove(path)
+    print 'srttable test ok'
+
+
+if __name__ == '__main__':
+    test()
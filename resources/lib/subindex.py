@@ -0,0 +1,502 @@
+
+"""
+Subtitle index build pipeline shared by the GUI and the pre-indexer.
+
+The build runs without any dialogs: progress is reported to an optional
+callback and, for background builds, to a status file in the cache root
+which the GUI polls until the archive is ready.
+"""
+
+import os
+import time
+import math
+import marshal
+import threading
+
+import indexcache
+from pysrt import SubRipFile
+from nucular import entry
+
+CACHEROOT = os.path.join("special://temp", "subseek-cache")
+INDEXVERSION = 7 # bump when the indexed dictionaries change
+MEMORYLIMIT = 2*1024*1024 # subtitle files up to this size get an in memory snapshot archive
+MAXRESULTS = 50 # cues listed for a search
+HITFIELDS = ("content", "start") # cue attributes the GUI lists
+FUZZYEDITS = 1 # typos allowed per word when nothing matches exactly
+STATUSFILE = "status.dat"
+TRACEFILE = "queries.trace" # query profiles (one JSON object per line) when tracing is enabled
+STATUSSTALE = 120 # seconds without a status update before a build is presumed dead
+
+BUILDING = "building"
+DONE = "done"
+FAILED = "failed"
+
+def subtitleFile():
+    "path of the subtitle file loaded in the player, or None"
+    import xbmc
+    player = xbmc.Player()
+    subtitles = player.getSubtitles()
+    if not subtitles:
+        return None
+    filename = os.path.join(os.path.split(player.getPlayingFile())[0], subtitles)
+    if not os.path.exists(filename):
+        filename = os.path.join("special://temp", subtitles)
+    return filename
+
+def openCache(root=CACHEROOT):
+    "the archive cache for the current index format"
+    return indexcache.IndexCache(root, version=INDEXVERSION)
+
+def cueDictionary(sub):
+    "index dictionary for a SubRipItem: start and end in milliseconds"
+    return {   "content": sub.text.replace("\n", " ").replace("<i>", "[I]").replace("</i>", "[/I]"),
+               "start": sub.start.ordinal,
+               "end": sub.end.ordinal }
+
+def cueIdentity(sub):
+    "identity for a SubRipItem which sorts in cue time order: zero padded start ms and cue index"
+    return "%010d.%06d" % (sub.start.ordinal, sub.index)
+
+def formatTime(milliseconds):
+    "H:MM:SS display string for a time in milliseconds"
+    seconds = milliseconds/1000
+    return "%d:%02d:%02d" % (seconds/3600, (seconds/60)%60, seconds%60)
+
+def search(archive, text, window=None, near=None, limit=MAXRESULTS, fields=None):
+    """dictionaries for the best limit cues containing text, best first,
+       optionally only those starting in window=(lowMs, highMs) inclusive;
+       if near is given (in milliseconds) closer cues rank higher.
+       fields if given lists the cue attributes wanted (eg, HITFIELDS).
+       If no cue matches, cues with the words of text in the same order,
+       each within FUZZYEDITS typos, are returned instead, marked with
+       hit["approximate"] = True.
+       A phrase of only short (unindexed) words finds nothing."""
+    if near is not None:
+        near = ("start", near)
+    query = archive.Query()
+    # several words are searched as a phrase
+    query.attributePhrase("content", text)
+    if not query.indexed():
+        return [] # only short words, which match any word
+    restrictWindow(query, window)
+    hits = query.topK(limit, near=near, fields=fields)
+    if hits:
+        return hits
+    query = archive.Query()
+    query.fuzzyPhrase("content", text, FUZZYEDITS)
+    restrictWindow(query, window)
+    hits = query.topK(limit, near=near, fields=fields)
+    for hit in hits:
+        hit["approximate"] = True
+    return hits
+
+def restrictWindow(query, window):
+    if window is not None:
+        (low, high) = window
+        query.timeWindow("start", low, high)
+
+def searchWindow(position, minutes):
+    "(lowMs, highMs) window of minutes either side of position in seconds, or None"
+    if minutes<=0:
+        return None
+    centre = int(position*1000)
+    radius = int(minutes*60*1000)
+    return (max(0, centre-radius), centre+radius)
+
+def build(cache, filename, progress=None, fingerprint=None):
+    """open the cached archive for filename, building it first if needed;
+       progress(percent, message) is called during a build.  fingerprint
+       is the (signature, digest) of filename if already known."""
+    if progress is None:
+        progress = ignoreProgress
+    if fingerprint is None:
+        fingerprint = cache.fingerprint(filename)
+    (signature, digest) = fingerprint
+    if cache.has(digest):
+        return cache.open(digest)
+    progress(0, "Populating Database...")
+    size = max(os.path.getsize(filename), 1)
+    memory = size<=MEMORYLIMIT
+    source = open(filename, "rb")
+    def cuePairs():
+        # parse while indexing: progress is the position in the file
+        for sub in SubRipFile.stream(filename, encoding='iso-8859-1', file_descriptor=source):
+            progress(int(math.floor(100*source.tell()/size)), None)
+            yield (cueIdentity(sub), cueDictionary(sub))
+    def populate(archive):
+        archive.positionalIndexing()
+        archive.trigramIndexing()
+        # accented words are found without the accents
+        archive.useTokenizer(entry.Tokenizer())
+        # the archive is fresh: load all cues straight into the base layer
+        archive.indexBatch(cuePairs(), fresh=True)
+        progress(100, "Storing Database...")
+    try:
+        return cache.build(digest, signature, filename, populate, memory)
+    finally:
+        source.close()
+
+def ignoreProgress(percent, message):
+    pass
+
+def readStatus(root=CACHEROOT):
+    "status dictionary {digest, state, progress, message, time} or None"
+    path = os.path.join(root, STATUSFILE)
+    if not os.path.exists(path):
+        return None
+    f = open(path, "rb")
+    try:
+        try:
+            return marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+
+def writeStatus(root, status):
+    path = os.path.join(root, STATUSFILE)
+    tempPath = path+".tmp"
+    f = open(tempPath, "wb")
+    try:
+        marshal.dump(status, f)
+    finally:
+        f.close()
+    try:
+        os.rename(tempPath, path)
+    except OSError:
+        # windows won't rename over an existing file
+        os.remove(path)
+        os.rename(tempPath, path)
+
+def buildingStatus(digest, root=CACHEROOT):
+    "the status of a live background build of digest, or None"
+    status = readStatus(root)
+    if status is None or status.get("digest")!=digest or status.get("state")!=BUILDING:
+        return None
+    if time.time()-status.get("time", 0)>STATUSSTALE:
+        return None
+    return status
+
+class PreIndexer(threading.Thread):
+    """build the archive for a subtitle file in a worker thread, reporting to the status file"""
+
+    def __init__(self, filename, root=CACHEROOT):
+        threading.Thread.__init__(self)
+        self.filename = filename
+        self.root = root
+        self.digest = None
+        self.lastPercent = None
+        self.message = ""
+        self.error = None
+
+    def status(self, state, percent):
+        writeStatus(self.root, {
+            "digest": self.digest,
+            "state": state,
+            "progress": percent,
+            "message": self.message,
+            "time": time.time(),
+            })
+
+    def progress(self, percent, message):
+        # only touch the file when something visible changes
+        if message is None and percent==self.lastPercent:
+            return
+        if message is not None:
+            self.message = message
+        self.lastPercent = percent
+        self.status(BUILDING, percent)
+
+    def run(self):
+        cache = openCache(self.root)
+        try:
+            fingerprint = cache.fingerprint(self.filename)
+            self.digest = fingerprint[1]
+            if not cache.has(self.digest):
+                build(cache, self.filename, self.progress, fingerprint)
+            self.message = "Ready"
+            self.status(DONE, 100)
+        except Exception, e:
+            self.error = e
+            self.message = str(e)
+            self.status(FAILED, self.lastPercent)
+            import xbmc
+            xbmc.log("SubSeek: pre-indexing failed: "+str(e), xbmc.LOGERROR)
+
+def startPreIndexer(filename, root=CACHEROOT):
+    "start building the archive for filename in a worker thread; returns the PreIndexer or None"
+    import xbmc
+    if filename is None or not os.path.exists(filename) or not filename.endswith(".srt"):
+        xbmc.log("SubSeek: no .srt subtitle to pre-index", xbmc.LOGDEBUG)
+        return None
+    xbmc.log("SubSeek: pre-indexing "+filename, xbmc.LOGDEBUG)
+    worker = PreIndexer(filename, root)
+    worker.start()
+    return worker
+
+def preindex(root=CACHEROOT, timeout=30, poll=500):
+    """wait up to timeout seconds for the player to load a subtitle, then start
+       building its archive in a worker thread; returns the PreIndexer or None
+       (join it to wait for the build)"""
+    import xbmc
+    waited = 0
+    filename = None
+    while waited<timeout*1000:
+        if xbmc.Player().isPlaying():
+            filename = subtitleFile()
+            if filename is not None:
+                break
+        xbmc.sleep(poll)
+        waited += poll
+    return startPreIndexer(filename, root)
+
+def service(root=CACHEROOT, poll=1000):
+    """run until XBMC shuts down, pre-indexing the subtitle of each file played;
+       returns the PreIndexers started"""
+    import xbmc
+    workers = []
+    last = None
+    while not xbmc.abortRequested:
+        filename = None
+        if xbmc.Player().isPlaying():
+            filename = subtitleFile()
+        if filename is not None and filename!=last:
+            worker = startPreIndexer(filename, root)
+            if worker is not None:
+                workers.append(worker)
+        last = filename
+        xbmc.sleep(poll)
+    return workers
+
+def writeSubtitles(srt):
+    "200 cues, one a second: 'line number i of the movie' (cue 42 has an accented word)"
+    f = open(srt, "w")
+    for i in range(200):
+        place = "movie"
+        if i==42:
+            place = "caf\xe9 movie" # iso-8859-1
+        f.write("%s\n00:%02d:%02d,000 --> 00:%02d:%02d,500\nline number %s of the %s\n\n"
+                % (i+1, i/60, i%60, i/60, i%60, i, place))
+    f.close()
+
+def stubXbmc(movie):
+    "stub xbmc module: a player that is playing movie with movie.srt loaded"
+    import new
+    class Player:
+        def isPlaying(self):
+            return True
+        def getPlayingFile(self):
+            return movie
+        def getSubtitles(self):
+            return "movie.srt"
+    xbmc = new.module("xbmc")
+    xbmc.Player = Player
+    xbmc.LOGDEBUG = 0
+    xbmc.LOGERROR = 4
+    xbmc.log = lambda message, level=0: None
+    xbmc.sleep = lambda ms: None
+    xbmc.abortRequested = False
+    return xbmc
+
+def checkStarts(hits, expected):
+    starts = [ hit["start"] for hit in hits ]
+    if starts!=expected:
+        raise ValueError, "expected starts %s, got %s" % (expected, starts)
+
+def preindexTest(cacheRoot, srt):
+    "the service builds the archive in the background, the GUI opens it; returns (digest, archive)"
+    if subtitleFile()!=srt:
+        raise ValueError, "bad subtitle file "+repr(subtitleFile())
+    worker = preindex(cacheRoot)
+    worker.join()
+    if worker.error is not None:
+        raise ValueError, "pre-indexing failed: "+repr(worker.error)
+    status = readStatus(cacheRoot)
+    print "status", status
+    if status["state"]!=DONE or status["digest"]!=worker.digest:
+        raise ValueError, "bad status "+repr(status)
+    if buildingStatus(worker.digest, cacheRoot) is not None:
+        raise ValueError, "still building "+repr(buildingStatus(worker.digest, cacheRoot))
+    # the GUI then opens the built archive without rebuilding
+    cache = openCache(cacheRoot)
+    if not cache.has(worker.digest) or not os.path.isfile(cache.directory(worker.digest)):
+        raise ValueError, "built archive not cached"
+    archive = build(cache, srt)
+    hits = search(archive, "number 150")
+    if len(hits)!=1 or hits[0]["start"]!=150000 or hits[0]["end"]!=150500:
+        raise ValueError, "bad hits "+repr(hits)
+    if formatTime(hits[0]["start"])!="0:02:30":
+        raise ValueError, "bad time "+repr(formatTime(hits[0]["start"]))
+    return (worker.digest, archive)
+
+def windowTest(archive):
+    checkStarts(search(archive, "movie", (10000, 12000)), [10000, 11000, 12000])
+    window = searchWindow(100.2, 0.05)
+    if window!=(97200, 103200):
+        raise ValueError, "bad window "+repr(window)
+    if searchWindow(100.2, 0) is not None:
+        raise ValueError, "window for 0 minutes"
+    print "windowTest ok"
+
+def rankingTest(archive):
+    # closer cues first
+    window = searchWindow(100.2, 0.05)
+    checkStarts(search(archive, "movie", window, near=100200), [100000, 101000, 99000, 102000, 98000, 103000])
+    hits = search(archive, "movie", near=150000, limit=3)
+    checkStarts(hits, [150000, 149000, 151000])
+    # identities sort by time: equal scores come out in time order
+    if hits[0]["i"]!="0000150000.000151":
+        raise ValueError, "bad identity "+repr(hits[0]["i"])
+    print "rankingTest ok"
+
+def phraseTest(archive):
+    checkStarts(search(archive, "number 150 of"), [150000])
+    if search(archive, "150000")!=[]:
+        raise ValueError, "found a number in no cue"
+    # a phrase of short words is not searched, in a window or not
+    if search(archive, "5 of")!=[] or search(archive, "5 of", (0, 10000))!=[]:
+        raise ValueError, "searched a phrase of short words"
+    print "phraseTest ok"
+
+def describeTest(archive, srt):
+    # batched descriptions match single ones, for close and for scattered ids
+    ids = [ cueIdentity(sub) for sub in SubRipFile.open(srt, encoding='iso-8859-1') ]
+    for some in [ids[10:30], ids[::40], ids[5:6], ids]:
+        many = [ e.asDictionary() for e in archive.describeMany(some) ]
+        if many!=[ archive.describe(i).asDictionary() for i in some ]:
+            raise ValueError, "batched descriptions differ for "+repr(some)
+    # only the wanted fields are fetched
+    starts = [ e.asDictionary() for e in archive.describeMany(ids[:2], ["start"]) ]
+    if starts!=[ {"i": ids[0], "start": 0}, {"i": ids[1], "start": 1000} ]:
+        raise ValueError, "bad projection "+repr(starts)
+    hits = search(archive, "number 150", fields=HITFIELDS)
+    if hits!=[ {"i": ids[150], "content": "line number 150 of the movie ", "start": 150000} ]:
+        raise ValueError, "bad hit fields "+repr(hits)
+    print "describeTest ok"
+
+def cacheTest(archive):
+    # repeated searches reuse the evaluated query
+    cache = archive.resultCache
+    (hits, misses) = (cache.hits, cache.misses)
+    first = search(archive, "movie", (20000, 22000))
+    if search(archive, "movie", (20000, 22000))!=first:
+        raise ValueError, "cached search differs"
+    if (cache.hits, cache.misses)!=(hits+1, misses+1):
+        raise ValueError, "bad cache counts "+repr((cache.hits, cache.misses))
+    print "cacheTest ok"
+
+def planTest(archive, root):
+    # the planner seeks the few phrase matches in the window postings
+    query = archive.Query()
+    query.attributePhrase("content", "number 150")
+    restrictWindow(query, (0, 300000))
+    plan = query.explain()
+    if [ (step["method"], step["size"]) for step in plan ]!=[("scan", 1), ("seek", 1)]:
+        raise ValueError, "bad plan "+repr(plan)
+    profile = query.profile
+    if profile.steps is not plan or profile.size!=1 or profile.describes!=0:
+        raise ValueError, "bad profile "+repr(profile)
+    # traced searches append their profiles to the trace file
+    trace = os.path.join(root, TRACEFILE)
+    archive.traceQueries(trace)
+    search(archive, "number 150")
+    archive.traceQueries(None)
+    search(archive, "number 150")
+    lines = open(trace).readlines()
+    if len(lines)!=1 or not lines[0].startswith('{"cacheHit": '):
+        raise ValueError, "bad trace "+repr(lines)
+    print "planTest ok"
+
+def accentTest(archive):
+    # accents are folded away in the archive and in queries
+    for text in ["cafe", u"caf\xe9 MOVIE"]:
+        checkStarts(search(archive, text), [42000])
+    print "accentTest ok"
+
+def fuzzyTest(archive, root):
+    # no cue has the phrase, nor the words in that order with typos
+    if search(archive, "movie number")!=[]:
+        raise ValueError, "words out of order matched"
+    hits = search(archive, "nmber 150")
+    # the exact "150" ranks before near misses like "151"
+    checkStarts(hits, [ i*1000 for i in range(150, 160) ])
+    if [ hit for hit in hits if not hit.get("approximate") ]:
+        raise ValueError, "fuzzy hits not marked approximate "+repr(hits)
+    if [ hit for hit in search(archive, "number 150") if hit.get("approximate") ]:
+        raise ValueError, "exact hits marked approximate"
+    checkStarts(search(archive, "muvie", (10000, 12000)), [10000, 11000, 12000])
+    # the trigram index is only created for archives indexing trigrams
+    from nucular import Nucular
+    plain = Nucular.Nucular(os.path.join(root, "plain"))
+    plain.create()
+    if plain.Trigram.exists():
+        raise ValueError, "trigram index created without trigram indexing"
+    plain.trigramIndexing()
+    if not plain.Trigram.exists():
+        raise ValueError, "trigram index not created"
+    print "fuzzyTest ok"
+
+def incrementalTest(archive):
+    # search as you type: later prefixes are narrowed from the first scan
+    # ("1" and "15" are too short to be indexed, "150" needs a scan)
+    session = archive.incrementalSession()
+    for typed in ["nu", "num", "numb", "number", "number 1", "number 15", "number 150"]:
+        now = time.time()
+        hits = search(session, typed)
+        print "typed", repr(typed), len(hits), "hits", time.time()-now
+    checkStarts(hits, [150000])
+    scans = session.AttrWord.getExistingBaseIndex().scans
+    if scans!=2:
+        raise ValueError, "bad scan count "+repr(scans)
+    print "incrementalTest ok"
+
+def serviceTest(xbmc, cacheRoot, digest):
+    # the service pre-indexes each subtitle once while it plays, without waiting for the build
+    sleeps = []
+    def sleep(ms):
+        sleeps.append(ms)
+        xbmc.abortRequested = len(sleeps)>=3
+    xbmc.sleep = sleep
+    workers = service(cacheRoot)
+    if len(workers)!=1 or len(sleeps)!=3:
+        raise ValueError, "bad service run "+repr((workers, sleeps))
+    workers[0].join()
+    if workers[0].error is not None or workers[0].digest!=digest:
+        raise ValueError, "bad service build "+repr(workers[0].error)
+    print "serviceTest ok"
+
+def test(root="/tmp/subindextest"):
+    import sys
+    import shutil
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+    movie = os.path.join(root, "movie.avi")
+    srt = os.path.join(root, "movie.srt")
+    writeSubtitles(srt)
+    xbmc = stubXbmc(movie)
+    saved = sys.modules.get("xbmc")
+    sys.modules["xbmc"] = xbmc
+    try:
+        cacheRoot = os.path.join(root, "cache")
+        (digest, archive) = preindexTest(cacheRoot, srt)
+        windowTest(archive)
+        rankingTest(archive)
+        phraseTest(archive)
+        describeTest(archive, srt)
+        cacheTest(archive)
+        planTest(archive, root)
+        accentTest(archive)
+        fuzzyTest(archive, root)
+        incrementalTest(archive)
+        serviceTest(xbmc, cacheRoot, digest)
+    finally:
+        if saved is None:
+            del sys.modules["xbmc"]
+        else:
+            sys.modules["xbmc"] = saved
+    shutil.rmtree(root)
+    print "subindex test ok"
+
+if __name__=="__main__":
+    test()